@@ -1,8 +1,15 @@
+import hashlib
+import mmap
+import struct
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 from inc_noesis import *
-from fmt_smon_pmm import load_pmm_data, pmm_check_signature, pmm_check_ciphered, as_deciphered
+from fmt_smon_pmm import load_pmm_data, pmm_check_signature, pmm_check_ciphered, decipher_stream, decipher_into
 from fmt_smon_plm import load_plm_animation
-from fmt_smon_joker import load_joker, is_joker_chunk
-from inc_smon import peek_bytes
+import fmt_smon_joker
+from fmt_smon_joker import read_joker_images, is_joker_chunk, combine_joker_alpha
+from inc_smon import peek_bytes, read_view, MappedStream
 
 
 # ----------
@@ -27,6 +34,14 @@ def registerNoesisTypes():
     return 1
 
 
+# Decode the textures of a .dat file on multiple threads, where rapi.loadTexByHandler is known to be thread-safe.
+# The native Noesis decoders are not known to be, so inside Noesis the textures are always decoded one after another.
+DAT_PARALLEL_TEXTURES = 1
+
+# Enough threads for a diffuse and alpha image of each of the six elements
+DAT_TEXTURE_WORKERS = 12
+
+
 def dat_check_type(data):
     # Check type by skipping header chunk then checking PMM chunk signature
     if len(data) < 8:
@@ -50,40 +65,73 @@ def dat_check_type(data):
 
 def dat_load_model(data, models):
     noesis.logPopup()
-    bs = NoeBitStream(data)
+    return dat_load_index(DatIndex(data), NoeBitStream(data), models)
 
-    # ================================= Header data= ================================= #
 
-    header_size = bs.readUInt()
-    header = DatHeader(bs, header_size)
-    print("[DAT:Header] Embedded header name: {0}".format(header.name))
+def dat_load_file(filepath, models, vertex_counts=None):
+    """
+    Imports a .dat file through a memory map instead of reading the whole file.
+    Mesh buffers and encoded images are read as views over the map.
+    The map is copy-on-write, so a ciphered PMM chunk is deciphered in place without changing the file.
+    For the headless tools only, Noesis imports through dat_load_model, which reads from bytes.
+    :type filepath: str
+    :type models: list[NoeModel]
+    :type vertex_counts: list[int]
+    :param vertex_counts: Appended with the vertex count of the model, read from the PMM chunk.
+    :rtype: int
+    """
+    # Models keep copies of the data they use, so the map is closed once they are built
+    with DatIndex.from_file(filepath, writable=True) as index:
+        return dat_load_index(index, MappedStream(index.data), models, vertex_counts=vertex_counts)
 
-    # =================================== PMM data =================================== #
 
-    pmm_size = bs.readUInt()
-    # print("[DAT:PMM] File Position: {0}, Size: {1}".format(hex(bs.tell()), hex(pmm_size)))
+def dat_load_bundle(filepaths, models):
+    """
+    Imports several .dat files like dat_load_file, decoding identical PMM and PLM chunks only once.
+    :type filepaths: list[str]
+    :type models: list[NoeModel]
+    :rtype: BundleStats
+    """
+    with DatBundle() as bundle:
+        for filepath in filepaths:
+            bundle.load_file(filepath, models)
+    return bundle.stats
 
-    # PMM signature: chunk may be ciphered, decipher if necessary
-    pmm_header = peek_bytes(bs, 3)
 
-    if pmm_check_ciphered(pmm_header):
-        decipher_pmm(bs, pmm_size)
+def dat_load_index(index, bs, models, bundle=None, vertex_counts=None):
+    """
+    Imports the chunks located by the index.
+    :type index: DatIndex
+    :type bs: NoeBitStream | MappedStream
+    :param bs: Stream over the same data as the index.
+    :type models: list[NoeModel]
+    :type bundle: DatBundle
+    :param bundle: Shares the decoded PMM and PLM chunks with the other files of the bundle.
+    :type vertex_counts: list[int]
+    :param vertex_counts: Appended with the vertex count of the model, read from the PMM chunk.
+    :rtype: int
+    """
 
-    pmm_data = load_pmm_data(bs)
+    # ================================= Header data= ================================= #
 
-    # =================================== PLM data =================================== #
+    bs.seek(index.header.offset, NOESEEK_ABS)
+    header = DatHeader(bs, index.header.size)
+    print("[DAT:Header] Embedded header name: {0}".format(header.name))
 
-    bs.seek(header_size + 4 + pmm_size + 4, NOESEEK_ABS)
-    plm_size = bs.readInt()
+    # =============================== PMM and PLM data =============================== #
 
-    # print("[DAT:PLM] File Position: {0}, Size: {1}".format(hex(bs.tell()), hex(plm_size)))
-    bones, animations = load_plm_animation(bs, pmm_data.scale_divider)
+    if bundle is None:
+        pmm_data = dat_read_pmm(index, bs)
+        bs.seek(index.plm.offset, NOESEEK_ABS)
+        # print("[DAT:PLM] File Position: {0}, Size: {1}".format(hex(bs.tell()), hex(index.plm.size)))
+        bones, animations = load_plm_animation(bs, pmm_data.scale_divider)
+    else:
+        pmm_data = bundle.read_pmm(index, bs)
+        bones, animations = bundle.read_plm(index, bs, pmm_data.scale_divider)
 
     # ================================= Texture data ================================= #
 
-    bs.seek(header_size + 4 + pmm_size + 4 + plm_size + 4, NOESEEK_ABS)
-    # print("[DAT:Tex] File Position: {0}".format(hex(bs.tell())))
-    materials, textures = load_textures(bs, header, pmm_data)
+    materials, textures = load_textures(bs, header, pmm_data, index.textures)
 
     # ================================= Create model ================================= #
 
@@ -95,30 +143,210 @@ def dat_load_model(data, models):
     model.setModelMaterials(NoeModelMaterials(textures, materials))
 
     models.append(model)
+    if vertex_counts is not None:
+        vertex_counts.append(pmm_data.num_vertices)
     return 1
 
 
-def load_textures(bs, header, pmm_data):
+def dat_read_pmm(index, bs):
+    """
+    Deciphers the PMM chunk located by the index if needed, and reads it.
+    :type index: DatIndex
+    :type bs: NoeBitStream | MappedStream
+    :param bs: Stream over the same data as the index.
+    :rtype: PmmData
+    """
+    bs.seek(index.pmm.offset, NOESEEK_ABS)
+    # print("[DAT:PMM] File Position: {0}, Size: {1}".format(hex(bs.tell()), hex(index.pmm.size)))
+
+    # PMM signature: chunk may be ciphered, decipher if necessary
+    pmm_header = peek_bytes(bs, 3)
+
+    pmm_bs = bs
+    if pmm_check_ciphered(pmm_header):
+        if isinstance(bs, MappedStream) and not bs.writable:
+            # Decipher a single copy of the chunk, the file data is read-only
+            pmm_chunk = bytearray(index.slice(index.pmm))
+            decipher_into(pmm_chunk, 0, index.pmm.size)
+            pmm_bs = MappedStream(pmm_chunk)
+        else:
+            decipher_pmm(bs, index.pmm.size)
+
+    return load_pmm_data(pmm_bs)
+
+
+class BundleStats:
+    """
+    What a DatBundle decoded and what it shared.
+    :cvar files: Files loaded.
+    :cvar pmm_decoded: PMM chunks decoded.
+    :cvar pmm_shared: PMM chunks that were identical to an already decoded one.
+    :cvar plm_decoded: PLM chunks decoded.
+    :cvar plm_shared: PLM chunks that were identical to an already decoded one.
+    :cvar bytes_decoded: Size of the decoded PMM and PLM chunks.
+    :cvar bytes_shared: Size of the PMM and PLM chunks that were not decoded again.
+    :cvar seconds: Time spent loading.
+    """
+
+    def __init__(self):
+        self.files = 0
+        self.pmm_decoded = 0
+        self.pmm_shared = 0
+        self.plm_decoded = 0
+        self.plm_shared = 0
+        self.bytes_decoded = 0
+        self.bytes_shared = 0
+        self.seconds = 0.0
+
+    def __str__(self):
+        total = self.bytes_decoded + self.bytes_shared
+        return ("Files: {0} | PMM: {1} decoded, {2} shared | PLM: {3} decoded, {4} shared | "
+                "Shared: {5:.1%} of {6} bytes | {7:.2f}s").format(
+            self.files, self.pmm_decoded, self.pmm_shared, self.plm_decoded, self.plm_shared,
+            self.bytes_shared / total if total else 0.0, total, self.seconds)
+
+
+class DatBundle:
+    """
+    Loads a set of .dat files, such as the costumes and elemental variants of a monster, sharing the decoded
+    PMM and PLM chunks between files where the chunks are identical.
+    Chunks are identified by a hash of their data as stored, and PLM chunks also by the scale divider of the PMM chunk.
+    Models sharing a PLM chunk share the same bones and animations lists.
+    The plugin options are read when a chunk is first decoded, they should not change while the bundle is in use.
+    Decoded PMM chunks are views over the file they were read from, so the files stay mapped until finish.
+    Can be used as a context manager, which calls finish on exit.
+    :cvar stats: What was decoded and shared so far.
+    """
+
+    def __init__(self):
+        self.stats = BundleStats()
+        self._pmm = {}
+        self._plm = {}
+        self._indexes = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            self.finish()
+        except BufferError:
+            # The traceback still references slices of the file data, the maps are closed once they are released
+            if exc_type is None:
+                raise
+
+    def load_file(self, filepath, models):
+        """
+        Imports a .dat file like dat_load_file.
+        :type filepath: str
+        :type models: list[NoeModel]
+        :rtype: int
+        """
+        start = time.perf_counter()
+        index = DatIndex.from_file(filepath, writable=True)
+        self._indexes.append(index)
+        result = dat_load_index(index, MappedStream(index.data), models, self)
+        self.stats.files += 1
+        self.stats.seconds += time.perf_counter() - start
+        return result
+
+    def finish(self):
+        """
+        Releases the decoded chunks and closes the files. Loaded models keep the data they use.
+        A file still referenced elsewhere stays mapped until released, and raises BufferError once the others are closed.
+        :rtype: BundleStats
+        """
+        self._pmm.clear()
+        self._plm.clear()
+        error = None
+        for index in self._indexes:
+            try:
+                index.close()
+            except BufferError as e:
+                error = e
+        self._indexes.clear()
+        if error is not None:
+            raise error
+        return self.stats
+
+    def read_pmm(self, index, bs):
+        """
+        dat_read_pmm, decoded only once per distinct chunk.
+        :type index: DatIndex
+        :type bs: NoeBitStream | MappedStream
+        :rtype: PmmData
+        :return: PmmData sharing the decoded buffers, with its own list of materials.
+        """
+        # Hashed before deciphering, which changes the chunk in place
+        key = hashlib.sha1(index.slice(index.pmm)).digest()
+        pmm_data = self._pmm.get(key)
+        if pmm_data is None:
+            pmm_data = self._pmm[key] = dat_read_pmm(index, bs)
+            self.stats.pmm_decoded += 1
+            self.stats.bytes_decoded += index.pmm.size
+        else:
+            self.stats.pmm_shared += 1
+            self.stats.bytes_shared += index.pmm.size
+        return pmm_data.share_buffers()
+
+    def read_plm(self, index, bs, scale_divider):
+        """
+        load_plm_animation of the PLM chunk located by the index, decoded only once per distinct chunk.
+        :type index: DatIndex
+        :type bs: NoeBitStream | MappedStream
+        :type scale_divider: int
+        :param scale_divider: Value from PMM chunk.
+        :rtype: tuple[list[NoeBone], list[NoeKeyFramedAnim]]
+        """
+        key = (hashlib.sha1(index.slice(index.plm)).digest(), scale_divider)
+        result = self._plm.get(key)
+        if result is None:
+            bs.seek(index.plm.offset, NOESEEK_ABS)
+            result = self._plm[key] = load_plm_animation(bs, scale_divider)
+            self.stats.plm_decoded += 1
+            self.stats.bytes_decoded += index.plm.size
+        else:
+            self.stats.plm_shared += 1
+            self.stats.bytes_shared += index.plm.size
+        return result
+
+
+def load_textures(bs, header, pmm_data, texture_chunks, parallel=None, combine_alpha=None):
+    """
+    Loads the textures and materials of the texture chunks.
+    :type bs: NoeBitStream | MappedStream
+    :type header: DatHeader
+    :type pmm_data: PmmData
+    :type texture_chunks: list[DatChunk]
+    :type parallel: int
+    :param parallel: Whether to decode the images on multiple threads, see decode_images.
+    Defaults to DAT_PARALLEL_TEXTURES.
+    :type combine_alpha: int
+    :param combine_alpha: Whether to merge alpha images into the diffuse textures. Defaults to JOKER_COMBINE_ALPHA.
+    :rtype: tuple[list[NoeMaterial], list[NoeTexture]]
+    """
+    # Read every encoded image first, then decode them all at once
+    images = []
+    for diffuse_bytes, alpha_bytes, extension in read_texture_images(bs, texture_chunks):
+        images.append((diffuse_bytes, extension))
+        images.append((alpha_bytes, extension if alpha_bytes is not None else None))
+
+    parallel = DAT_PARALLEL_TEXTURES if parallel is None else parallel
+    decoded = decode_images(images, DAT_TEXTURE_WORKERS if parallel else 1)
+    if combine_alpha is None:
+        combine_alpha = fmt_smon_joker.JOKER_COMBINE_ALPHA
+
     textures = []
     materials = []
-    while not bs.checkEOF():
-        # Some models may have only one image (special_mdl_*.dat)
-        # And do not use a material_id system
-        multi_material = True
-        material_id = bs.readInt()
-        if material_id > 255:
-            multi_material = False
-            chunk_size = material_id
-            material_id = 0
-        else:
-            chunk_size = bs.readInt()
-        if chunk_size == 0:
-            continue
+    for i, chunk in enumerate(texture_chunks):
+        multi_material = chunk.material_id is not None
+        material_id = chunk.material_id if multi_material else 0
 
-        texture_name = header.name + ("_" + material_names[material_id] if multi_material else "")
+        texture_name = dat_texture_name(header, chunk)
 
-        diffuse_texture, alpha_texture = load_joker(bs) if is_joker_chunk(bs) else (
-            rapi.loadTexByHandler(bs.readBytes(chunk_size), ".png"), None)
+        diffuse_texture, alpha_texture = decoded[i * 2], decoded[i * 2 + 1]
+        if combine_alpha and alpha_texture is not None:
+            diffuse_texture, alpha_texture = combine_joker_alpha(diffuse_texture, alpha_texture), None
 
         diffuse_texture.name = texture_name + "_diffuse"
         textures.append(diffuse_texture)
@@ -128,7 +356,7 @@ def load_textures(bs, header, pmm_data):
             textures.append(alpha_texture)
 
         # print("[DAT:Tex:Material {0}] Size: {1} | Format: {2} | Has Alpha: {3}"
-        #       .format(material_id, chunk_size, file_extension, alpha_texture is not None))
+        #       .format(material_id, chunk.size, images[i * 2][1], alpha_texture is not None))
         material_name = "Material {0}".format(material_id) if multi_material else "Material"
         material = NoeMaterial(material_name, diffuse_texture.name)
         if alpha_texture is not None:
@@ -140,17 +368,192 @@ def load_textures(bs, header, pmm_data):
     return materials, textures
 
 
+def read_texture_images(bs, texture_chunks):
+    """
+    Reads the encoded images of the texture chunks, without decoding them.
+    :type bs: NoeBitStream | MappedStream
+    :type texture_chunks: list[DatChunk]
+    :rtype: list[tuple[bytes | memoryview | None, bytes | memoryview | None, str]]
+    :return: The diffuse image, alpha image and handler extension of each chunk. PNG chunks have no alpha image.
+    Memoryviews over the stream buffer if the stream is a MappedStream.
+    """
+    images = []
+    for chunk in texture_chunks:
+        bs.seek(chunk.offset, NOESEEK_ABS)
+        if is_joker_chunk(bs):
+            diffuse_bytes, alpha_bytes = read_joker_images(bs)
+            images.append((diffuse_bytes, alpha_bytes, ".jpg"))
+        else:
+            images.append((read_view(bs, chunk.size), None, ".png"))
+    return images
+
+
+def dat_texture_name(header, chunk):
+    """
+    Returns the name of the texture of a texture chunk: the embedded filename, followed by the element name
+    for files with a material ID system.
+    :type header: DatHeader
+    :type chunk: DatChunk
+    :rtype: str
+    """
+    if chunk.material_id is None:
+        return header.name
+    return header.name + "_" + material_names.get(chunk.material_id, str(chunk.material_id))
+
+
+def decode_images(images, workers=1):
+    """
+    Decodes the images, on a pool of threads if workers is more than 1 and rapi declares that
+    loadTexByHandler is thread-safe. Only the headless stand-in does, otherwise the images are decoded in order.
+    :type images: list[tuple[bytes | None, str | None]]
+    :param images: Encoded data and file extension of each image. Data may be None for missing images.
+    :type workers: int
+    :param workers: Maximum number of threads.
+    :rtype: list[NoeTexture | None]
+    :return: The textures, in the same order as the images.
+    """
+    if workers > 1 and len(images) > 1 and getattr(rapi, "THREAD_SAFE_TEXTURE_DECODE", False):
+        with ThreadPoolExecutor(max_workers=min(workers, len(images))) as executor:
+            return list(executor.map(_decode_image, images))
+    return [_decode_image(image) for image in images]
+
+
+def _decode_image(image):
+    data, extension = image
+    return rapi.loadTexByHandler(data, extension) if data is not None else None
+
+
 def decipher_pmm(bs, size):
     """
-    :type bs: NoeBitStream
-    :param bs: The bitstream containing the PMM chunk
+    Deciphers the PMM chunk at the current position of the stream in place. The stream position is unchanged.
+    :type bs: NoeBitStream | MappedStream
+    :param bs: The bitstream containing the PMM chunk, must be writable
     :type size: int
     :param size: The size of the PMM chunk to decipher
     """
-    ciphered_pmm_chunk = peek_bytes(bs, size)
-    deciphered = as_deciphered(ciphered_pmm_chunk)
-    bs.writeBytes(deciphered)
-    bs.seek(-size, NOESEEK_REL)
+    if isinstance(bs, MappedStream):
+        decipher_into(bs.view, bs.tell(), size)
+    else:
+        decipher_stream(bs, size)
+
+
+DAT_CHUNK_HEADER = "header"
+DAT_CHUNK_PMM = "pmm"
+DAT_CHUNK_PLM = "plm"
+DAT_CHUNK_TEXTURE = "texture"
+
+
+class DatChunk:
+    """
+    Location of a chunk in a DAT file.
+    :cvar kind: One of DAT_CHUNK_HEADER, DAT_CHUNK_PMM, DAT_CHUNK_PLM or DAT_CHUNK_TEXTURE.
+    :cvar offset: Position of the chunk data in the file, past its size field.
+    :cvar size: Size of the chunk data.
+    :cvar material_id: Element ID of a texture chunk. None if the file does not use a material ID system.
+    """
+
+    def __init__(self, kind, offset, size, material_id=None):
+        self.kind = kind
+        self.offset = offset
+        self.size = size
+        self.material_id = material_id
+
+    def __repr__(self):
+        return "DatChunk({0}, {1}, {2}, {3})".format(self.kind, hex(self.offset), hex(self.size), self.material_id)
+
+
+class DatIndex:
+    """
+    Locates every chunk of a DAT file in a single pass, without copying or parsing chunk data.
+    Chunks can then be accessed as memoryview slices of the file data.
+    :cvar header: The header chunk.
+    :cvar pmm: The PMM chunk.
+    :cvar plm: The PLM chunk.
+    :cvar textures: The texture chunks, in file order. Each is either a Joker chunk or a PNG file.
+    :cvar chunks: All chunks, in file order.
+    Can be used as a context manager, which closes the index on exit.
+    """
+
+    def __init__(self, data):
+        """
+        :type data: bytes | bytearray | mmap.mmap
+        :param data: Contents of a DAT file.
+        """
+        self.data = data
+        self.view = memoryview(data)
+        self.chunks = []
+        self.textures = []
+
+        size = len(self.view)
+        offset = 0
+        self.header, offset = self._read_chunk(DAT_CHUNK_HEADER, offset, size)
+        self.pmm, offset = self._read_chunk(DAT_CHUNK_PMM, offset, size)
+        self.plm, offset = self._read_chunk(DAT_CHUNK_PLM, offset, size)
+
+        while offset + 4 <= size:
+            # Some models may have only one image (special_mdl_*.dat)
+            # And do not use a material_id system
+            material_id = struct.unpack_from("<i", self.view, offset)[0]
+            if material_id > 255:
+                material_id = None
+            else:
+                offset += 4
+            chunk, offset = self._read_chunk(DAT_CHUNK_TEXTURE, offset, size, material_id)
+            if chunk.size != 0:
+                self.textures.append(chunk)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            self.close()
+        except BufferError:
+            # The traceback still references slices of the file data, the map is closed once they are released
+            if exc_type is None:
+                raise
+
+    @classmethod
+    def from_file(cls, filepath, writable=False):
+        """
+        Indexes a DAT file through a memory map, so chunks are only read from disk when accessed.
+        :type filepath: str
+        :type writable: bool
+        :param writable: Whether the map is copy-on-write instead of read-only. Writes only change memory,
+        and only the pages written to are copied.
+        :rtype: DatIndex
+        """
+        with open(filepath, "rb") as f:
+            return cls(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY if writable else mmap.ACCESS_READ))
+
+    def _read_chunk(self, kind, offset, size, material_id=None):
+        if offset + 4 > size:
+            raise Exception("[DAT] Missing {0} chunk at {1}".format(kind, hex(offset)))
+        chunk_size = struct.unpack_from("<i", self.view, offset)[0]
+        offset += 4
+        if chunk_size < 0 or offset + chunk_size > size:
+            raise Exception("[DAT] Invalid {0} chunk size {1} at {2}".format(kind, hex(chunk_size), hex(offset)))
+        chunk = DatChunk(kind, offset, chunk_size, material_id)
+        if chunk_size != 0:
+            self.chunks.append(chunk)
+        return chunk, offset + chunk_size
+
+    def slice(self, chunk):
+        """
+        Returns the chunk data as a memoryview over the file data. No data is copied.
+        :type chunk: DatChunk
+        :rtype: memoryview
+        """
+        return self.view[chunk.offset:chunk.offset + chunk.size]
+
+    def close(self):
+        """
+        Releases the view over the file data, and closes the memory map if created by from_file.
+        Slices and streams over the file data must be released first.
+        """
+        self.view.release()
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
 
 
 class DatHeader:
@@ -160,20 +563,27 @@ class DatHeader:
         bs.seek(0x11, NOESEEK_REL)
 
         # variable bytes original filename, todo: delimiter
-        self.name = ""
-        while True:
-            c = filename_decipher[bs.readUByte()]
-            if c == 0x00:
-                break
-            try:
-                self.name += chr(c)
-            except UnicodeDecodeError:
-                break
-        self.name = self.name.rstrip('\'')
+        self.name = decipher_filename(bs.readBytes(header_len - 0x11))
         # variable bytes remaining header
         bs.seek(start + header_len, NOESEEK_ABS)
 
 
+def decipher_filename(data):
+    """
+    Deciphers the original filename stored in the header chunk, up to the first null character.
+    :type data: bytes | bytearray | memoryview
+    :param data: Header chunk data starting at the filename.
+    :rtype: str
+    """
+    name = ""
+    for c in bytes(data):
+        c = filename_decipher[c]
+        if c == 0x00:
+            break
+        name += chr(c)
+    return name.rstrip('\'')
+
+
 # Incomplete cipher, some letters/numbers have not been used
 filename_decipher = bytearray([
     0xFE, 0x00, 0x00, 0x7A, 0x00, 0x00, 0x00, 0x00, 0x00, 0x31, 0x00, 0x00, 0x00, 0x30, 0x00, 0x00,
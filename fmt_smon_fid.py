@@ -1,5 +1,8 @@
+import struct
+
 from inc_noesis import *
-from os.path import isfile
+from inc_smon import TextureCache, numpy
+from os.path import join
 
 
 # -----------
@@ -34,13 +37,27 @@ def fid_check_type(data):
     return 1 if signature == FID_HEADER else 0
 
 
-def fid_load_model(data, models):
+def fid_load_model(data, models, directory=None, texture_cache=None, vertex_counts=None):
     """
     :type models: list[NoeModel]
     :type data: bytes
+    :type directory: str
+    :param directory: Directory containing the textures. Defaults to the directory of the selected file.
+    :type texture_cache: TextureCache
+    :param texture_cache: Shares decoded textures with other loads, such as the neighbouring tiles of a scene.
+    Defaults to a cache for this load only.
+    :type vertex_counts: list[int]
+    :param vertex_counts: Appended with the vertex count of each model, read from the mesh data.
     :rtype: int
     """
 
+    if directory is None:
+        directory = noesis.getSelectedDirectory()
+    if texture_cache is None:
+        texture_cache = TextureCache()
+    # Texture of each texture file name, meshes of a scene often share textures
+    textures = {}
+
     bs = NoeBitStream(data)
 
     fid_signature = bs.readBytes(12).decode().rstrip('\x00')
@@ -104,22 +121,41 @@ def fid_load_model(data, models):
         # ============================= Get Textures ================================= #
 
         texture_filename = texture_paths[texture_index]
-        texture_filepath = noesis.getSelectedDirectory() + "\\" + texture_filename
-        if not isfile(texture_filepath):
+        texture_filepath = join(directory, texture_filename)
+        if texture_filename not in textures:
+            textures[texture_filename] = fid_load_texture(texture_cache, texture_filepath, texture_filename)
+        fid_data.texture = textures[texture_filename]
+        if fid_data.texture is None:
             noesis.logError("[ERROR] [FID:Mesh {0}] Missing texture {1}\n".format(x, texture_filepath))
         else:
-            fid_data.texture = rapi.loadExternalTex(texture_filepath)
-            fid_data.texture.name = texture_filename
             fid_data.material = NoeMaterial("Material_" + texture_filename, fid_data.texture.name)
 
         # ============================= Create model ================================= #
 
         model = fid_data.construct_model()
         models.append(model)
+        if vertex_counts is not None:
+            vertex_counts.append(fid_data.vertex_count)
 
     return 1
 
 
+def fid_load_texture(texture_cache, filepath, name):
+    """
+    Loads a texture through the cache, named after its file name in the FID file.
+    :type texture_cache: TextureCache
+    :type filepath: str
+    :type name: str
+    :rtype: NoeTexture | None
+    :return: A NoeTexture sharing the pixel data of the cached texture, None if the texture is missing.
+    """
+    texture = texture_cache.load(filepath)
+    if texture is None:
+        return None
+    # The cached texture is shared with other loads, so it is not renamed
+    return NoeTexture(name, texture.width, texture.height, texture.pixelData, texture.pixelType)
+
+
 def bytes_str(bit_array, split=1):
     """
     Returns a clean string representation of the bytes object
@@ -143,26 +179,55 @@ def bytes_str(bit_array, split=1):
 
 class FidData:
     """
-    Contains data stored in a Summoners War PMM chunk.
+    Contains data stored in a Summoners War EGMesh chunk.
+    Buffers are kept as read. The *_array methods decode them with numpy.
+    :cvar model_name: Name of the mesh.
     :cvar vertex_count: Number of vertices in the model. Stored in file as int.
     :cvar vertex_bytes: Vertex position data. Stored in file as 3x float per item.
-    :cvar uv_bytes: UV position data. Stored in file as 2x float per item.
+    :cvar uv1_bytes: UV position data. Stored in file as 2x float per item.
+    :cvar uv2_slot: UV slot of uv2_bytes, 0 if there is no second UV buffer.
     :cvar uv2_bytes: UV position data. Stored in file as 2x float per item.
-    :cvar material: NoeMaterial
-    :cvar texture: NoeTexture
+    :cvar material: NoeMaterial, None if the texture is missing.
+    :cvar texture: NoeTexture, None if the texture is missing.
     """
 
-    model_name = None
-    vertex_count = 0
-    vertex_bytes = []
-    uv1_bytes = []
-    uv2_slot = 0
-    uv2_bytes = None
-    material = None
-    texture = None
+    __slots__ = ("model_name", "vertex_count", "vertex_bytes", "uv1_bytes", "uv2_slot", "uv2_bytes", "material",
+                 "texture")
 
     def __init__(self, model_name):
         self.model_name = model_name
+        self.vertex_count = 0
+        self.vertex_bytes = b""
+        self.uv1_bytes = b""
+        self.uv2_slot = 0
+        self.uv2_bytes = None
+        self.material = None
+        self.texture = None
+
+    def position_array(self):
+        """
+        :rtype: numpy.ndarray
+        :return: float32 view of shape (vertices, 3) of the positions.
+        """
+        return _buffer_array(self.vertex_bytes, self.vertex_count, 3)
+
+    def uv1_array(self):
+        """
+        Returns the UVs with V negated, like the UV scale of construct_model.
+        :rtype: numpy.ndarray
+        :return: float32 array of shape (vertices, 2).
+        """
+        return _buffer_array(self.uv1_bytes, self.vertex_count, 2) * numpy.array((1, -1), dtype=numpy.float32)
+
+    def uv2_array(self):
+        """
+        Returns the second UVs as stored. The UV scale of construct_model only applies to the first UVs.
+        :rtype: numpy.ndarray | None
+        :return: float32 view of shape (vertices, 2), or None if the mesh has no second UVs.
+        """
+        if self.uv2_bytes is None:
+            return None
+        return _buffer_array(self.uv2_bytes, self.vertex_count, 2)
 
     def construct_model(self):
         """
@@ -174,31 +239,53 @@ class FidData:
         rapi.rpgBindUV1Buffer(self.uv1_bytes, noesis.RPGEODATA_FLOAT, 8)
         if self.uv2_bytes is not None:
             rapi.rpgBindUVXBuffer(self.uv2_bytes, noesis.RPGEODATA_FLOAT, 8, self.uv2_slot, 1)
+        # UVs are flipped, we need to flip the Y component here.
+        rapi.rpgSetUVScaleBias(NoeVec3((1, -1, 1)), None)
 
-        if self.material.name is not None:
+        if self.material is not None and self.material.name is not None:
             rapi.rpgSetMaterial(self.material.name)
 
         # Rapi requires tris. Fid contains no tris. We have to fake it.
-        # Byte array where every 4 bytes represents an int of ascending value
-        fake_tris = bytearray()
-        for x in range(self.vertex_count):
-            fake_tris.append(x % 256)
-            fake_tris.append((x >> 8) % 256)
-            fake_tris.append((x >> 16) % 256)
-            fake_tris.append((x >> 24) % 256)
-
+        fake_tris = fid_index_buffer(self.vertex_count)
         rapi.rpgCommitTriangles(fake_tris, noesis.RPGEODATA_UINT, self.vertex_count, noesis.RPGEO_TRIANGLE, 1)
 
         model = rapi.rpgConstructModel()
+        rapi.rpgClearBufferBinds()
         model.meshes[0].setName(self.model_name)
-        model.setModelMaterials(NoeModelMaterials([self.texture], [self.material]))
-
-        # UVs are flipped, we need to flip the Y component here.
-        for item in model.meshes[0].uvs:
-            item[1] = -item[1]
+        if self.material is not None:
+            model.setModelMaterials(NoeModelMaterials([self.texture], [self.material]))
         return model
 
 
+def _buffer_array(buffer, count, components):
+    """
+    Returns a read-only float32 numpy view of the first count items of the buffer, without copying it.
+    """
+    if numpy is None:
+        raise Exception("[FID] numpy is required to decode buffers into arrays")
+    return numpy.frombuffer(buffer, dtype="<f4", count=count * components).reshape(count, components)
+
+
+# Ascending UInt32 indices, shared by every mesh and grown when a larger mesh is loaded
+_fid_index_buffer = b""
+
+
+def fid_index_buffer(vertex_count):
+    """
+    Returns a buffer where every 4 bytes represents an int of ascending value, with at least vertex_count ints.
+    The buffer is shared, only the first vertex_count indices should be used.
+    :type vertex_count: int
+    :rtype: bytes
+    """
+    global _fid_index_buffer
+    if len(_fid_index_buffer) < vertex_count * 4:
+        if numpy is not None:
+            _fid_index_buffer = numpy.arange(vertex_count, dtype="<u4").tobytes()
+        else:
+            _fid_index_buffer = struct.pack("<{0}I".format(vertex_count), *range(vertex_count))
+    return _fid_index_buffer
+
+
 def read_buffer(bs):
     """
     First reads an int for length of buffer, then reads the length
@@ -1,4 +1,5 @@
 from inc_noesis import *
+from inc_smon import read_view
 
 
 # -----------
@@ -12,10 +13,23 @@ def registerNoesisTypes():
     handle = noesis.register("Summoners War Image", ".png")
     noesis.setHandlerTypeCheck(handle, joker_check_type)
     noesis.setHandlerLoadRGBA(handle, load_joker_file)
+
+    handle_tool = noesis.registerTool("Combine alpha into diffuse", joker_tool_combine_alpha,
+                                      "When enabled, the alpha image is merged into the diffuse texture as a single " +
+                                      "RGBA texture. When disabled, the alpha image is loaded as a separate texture.")
+    noesis.setToolSubMenuName(handle_tool, "Summoners War: Sky Arena")
     return 1
 
 
 JOKER_HEADER = "Joker"
+JOKER_COMBINE_ALPHA = 0
+
+
+def joker_tool_combine_alpha(handle):
+    global JOKER_COMBINE_ALPHA
+    JOKER_COMBINE_ALPHA = 1 if not JOKER_COMBINE_ALPHA else 0
+    noesis.checkToolMenuItem(handle, JOKER_COMBINE_ALPHA)
+    return JOKER_COMBINE_ALPHA
 
 
 def joker_check_type(data):
@@ -42,18 +56,20 @@ def is_joker_chunk(bs):
         return 0
 
 
-def load_joker_file(data, textures):
+def load_joker_file(data, textures, combine_alpha=None):
     """
     For use by Noesis.
     :type data: bytes
     :type textures: list[NoeTexture]
+    :type combine_alpha: int
+    :param combine_alpha: Whether to merge the alpha image into the diffuse texture. Defaults to JOKER_COMBINE_ALPHA.
     :rtype: int
     """
     if joker_check_type(data) == 0:
         return 0
 
     bs = NoeBitStream(data)
-    diffuse, alpha = load_joker(bs)
+    diffuse, alpha = load_joker(bs, combine_alpha)
 
     if diffuse is not None:
         textures.append(diffuse)
@@ -64,24 +80,83 @@ def load_joker_file(data, textures):
     return 1
 
 
-def load_joker(bs):
+def load_joker(bs, combine_alpha=None):
     """
     Loads NoeTextures from the Joker chunk in the stream.
     :type bs: NoeBitStream
+    :type combine_alpha: int
+    :param combine_alpha: Whether to merge the alpha image into the diffuse texture. Defaults to JOKER_COMBINE_ALPHA.
     :rtype: tuple[NoeTexture | None, NoeTexture | None]
+    :return: The diffuse and alpha textures. When the alpha image is merged, the alpha texture is None.
     """
-    bs.seek(8, NOESEEK_REL)  # 6 bytes null terminated string "JOKER", 2 bytes 0x1F01
-    diffuse_size = bs.readInt()
-    alpha_size = bs.readInt()
+    diffuse_bytes, alpha_bytes = read_joker_images(bs)
 
     diffuse_tex = None
-    if diffuse_size > 0:
-        diffuse_bytes = bs.readBytes(diffuse_size)
+    if diffuse_bytes is not None:
         diffuse_tex = rapi.loadTexByHandler(diffuse_bytes, ".jpg")
 
     alpha_tex = None
-    if alpha_size > 0:
-        alpha_bytes = bs.readBytes(alpha_size)
+    if alpha_bytes is not None:
         alpha_tex = rapi.loadTexByHandler(alpha_bytes, ".jpg")
 
+    combine_alpha = JOKER_COMBINE_ALPHA if combine_alpha is None else combine_alpha
+    if combine_alpha and diffuse_tex is not None and alpha_tex is not None:
+        return combine_joker_alpha(diffuse_tex, alpha_tex), None
+
     return diffuse_tex, alpha_tex
+
+
+def combine_joker_alpha(diffuse_tex, alpha_tex):
+    """
+    Creates a single RGBA texture from the diffuse texture, with the alpha texture as its alpha channel.
+    The alpha texture is resampled to the size of the diffuse texture if needed.
+    The pixel data of both textures is released, so that only one full size image is alive at a time.
+    :type diffuse_tex: NoeTexture
+    :type alpha_tex: NoeTexture
+    :rtype: NoeTexture
+    """
+    width, height = diffuse_tex.width, diffuse_tex.height
+    alpha = rapi.imageGetTexRGBA(alpha_tex)
+    if (alpha_tex.width, alpha_tex.height) != (width, height):
+        alpha = rapi.imageResample(alpha, alpha_tex.width, alpha_tex.height, width, height)
+    alpha = joker_alpha_luma(alpha)
+    alpha_tex.pixelData = None
+
+    # Written in place when the decoded data is mutable, otherwise the diffuse data is freed once copied
+    rgba = rapi.imageGetTexRGBA(diffuse_tex)
+    if not isinstance(rgba, bytearray):
+        rgba = bytearray(rgba)
+    diffuse_tex.pixelData = None
+    rgba[3::4] = alpha
+    return NoeTexture(diffuse_tex.name, width, height, rgba, noesis.NOESISTEX_RGBA32)
+
+
+def joker_alpha_luma(rgba):
+    """
+    Converts RGBA32 data to its Rec.601 luma, the alpha values of a Joker alpha image.
+    :type rgba: bytes | bytearray
+    :rtype: bytes
+    :return: One byte per pixel.
+    """
+    red, green, blue = rgba[0::4], rgba[1::4], rgba[2::4]
+    # Most alpha images are greyscale, where the luma is the value of any channel
+    if red == green == blue:
+        return bytes(red)
+    return bytes((299 * r + 587 * g + 114 * b) // 1000 for r, g, b in zip(red, green, blue))
+
+
+def read_joker_images(bs):
+    """
+    Reads the encoded JPEG images of the Joker chunk in the stream, without decoding them.
+    :type bs: NoeBitStream
+    :rtype: tuple[bytes | memoryview | None, bytes | memoryview | None]
+    :return: The diffuse and alpha images. None if the chunk does not contain the image.
+    Memoryviews over the stream buffer if the stream is a MappedStream.
+    """
+    bs.seek(8, NOESEEK_REL)  # 6 bytes null terminated string "JOKER", 2 bytes 0x1F01
+    diffuse_size = bs.readInt()
+    alpha_size = bs.readInt()
+
+    diffuse_bytes = read_view(bs, diffuse_size) if diffuse_size > 0 else None
+    alpha_bytes = read_view(bs, alpha_size) if alpha_size > 0 else None
+    return diffuse_bytes, alpha_bytes
@@ -1,6 +1,7 @@
 from inc_noesis import *
-from inc_smon import access_bit
-from math import ceil
+from inc_smon import access_bit, numpy, read_view
+from math import acos, ceil, sin
+from collections import OrderedDict
 
 
 # ----------
@@ -38,9 +39,16 @@ def registerNoesisTypes():
                                         "When disabled, animations will be processed and applied to the model."
                                         )
 
+    handle_tool_4 = noesis.registerTool("Reduce animation keys", plm_tool_reduce_keys,
+                                        "When enabled, keys that interpolation reproduces within a tolerance " +
+                                        "will be removed from animations. " +
+                                        "When disabled, every key will be kept."
+                                        )
+
     noesis.setToolSubMenuName(handle_tool_1, "Summoners War: Sky Arena")
     noesis.setToolSubMenuName(handle_tool_2, "Summoners War: Sky Arena")
     noesis.setToolSubMenuName(handle_tool_3, "Summoners War: Sky Arena")
+    noesis.setToolSubMenuName(handle_tool_4, "Summoners War: Sky Arena")
 
     return 0
 
@@ -60,6 +68,13 @@ PLM_VERSIONS = (PLM_V2, PLM_V3, PLM_V4, PLM_V5, PLM_V6, PLM_V7, PLM_V8, PLM_V9)
 PLM_IGNORE_SCALE = 0
 PLM_INTERPOLATE_TYPE = noesis.NOEKF_INTERPOLATE_NEAREST
 PLM_IGNORE_ANIMATIONS = 0
+PLM_REDUCE_KEYS = 0
+
+# Largest difference of any component between a removed key and the value interpolated at its time
+PLM_REDUCE_TOLERANCE = 0.0001
+
+# Number of decoded animations kept by LazyPlmAnimations
+PLM_LAZY_CACHE_SIZE = 4
 
 
 def has_scale(v): return v != PLM_V2
@@ -105,6 +120,13 @@ def plm_tool_skip_animations(handle):
     return PLM_IGNORE_ANIMATIONS
 
 
+def plm_tool_reduce_keys(handle):
+    global PLM_REDUCE_KEYS
+    PLM_REDUCE_KEYS = 1 if not PLM_REDUCE_KEYS else 0
+    noesis.checkToolMenuItem(handle, PLM_REDUCE_KEYS)
+    return PLM_REDUCE_KEYS
+
+
 def load_plm_animation(bs, scale_divider):
     """
     Processes the PLM chunk and returns its data.
@@ -113,6 +135,101 @@ def load_plm_animation(bs, scale_divider):
     :type scale_divider: int
     :rtype: tuple[list[NoeBone], list[NoeKeyFramedAnim]]
     """
+    header = plm_read_header(bs, scale_divider)
+    bones = plm_read_bones(bs, header)
+
+    if PLM_IGNORE_ANIMATIONS:
+        return bones, None
+
+    kf_animations = plm_read_animations(bs, header.anim_num_frames, bones, header.num_animations, header.num_bones,
+                                        header.version, header.scale_divider)
+
+    if PLM_REDUCE_KEYS:
+        print("[PLM:Keys] {0}".format(plm_reduce_animations(kf_animations)))
+
+    return bones, kf_animations
+
+
+def load_plm_animation_lazy(bs, scale_divider, cache_size=None, as_arrays=False):
+    """
+    Processes the PLM chunk like load_plm_animation, but only decodes an animation when it is first accessed.
+    The animation tracks are skimmed once to find where each one starts, and copied out of the stream.
+    :type bs: NoeBitStream
+    :param scale_divider: Value from PMM chunk.
+    :type scale_divider: int
+    :type cache_size: int
+    :param cache_size: Number of decoded animations to keep. Defaults to PLM_LAZY_CACHE_SIZE.
+    :type as_arrays: bool
+    :param as_arrays: Decode animations into PlmTracks instead of NoeKeyFramedAnims. Requires numpy.
+    :rtype: tuple[list[NoeBone], LazyPlmAnimations]
+    """
+    header = plm_read_header(bs, scale_divider)
+    bones = plm_read_bones(bs, header)
+    return bones, plm_read_lazy_animations(bs, header, bones, cache_size, as_arrays)
+
+
+def load_plm_animation_arrays(bs, scale_divider):
+    """
+    Processes the PLM chunk like load_plm_animation, but decodes the animations into arrays. Requires numpy.
+    :type bs: NoeBitStream
+    :param scale_divider: Value from PMM chunk.
+    :type scale_divider: int
+    :rtype: tuple[list[NoeBone], list[PlmTrack]]
+    """
+    header = plm_read_header(bs, scale_divider)
+    bones = plm_read_bones(bs, header)
+    tracks = [plm_read_track(bs, x, num_frames, header) for x, num_frames in enumerate(header.anim_num_frames)]
+    return bones, tracks
+
+
+def load_plm_skeleton(bs, scale_divider, read_tracks=True, lazy=False):
+    """
+    Processes the PLM chunk into a PlmSkeleton and PlmTracks. Requires numpy.
+    :type bs: NoeBitStream
+    :param scale_divider: Value from PMM chunk.
+    :type scale_divider: int
+    :type read_tracks: bool
+    :param read_tracks: Whether to decode the animations. When False, the returned list of tracks is empty.
+    :type lazy: bool
+    :param lazy: Whether to return the tracks as LazyPlmAnimations, so that only the tracks in use are decoded.
+    :rtype: tuple[PlmSkeleton, list[PlmTrack] | LazyPlmAnimations]
+    """
+    header = plm_read_header(bs, scale_divider)
+    skeleton = PlmSkeleton(plm_read_bone_records(bs, header))
+    tracks = []
+    if read_tracks and lazy:
+        tracks = plm_read_lazy_animations(bs, header, as_arrays=True)
+    elif read_tracks:
+        tracks = [plm_read_track(bs, x, num_frames, header) for x, num_frames in enumerate(header.anim_num_frames)]
+    return skeleton, tracks
+
+
+class PlmHeader:
+    """
+    Header of a PLM chunk.
+    :cvar version: PLM version, one of PLM_VERSIONS.
+    :cvar scale_divider: Value to divide translations by. Always 1 for versions with floating point values.
+    :cvar num_animations: Number of animation tracks.
+    :cvar anim_num_frames: Number of frames of each animation track.
+    :cvar num_bones: Number of bones in the skeleton.
+    """
+
+    def __init__(self):
+        self.version = PLM_V2
+        self.scale_divider = 1
+        self.num_animations = 0
+        self.anim_num_frames = []
+        self.num_bones = 0
+
+
+def plm_read_header(bs, scale_divider):
+    """
+    Reads the PLM chunk header, leaving the stream at the first bone.
+    :type bs: NoeBitStream
+    :param scale_divider: Value from PMM chunk.
+    :type scale_divider: int
+    :rtype: PlmHeader
+    """
     plm_signature = bs.readBytes(3).decode()
     if plm_signature != PLM_SIGNATURE:
         raise Exception("[PLM] Unexpected signature: {0}".format(plm_signature))
@@ -124,6 +241,10 @@ def load_plm_animation(bs, scale_divider):
     if is_floats(version):
         scale_divider = 1
 
+    header = PlmHeader()
+    header.version = version
+    header.scale_divider = scale_divider
+
     print("[PLM:Signature] {}{}".format(plm_signature, version))
 
     # 2 byte int: number of animations
@@ -143,8 +264,6 @@ def load_plm_animation(bs, scale_divider):
         num_frames = bs.readUShort()
         anim_num_frames.append(num_frames)
 
-    bones = []
-
     # 1 byte number of bones in model skeleton
     num_bones = bs.readUByte()
 
@@ -167,53 +286,256 @@ def load_plm_animation(bs, scale_divider):
 
     # print("[PLM:Header:Unk2] {0}".format(bytes_str(unk2)))
     # print("[PLM:Header:Unk3] {0}".format(bytes_str(unk3, 4)))
-    # print("[PLM:Bones] File Position: {0}".format(hex(bs.tell())))
-    for i in range(num_bones):
-        bone = plm_read_bone(bs, scale_divider, version)
-        # print("[PLM:Bone{0:03}] Parent: {1}, File Position End: {2}".format(i, bone.parentIndex, hex(bs.tell())))
-        bones.append(bone)
+
+    header.num_animations = num_animations
+    header.anim_num_frames = anim_num_frames
+    header.num_bones = num_bones
+    return header
+
+
+def plm_read_bones(bs, header):
+    """
+    Reads the bones following the PLM chunk header, and applies the parent transforms to them.
+    :type bs: NoeBitStream
+    :type header: PlmHeader
+    :rtype: list[NoeBone]
+    """
+    records = plm_read_bone_records(bs, header)
+    bones = [record.to_bone() for record in records]
 
     # Bones are stored in local position, we have to apply parent transform
-    for i in range(0, num_bones):
+    # Parents are transformed first, even if they are stored after their children
+    for i in plm_bone_order([record.parent_id for record in records]):
         bone = bones[i]
         parent_idx = bones[i].parentIndex
         if parent_idx != 0xFF:
             parent_bone = bones[parent_idx]
             bone.setMatrix(bone.getMatrix() * parent_bone.getMatrix())
 
-    if PLM_IGNORE_ANIMATIONS:
-        return bones, None
+    return bones
 
-    kf_animations = plm_read_animations(bs, anim_num_frames, bones, num_animations, num_bones, version,
-                                        scale_divider)
 
-    return bones, kf_animations
+def plm_read_bone_records(bs, header):
+    """
+    Reads the bones following the PLM chunk header, without applying the parent transforms.
+    :type bs: NoeBitStream
+    :type header: PlmHeader
+    :rtype: list[PlmBone]
+    """
+    # print("[PLM:Bones] File Position: {0}".format(hex(bs.tell())))
+    return [plm_read_bone_record(bs, header.scale_divider, header.version) for _ in range(header.num_bones)]
+
+
+def plm_bone_depths(parent_ids):
+    """
+    Returns the depth of each bone in the hierarchy, 0 for root bones.
+    Parent IDs of 0xFF, or outside of the bone list, mark root bones.
+    :type parent_ids: list[int]
+    :rtype: list[int]
+    """
+    num_bones = len(parent_ids)
+    depths = [None] * num_bones
+    for i in range(num_bones):
+        chain = []
+        bone = i
+        while depths[bone] is None:
+            chain.append(bone)
+            parent = parent_ids[bone]
+            if parent >= num_bones:
+                depths[bone] = 0
+                chain.pop()
+                break
+            if len(chain) > num_bones:
+                raise Exception("[PLM] Bone hierarchy has a cycle at bone {0}".format(i))
+            bone = parent
+        for bone in reversed(chain):
+            depths[bone] = depths[parent_ids[bone]] + 1
+    return depths
+
+
+def plm_bone_order(parent_ids):
+    """
+    Returns the bone indices ordered so that each parent comes before its children.
+    Bones already in that order keep their file order.
+    :type parent_ids: list[int]
+    :rtype: list[int]
+    """
+    depths = plm_bone_depths(parent_ids)
+    return sorted(range(len(parent_ids)), key=lambda i: depths[i])
 
 
 def plm_read_animations(bs, anim_num_frames, bones, num_animations, num_bones, version, scale_divider):
     kf_animations = []
     # print("[PLM:Tracks] File Position: {0}".format(hex(bs.tell())))
     for x in range(num_animations):
-        # print("[PLM:Track{0: 2}] File Position: {1}".format(x, hex(bs.tell())))
-        # 0x18 bytes unknown
-        unk_track = bs.readBytes(0x18)
-        # print("[PLM:Track{0:02}:Unk] {1}".format(x, bytes_str(unk_track, 4)))
-
-        num_frames = anim_num_frames[x]
-        # print("[PLM:Track{0: 2}] Frame Count: {1}, File Position: {2}".format(x, num_frames, hex(bs.tell())))
-        keyframed_bones = []
-        for b in range(num_bones):
-            keyframed_bone = plm_read_keyframed_bone_animation(bs, b, num_frames, scale_divider, version)
-            keyframed_bones.append(keyframed_bone)
-            # print("[PLM:Track{0: 2}:Bone{1: 3}] File Position: {2}".format(x, b, hex(bs.tell())))
-
-        # Note, for .dat files, actual animation names are stored in the game's encrypted infocsv file
-        # and are inaccessible here
-        animation = NoeKeyFramedAnim("Anim_{0:02}".format(x), bones, keyframed_bones, 60)
+        animation = plm_read_animation(bs, x, anim_num_frames[x], bones, num_bones, version, scale_divider)
         kf_animations.append(animation)
     return kf_animations
 
 
+def plm_read_animation(bs, x, num_frames, bones, num_bones, version, scale_divider):
+    """
+    Reads a single animation track.
+    :type bs: NoeBitStream
+    :param bs: Bitstream positioned at the start of the track
+    :type x: int
+    :param x: Index of the track in the PLM chunk, used for its name.
+    :type num_frames: int
+    :type bones: list[NoeBone]
+    :type num_bones: int
+    :type version: string
+    :type scale_divider: int
+    :rtype: NoeKeyFramedAnim
+    """
+    # print("[PLM:Track{0: 2}] File Position: {1}".format(x, hex(bs.tell())))
+    # 0x18 bytes unknown
+    unk_track = bs.readBytes(0x18)
+    # print("[PLM:Track{0:02}:Unk] {1}".format(x, bytes_str(unk_track, 4)))
+
+    # print("[PLM:Track{0: 2}] Frame Count: {1}, File Position: {2}".format(x, num_frames, hex(bs.tell())))
+    keyframed_bones = []
+    for b in range(num_bones):
+        keyframed_bone = plm_read_keyframed_bone_animation(bs, b, num_frames, scale_divider, version)
+        keyframed_bones.append(keyframed_bone)
+        # print("[PLM:Track{0: 2}:Bone{1: 3}] File Position: {2}".format(x, b, hex(bs.tell())))
+
+    # Note, for .dat files, actual animation names are stored in the game's encrypted infocsv file
+    # and are inaccessible here
+    return NoeKeyFramedAnim("Anim_{0:02}".format(x), bones, keyframed_bones, 60)
+
+
+def plm_skip_animations(bs, header):
+    """
+    Skims over the animation tracks without decoding any keys.
+    Only the first byte or key bitarray of each attribute is read, to find the number of keys to skip.
+    :type bs: NoeBitStream
+    :param bs: Bitstream positioned at the start of the first track
+    :type header: PlmHeader
+    :rtype: list[int]
+    :return: Position of each track in the stream.
+    """
+    version = header.version
+    floats = is_floats(version)
+    value_sizes = [16 if floats else 8, 12]
+    if has_scale(version):
+        value_sizes.append(12)
+
+    track_offsets = []
+    for num_frames in header.anim_num_frames:
+        track_offsets.append(bs.tell())
+        bs.seek(0x18, NOESEEK_REL)
+        key_position_size = int(ceil((num_frames + 1) / 8))
+        frame_mask = (1 << num_frames) - 1
+        for b in range(header.num_bones):
+            for value_size in value_sizes:
+                # See plm_read_keys for the layout of the keys
+                if bs.readByte() == 0:
+                    bs.seek(value_size, NOESEEK_REL)
+                else:
+                    bs.seek(-1, NOESEEK_REL)
+                    key_positions = int.from_bytes(bs.readBytes(key_position_size), "little") & frame_mask
+                    bs.seek(bin(key_positions).count("1") * value_size, NOESEEK_REL)
+    return track_offsets
+
+
+def plm_read_lazy_animations(bs, header, bones=None, cache_size=None, as_arrays=False):
+    """
+    Skims over the animation tracks and copies them out of the stream, to be decoded when accessed.
+    :type bs: NoeBitStream | MappedStream
+    :param bs: Bitstream positioned at the start of the first track
+    :type header: PlmHeader
+    :type bones: list[NoeBone]
+    :param bones: Bones of the NoeKeyFramedAnims, unused with as_arrays.
+    :type cache_size: int
+    :param cache_size: Number of decoded animations to keep. Defaults to PLM_LAZY_CACHE_SIZE.
+    :type as_arrays: bool
+    :rtype: LazyPlmAnimations
+    """
+    start = bs.tell()
+    track_offsets = [offset - start for offset in plm_skip_animations(bs, header)]
+    size = bs.tell() - start
+    bs.seek(start, NOESEEK_ABS)
+    data = bytes(read_view(bs, size))
+    return LazyPlmAnimations(data, header, bones, track_offsets,
+                             PLM_LAZY_CACHE_SIZE if cache_size is None else cache_size, as_arrays)
+
+
+class LazyPlmAnimations:
+    """
+    Sequence of the animations of a PLM chunk, where each animation is only decoded when first accessed.
+    The most recently used animations are kept, up to cache_size.
+    Only the encoded tracks are kept, not the stream or file they were read from.
+    """
+
+    def __init__(self, data, header, bones, track_offsets, cache_size=PLM_LAZY_CACHE_SIZE, as_arrays=False):
+        """
+        :type data: bytes
+        :param data: The encoded animation tracks.
+        :type header: PlmHeader
+        :type bones: list[NoeBone]
+        :type track_offsets: list[int]
+        :param track_offsets: Position of each track in data.
+        :type cache_size: int
+        :param cache_size: Number of decoded animations to keep.
+        :type as_arrays: bool
+        :param as_arrays: Decode animations into PlmTracks instead of NoeKeyFramedAnims. Requires numpy.
+        """
+        self.data = data
+        self.header = header
+        self.bones = bones
+        self.track_offsets = track_offsets
+        self.cache_size = cache_size
+        self.as_arrays = as_arrays
+        self.names = ["Anim_{0:02}".format(x) for x in range(len(track_offsets))]
+        self._cache = OrderedDict()
+
+    def __len__(self):
+        return len(self.track_offsets)
+
+    def __getitem__(self, x):
+        if x < 0:
+            x += len(self)
+        if x < 0 or x >= len(self):
+            raise IndexError("[PLM] Animation index out of range: {0}".format(x))
+
+        if x in self._cache:
+            self._cache.move_to_end(x)
+            return self._cache[x]
+
+        animation = self._decode(x)
+        self._cache[x] = animation
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return animation
+
+    def __iter__(self):
+        for x in range(len(self)):
+            yield self[x]
+
+    def get(self, name):
+        """
+        Returns the animation with the given name, such as "Anim_03".
+        :type name: str
+        :rtype: NoeKeyFramedAnim | PlmTrack
+        """
+        return self[self.names.index(name)]
+
+    def is_decoded(self, x):
+        return x in self._cache
+
+    def _decode(self, x):
+        header = self.header
+        bs = NoeBitStream(self.data)
+        bs.seek(self.track_offsets[x], NOESEEK_ABS)
+        if self.as_arrays:
+            return plm_read_track(bs, x, header.anim_num_frames[x], header)
+        animation = plm_read_animation(bs, x, header.anim_num_frames[x], self.bones, header.num_bones,
+                                       header.version, header.scale_divider)
+        if PLM_REDUCE_KEYS:
+            plm_reduce_animations([animation])
+        return animation
+
+
 def plm_read_bone(bs, scale_divider, version):
     """
     :type bs: NoeBitStream
@@ -223,23 +545,65 @@ def plm_read_bone(bs, scale_divider, version):
     :param version: PLM version, required to correctly process bone information.
     :rtype: NoeBone
     """
+    return plm_read_bone_record(bs, scale_divider, version).to_bone()
 
-    flag = bs.readUByte()  # Flag is where the game would assign cosmetics, UI features, etc
-    bone_id = bs.readUByte()
-    parent_id = bs.readUByte()
-    next_sibling_id = bs.readUByte()
-    first_child_id = bs.readUByte()
-    skinned_vert_count = bs.readUShort()
 
-    quaternion = read_quaternion(bs, version)
-    translation = read_translation(bs, version) / scale_divider
-    scale = read_scale(bs, version)
+def plm_read_bone_record(bs, scale_divider, version):
+    """
+    :type bs: NoeBitStream
+    :type scale_divider: int
+    :param scale_divider: Value from PMM chunk.
+    :type version: string
+    :param version: PLM version, required to correctly process bone information.
+    :rtype: PlmBone
+    """
+    bone = PlmBone()
+    bone.flag = bs.readUByte()  # Flag is where the game would assign cosmetics, UI features, etc
+    bone.bone_id = bs.readUByte()
+    bone.parent_id = bs.readUByte()
+    bone.next_sibling_id = bs.readUByte()
+    bone.first_child_id = bs.readUByte()
+    bone.skinned_vert_count = bs.readUShort()
 
-    bone_matrix = compose_matrix(quaternion, translation, scale)
+    bone.quaternion = read_quaternion(bs, version)
+    bone.translation = read_translation(bs, version) / scale_divider
+    bone.scale = read_scale(bs, version)
+    return bone
 
-    print('bone {} parent {} verts {}'.format(bone_id, parent_id, skinned_vert_count))
 
-    return NoeBone(bone_id, "Bone {0}".format(bone_id), bone_matrix, "Bone {0}".format(parent_id), parent_id)
+class PlmBone:
+    """
+    Bone as stored in the PLM chunk, in the space of its parent.
+    :cvar flag: Where the game would assign cosmetics, UI features, etc.
+    :cvar bone_id: Index of the bone.
+    :cvar parent_id: Index of the parent bone, 0xFF for root bones.
+    :cvar next_sibling_id: Index of the next bone with the same parent, 0xFF for the last one.
+    :cvar first_child_id: Index of the first child bone, 0xFF for bones without children.
+    :cvar skinned_vert_count: Number of PMM vertices bound to the bone.
+    :cvar quaternion: Rotation of the bone.
+    :cvar translation: Translation of the bone, divided by scale_divider.
+    :cvar scale: Scale of the bone, (1, 1, 1) for PLM versions without scale.
+    """
+
+    def __init__(self):
+        self.flag = 0
+        self.bone_id = 0
+        self.parent_id = 0xFF
+        self.next_sibling_id = 0xFF
+        self.first_child_id = 0xFF
+        self.skinned_vert_count = 0
+        self.quaternion = None
+        self.translation = None
+        self.scale = None
+
+    def to_bone(self):
+        """
+        Creates the NoeBone, with its matrix still in the space of its parent.
+        :rtype: NoeBone
+        """
+        bone_matrix = compose_matrix(self.quaternion, self.translation, self.scale)
+        return NoeBone(self.bone_id, "Bone {0}".format(self.bone_id), bone_matrix,
+                       "Bone {0}".format(self.parent_id), self.parent_id)
 
 
 def plm_read_keyframed_bone_animation(bs, bone_id, num_frames, scale_divider, version):
@@ -322,6 +686,446 @@ def plm_read_keys(bs, num_frames, read_func, version, scale_divider=1):
     return keys
 
 
+class KeyReductionStats:
+    """
+    Number of keys before and after plm_reduce_animations.
+    :cvar keys_before: Number of keys of the decoded animations.
+    :cvar keys_after: Number of keys left.
+    """
+
+    def __init__(self):
+        self.keys_before = 0
+        self.keys_after = 0
+
+    @property
+    def keys_removed(self):
+        return self.keys_before - self.keys_after
+
+    def __str__(self):
+        ratio = self.keys_after / self.keys_before if self.keys_before else 1.0
+        return "Keys: {0} -> {1} ({2:.1%})".format(self.keys_before, self.keys_after, ratio)
+
+
+def plm_reduce_animations(animations, tolerance=None, interpolation=None):
+    """
+    Removes the keys of every keyframed bone that interpolation reproduces within the tolerance.
+    The key lists of the animations are replaced in place.
+    :type animations: list[NoeKeyFramedAnim]
+    :type tolerance: float
+    :param tolerance: Defaults to PLM_REDUCE_TOLERANCE.
+    :type interpolation: int
+    :param interpolation: Interpolation the animations are played with. Defaults to PLM_INTERPOLATE_TYPE.
+    :rtype: KeyReductionStats
+    """
+    stats = KeyReductionStats()
+    for animation in animations:
+        for kf_bone in animation.kfBones:
+            for attribute in ("rotationKeys", "translationKeys", "scaleKeys"):
+                keys = getattr(kf_bone, attribute)
+                if not keys:
+                    continue
+                reduced = plm_reduce_keys(keys, tolerance, interpolation)
+                setattr(kf_bone, attribute, reduced)
+                stats.keys_before += len(keys)
+                stats.keys_after += len(reduced)
+    return stats
+
+
+def plm_reduce_keys(keys, tolerance=None, interpolation=None):
+    """
+    Removes the keys that interpolation reproduces within the tolerance.
+    The first and last keys are always kept, so the length of the animation does not change.
+    With nearest interpolation, only keys inside a run of equal values are removed, which includes the hold keys
+    added by plm_read_keys. The last key of a run is kept so that the next value does not start early.
+    With linear interpolation, a key is removed when interpolating between the keys kept around it gives its value.
+    Rotations are compared and interpolated along the shortest arc.
+    :type keys: list[NoeKeyFramedValue]
+    :type tolerance: float
+    :param tolerance: Defaults to PLM_REDUCE_TOLERANCE.
+    :type interpolation: int
+    :param interpolation: Defaults to PLM_INTERPOLATE_TYPE.
+    :rtype: list[NoeKeyFramedValue]
+    """
+    tolerance = PLM_REDUCE_TOLERANCE if tolerance is None else tolerance
+    interp = PLM_INTERPOLATE_TYPE if interpolation is None else interpolation
+    if len(keys) < 3:
+        return list(keys)
+
+    components = len(keys[0].value)
+    values = [[key.value[c] for c in range(components)] for key in keys]
+    if components == 4:
+        lerp_func = _slerp
+        difference_func = _quaternion_difference
+    else:
+        lerp_func = _lerp
+        difference_func = _difference
+
+    kept = [0]
+    if interp != noesis.NOEKF_INTERPOLATE_LINEAR:
+        for i in range(1, len(keys) - 1):
+            held = values[kept[-1]]
+            if difference_func(values[i], held) > tolerance or difference_func(values[i + 1], held) > tolerance:
+                kept.append(i)
+    else:
+        # Extends the span from the last kept key for as long as every key it skips can be interpolated
+        for i in range(1, len(keys) - 1):
+            start = kept[-1]
+            start_time = keys[start].time
+            span = keys[i + 1].time - start_time
+            for j in range(start + 1, i + 1):
+                t = (keys[j].time - start_time) / span if span else 0.0
+                if difference_func(values[j], lerp_func(values[start], values[i + 1], t)) > tolerance:
+                    kept.append(i)
+                    break
+    kept.append(len(keys) - 1)
+    return [keys[i] for i in kept]
+
+
+def _difference(a, b):
+    return max(abs(x - y) for x, y in zip(a, b))
+
+
+def _quaternion_difference(a, b):
+    # q and -q are the same rotation
+    if sum(x * y for x, y in zip(a, b)) < 0:
+        return max(abs(x + y) for x, y in zip(a, b))
+    return _difference(a, b)
+
+
+def _lerp(a, b, t):
+    return [x + (y - x) * t for x, y in zip(a, b)]
+
+
+def _slerp(a, b, t):
+    dot = sum(x * y for x, y in zip(a, b))
+    if dot < 0:
+        b = [-y for y in b]
+        dot = -dot
+    if dot > 0.9995:
+        # Nearly identical rotations, normalized lerp avoids dividing by sin of a tiny angle
+        result = _lerp(a, b, t)
+        length = sum(x * x for x in result) ** 0.5
+        return [x / length for x in result]
+    theta = acos(dot)
+    weight_a = sin((1 - t) * theta) / sin(theta)
+    weight_b = sin(t * theta) / sin(theta)
+    return [x * weight_a + y * weight_b for x, y in zip(a, b)]
+
+
+def plm_read_track(bs, index, num_frames, header):
+    """
+    Reads an animation track into arrays instead of NoeKeyFramedBones. Requires numpy.
+    :type bs: NoeBitStream
+    :param bs: Bitstream positioned at the start of the track
+    :type index: int
+    :param index: Index of the track in the PLM chunk, used for its name.
+    :type num_frames: int
+    :param num_frames: Max number of frames in the track.
+    :type header: PlmHeader
+    :rtype: PlmTrack
+    """
+    if numpy is None:
+        raise Exception("[PLM] numpy is required to read animations into arrays")
+
+    # 0x18 bytes unknown
+    bs.seek(0x18, NOESEEK_REL)
+
+    version = header.version
+    track = PlmTrack("Anim_{0:02}".format(index), num_frames, header.num_bones, has_scale(version))
+    rotation_format, translation_format, scale_format = plm_key_formats(version, header.scale_divider)
+    for b in range(header.num_bones):
+        track.rotation_single_key[b] = plm_read_key_array(bs, num_frames, rotation_format, track.rotations[:, b],
+                                                          track.rotation_keys[:, b])
+        track.translation_single_key[b] = plm_read_key_array(bs, num_frames, translation_format,
+                                                             track.translations[:, b], track.translation_keys[:, b])
+        if track.scales is not None:
+            track.scale_single_key[b] = plm_read_key_array(bs, num_frames, scale_format, track.scales[:, b],
+                                                           track.scale_keys[:, b])
+    return track
+
+
+def plm_key_formats(version, scale_divider):
+    """
+    Returns how rotation, translation and scale keys are stored, as (dtype, per-component multiplier) tuples.
+    The multipliers apply the same conversions as read_quaternion_key, read_translation and read_scale.
+    :type version: string
+    :type scale_divider: int
+    :rtype: tuple[tuple[numpy.dtype, numpy.ndarray], tuple[numpy.dtype, numpy.ndarray], tuple[numpy.dtype, numpy.ndarray]]
+    """
+    if is_floats(version):
+        return ((numpy.dtype("<f4"), numpy.array((1, 1, 1, -1), dtype=numpy.float32)),
+                (numpy.dtype("<f4"), numpy.full(3, 64 / scale_divider, dtype=numpy.float32)),
+                (numpy.dtype("<f4"), numpy.ones(3, dtype=numpy.float32)))
+
+    q = 1 / 0x7FFF
+    return ((numpy.dtype("<i2"), numpy.array((q, q, q, -q), dtype=numpy.float32)),
+            (numpy.dtype("<i4"), numpy.full(3, 1 / scale_divider, dtype=numpy.float32)),
+            (numpy.dtype("<i4"), numpy.full(3, 1 / 0x10000, dtype=numpy.float32)))
+
+
+def plm_read_key_array(bs, num_frames, key_format, out_values, out_keys):
+    """
+    Array version of plm_read_keys. Reads all keys of one attribute of a bone with a single read.
+    :type bs: NoeBitStream
+    :param bs: Bitstream to read the keys from
+    :type num_frames: int
+    :param num_frames: Maximum number of frames to read
+    :type key_format: tuple[numpy.dtype, numpy.ndarray]
+    :param key_format: How values are stored, from plm_key_formats.
+    :type out_values: numpy.ndarray
+    :param out_values: Array of shape (frames, components) that receives the value of each frame.
+    Frames without a key receive the value of the previous key.
+    :type out_keys: numpy.ndarray
+    :param out_keys: Boolean array of shape (frames,) that is set where a key is stored.
+    :rtype: bool
+    :return: Whether the key is stored with the single key layout instead of a bitarray.
+    """
+    dtype, multiplier = key_format
+    components = len(multiplier)
+
+    # See plm_read_keys for the layout of the keys
+    single_key = bs.readByte() == 0
+    if single_key:
+        key_frames = numpy.zeros(1, dtype=numpy.intp)
+    else:
+        bs.seek(-1, NOESEEK_REL)
+        key_positions = numpy.frombuffer(bs.readBytes(int(ceil((num_frames + 1) / 8))), dtype=numpy.uint8)
+        key_frames = numpy.flatnonzero(numpy.unpackbits(key_positions, bitorder="little")[:num_frames])
+
+    num_keys = len(key_frames)
+    values = numpy.frombuffer(read_view(bs, num_keys * components * dtype.itemsize), dtype=dtype)
+    if num_keys == 0:
+        return single_key
+
+    values = values.reshape(num_keys, components) * multiplier
+    out_keys[key_frames] = True
+    held_keys = numpy.maximum(numpy.cumsum(out_keys) - 1, 0)
+    out_values[:] = values[held_keys]
+    return single_key
+
+
+class PlmTrack:
+    """
+    Animation track decoded into arrays of shape (frames, bones, components).
+    Every frame has a value, frames without a key hold the value of the previous key.
+    :cvar name: Name of the track.
+    :cvar num_frames: Number of frames in the track.
+    :cvar rotations: float32 quaternions (x, y, z, w), with the W component negated like read_quaternion_key.
+    :cvar translations: float32 translations, divided by scale_divider.
+    :cvar scales: float32 scales, None for PLM versions without scale.
+    :cvar rotation_keys: Boolean array of shape (frames, bones), True where a rotation key is stored.
+    :cvar translation_keys: Boolean array of shape (frames, bones), True where a translation key is stored.
+    :cvar scale_keys: Boolean array of shape (frames, bones), True where a scale key is stored.
+    :cvar rotation_single_key: Boolean array of shape (bones,), True where rotations use the single key layout.
+    :cvar translation_single_key: Boolean array of shape (bones,), True where translations use the single key layout.
+    :cvar scale_single_key: Boolean array of shape (bones,), True where scales use the single key layout.
+    """
+
+    def __init__(self, name, num_frames, num_bones, with_scale):
+        # Tracks without frames still store one key per attribute
+        rows = max(num_frames, 1)
+        self.name = name
+        self.num_frames = num_frames
+        self.rotations = numpy.zeros((rows, num_bones, 4), dtype=numpy.float32)
+        self.rotations[:, :, 3] = 1
+        self.translations = numpy.zeros((rows, num_bones, 3), dtype=numpy.float32)
+        self.rotation_keys = numpy.zeros((rows, num_bones), dtype=bool)
+        self.translation_keys = numpy.zeros((rows, num_bones), dtype=bool)
+        self.scales = numpy.ones((rows, num_bones, 3), dtype=numpy.float32) if with_scale else None
+        self.scale_keys = numpy.zeros((rows, num_bones), dtype=bool) if with_scale else None
+        self.rotation_single_key = numpy.zeros(num_bones, dtype=bool)
+        self.translation_single_key = numpy.zeros(num_bones, dtype=bool)
+        self.scale_single_key = numpy.zeros(num_bones, dtype=bool)
+
+    @property
+    def num_bones(self):
+        return self.rotations.shape[1]
+
+    def to_keyframed_bones(self, interpolation=None, ignore_scale=None):
+        """
+        Creates the NoeKeyFramedBones of the track, with the same keys as plm_read_keyframed_bone_animation.
+        Like plm_read_keys, attributes stored with the single key layout get no keys, and with nearest interpolation
+        every frame after the first key of a bitarray gets a hold key.
+        :type interpolation: int
+        :param interpolation: Defaults to PLM_INTERPOLATE_TYPE.
+        :type ignore_scale: int
+        :param ignore_scale: Defaults to PLM_IGNORE_SCALE.
+        :rtype: list[NoeKeyFramedBone]
+        """
+        interp = PLM_INTERPOLATE_TYPE if interpolation is None else interpolation
+        ignore_scale = PLM_IGNORE_SCALE if ignore_scale is None else ignore_scale
+        hold = interp != noesis.NOEKF_INTERPOLATE_LINEAR
+
+        kf_bones = []
+        for b in range(self.num_bones):
+            kf_bone = NoeKeyFramedBone(b)
+            kf_bone.setRotation(self._keys(self.rotations, self.rotation_keys, self.rotation_single_key, b, NoeQuat,
+                                           hold), interpolationType=interp)
+            kf_bone.setTranslation(self._keys(self.translations, self.translation_keys, self.translation_single_key, b,
+                                              NoeVec3, hold), interpolationType=interp)
+            if self.scales is not None and not ignore_scale:
+                kf_bone.setScale(self._keys(self.scales, self.scale_keys, self.scale_single_key, b, NoeVec3, hold),
+                                 noesis.NOEKF_SCALE_VECTOR_3)
+            kf_bones.append(kf_bone)
+        return kf_bones
+
+    def to_anim(self, bones, interpolation=None, ignore_scale=None):
+        """
+        Creates the NoeKeyFramedAnim of the track.
+        :type bones: list[NoeBone]
+        :rtype: NoeKeyFramedAnim
+        """
+        return NoeKeyFramedAnim(self.name, bones, self.to_keyframed_bones(interpolation, ignore_scale), 60)
+
+    @staticmethod
+    def _keys(values, keys, single_key, bone, value_type, hold):
+        key_frames = numpy.flatnonzero(keys[:, bone])
+        if len(key_frames) == 0 or single_key[bone]:
+            return []
+        if hold:
+            frames = range(key_frames[0], len(keys))
+        else:
+            frames = key_frames.tolist()
+        bone_values = values[:, bone].tolist()
+        return [NoeKeyFramedValue(f / 30.0, value_type(bone_values[f])) for f in frames]
+
+
+class PlmSkeleton:
+    """
+    Bone hierarchy and bind pose of a PLM chunk as arrays. Requires numpy.
+    Matrices are 4x4 with the translation in the last row, points are transformed as p @ m like NoeMat43.
+    Bone indices of -1 mark a missing parent, sibling or child.
+    :cvar flags: uint8 flag of each bone.
+    :cvar parents: int16 index of the parent of each bone.
+    :cvar next_siblings: int16 index of the next bone with the same parent.
+    :cvar first_children: int16 index of the first child of each bone.
+    :cvar skinned_vert_counts: uint16 number of PMM vertices bound to each bone.
+    :cvar depths: Depth of each bone in the hierarchy, 0 for root bones.
+    :cvar order: Bone indices with each parent before its children.
+    :cvar local_matrices: float32 array of shape (bones, 4, 4), transform of each bone in the space of its parent.
+    :cvar world_matrices: float32 array of shape (bones, 4, 4), transform of each bone in model space.
+    """
+
+    def __init__(self, records):
+        """
+        :type records: list[PlmBone]
+        :param records: Bones in file order, from plm_read_bone_records.
+        """
+        if numpy is None:
+            raise Exception("[PLM] numpy is required to build a PlmSkeleton")
+
+        num_bones = len(records)
+
+        def index_array(values):
+            array = numpy.array(values, dtype=numpy.int16).reshape(num_bones)
+            array[array >= num_bones] = -1
+            return array
+
+        self.flags = numpy.array([r.flag for r in records], dtype=numpy.uint8)
+        self.parents = index_array([r.parent_id for r in records])
+        self.next_siblings = index_array([r.next_sibling_id for r in records])
+        self.first_children = index_array([r.first_child_id for r in records])
+        self.skinned_vert_counts = numpy.array([r.skinned_vert_count for r in records], dtype=numpy.uint16)
+        self.depths = numpy.array(plm_bone_depths([r.parent_id for r in records]), dtype=numpy.intp)
+        self.order = numpy.argsort(self.depths, kind="stable")
+
+        quaternions = numpy.array([r.quaternion.quat for r in records], dtype=numpy.float32).reshape(num_bones, 4)
+        translations = numpy.array([r.translation.vec3 for r in records], dtype=numpy.float32).reshape(num_bones, 3)
+        scales = numpy.array([r.scale.vec3 for r in records], dtype=numpy.float32).reshape(num_bones, 3)
+        if PLM_IGNORE_SCALE:
+            scales[:] = 1
+        self.local_matrices = compose_matrices(quaternions, translations, scales, transposed=True)
+        self.world_matrices = self.to_world(self.local_matrices)
+
+    @property
+    def num_bones(self):
+        return len(self.parents)
+
+    def to_world(self, local_matrices):
+        """
+        Applies the parent transforms to local bone matrices, one level of the hierarchy at a time.
+        :type local_matrices: numpy.ndarray
+        :param local_matrices: Array of shape (..., bones, 4, 4), such as one set of matrices per frame.
+        :rtype: numpy.ndarray
+        :return: Array of the same shape, in model space.
+        """
+        world_matrices = numpy.array(local_matrices, copy=True)
+        for depth in range(1, int(self.depths.max(initial=0)) + 1):
+            bones = numpy.flatnonzero(self.depths == depth)
+            world_matrices[..., bones, :, :] = numpy.matmul(local_matrices[..., bones, :, :],
+                                                            world_matrices[..., self.parents[bones], :, :])
+        return world_matrices
+
+    def children(self, index):
+        """
+        Returns the children of the bone, following the first child and next sibling links.
+        :type index: int
+        :rtype: list[int]
+        """
+        children = []
+        child = self.first_children[index]
+        while child != -1 and len(children) < self.num_bones:
+            children.append(int(child))
+            child = self.next_siblings[child]
+        return children
+
+    def to_bones(self):
+        """
+        Creates the NoeBones in model space, like plm_read_bones.
+        :rtype: list[NoeBone]
+        """
+        bones = []
+        for i, matrix in enumerate(self.world_matrices.tolist()):
+            parent = int(self.parents[i])
+            parent = 0xFF if parent == -1 else parent
+            bones.append(NoeBone(i, "Bone {0}".format(i), NoeMat43([row[:3] for row in matrix]),
+                                 "Bone {0}".format(parent), parent))
+        return bones
+
+
+def quaternions_to_matrices(quaternions, transposed=False):
+    """
+    Array version of NoeQuat.toMat43 for any number of quaternions. Requires numpy.
+    :type quaternions: numpy.ndarray
+    :param quaternions: Array of shape (..., 4) of (x, y, z, w) quaternions.
+    :type transposed: bool
+    :param transposed: Like the transposed argument of toMat43, returns the inverse rotation.
+    :rtype: numpy.ndarray
+    :return: Array of shape (..., 3, 3).
+    """
+    x, y, z, w = numpy.moveaxis(quaternions, -1, 0)
+    rows = numpy.stack((
+        numpy.stack((1 - 2 * (y * y + z * z), 2 * (x * y + z * w), 2 * (x * z - y * w)), axis=-1),
+        numpy.stack((2 * (x * y - z * w), 1 - 2 * (x * x + z * z), 2 * (y * z + x * w)), axis=-1),
+        numpy.stack((2 * (x * z + y * w), 2 * (y * z - x * w), 1 - 2 * (x * x + y * y)), axis=-1),
+    ), axis=-2)
+    return numpy.swapaxes(rows, -1, -2) if transposed else rows
+
+
+def compose_matrices(quaternions, translations, scales=None, transposed=False):
+    """
+    Array version of compose_matrix. Requires numpy.
+    :type quaternions: numpy.ndarray
+    :param quaternions: Array of shape (..., 4).
+    :type translations: numpy.ndarray
+    :param translations: Array of shape (..., 3).
+    :type scales: numpy.ndarray
+    :param scales: Array of shape (..., 3), or None for no scale.
+    :type transposed: bool
+    :param transposed: Whether the rotations are transposed, like compose_matrix does for bind pose bones.
+    :rtype: numpy.ndarray
+    :return: float32 array of shape (..., 4, 4), with the translation in the last row.
+    """
+    shape = quaternions.shape[:-1]
+    matrices = numpy.zeros(shape + (4, 4), dtype=numpy.float32)
+    matrices[..., :3, :3] = quaternions_to_matrices(quaternions, transposed)
+    if scales is not None:
+        matrices[..., :3, :3] *= scales[..., :, None]
+    matrices[..., 3, :3] = translations
+    matrices[..., 3, 3] = 1
+    return matrices
+
+
 def read_quaternion(bs, version):
     """
     Reads a NoeQuat from the bitstream and returns it.
@@ -2,7 +2,8 @@ import string
 
 import fmt_smon_joker
 from inc_noesis import *
-from os.path import isfile, basename
+from os.path import isfile, basename, dirname
+from inc_smon import directory_cache, numpy, read_view
 from fmt_smon_plm import plm_check_type, load_plm_animation
 
 # -----------
@@ -49,12 +50,7 @@ def pmm_check_type(data):
 
     if len(data) < 8:
         return 0
-    bs = NoeBitStream(data)
-
-    pmm_header = bs.readBytes(3)
-    pmm_version = bs.readBytes(1)
-    print(pmm_header + pmm_version)
-    return pmm_check_signature(pmm_header, pmm_version, True)
+    return pmm_check_signature(bytes(data[:3]), bytes(data[3:4]), True)
 
 
 def pmm_check_signature(pmm_header, pmm_version, allow_cipher):
@@ -102,35 +98,45 @@ def pmm_check_ciphered(pmm_header):
     return 1 if pmm_header == PMM_HEADER_CIPHERED else 0
 
 
-def load_pmm_from_pmod(data, models):
+def load_pmm_from_pmod(data, models, filepath=None, vertex_counts=None):
     """
     For use by Noesis. Imports a .pmod file.
     :type models: list[NoeModel]
     :type data: bytes
+    :type filepath: str
+    :param filepath: Path of the .pmod file, used to find the .pliv and texture files. Defaults to the selected file.
+    :type vertex_counts: list[int]
+    :param vertex_counts: Appended with the vertex count of the model, read from the PMM data.
     :rtype: int
     """
 
+    if filepath is None:
+        filepath = noesis.getSelectedFile()
+
+    # The .pliv and texture are looked up in a listing of the directory instead of checking each name on disk
+    directory_cache.refresh(dirname(filepath))
+    exists = directory_cache.isfile
+
     bs = NoeBitStream(data)
     pmm_data = load_pmm_data(bs)
     model = pmm_data.construct_model()
 
-    plm_filepath = noesis.getSelectedFile()[:-5] + ".pliv"
-    if not isfile(plm_filepath):
+    plm_filepath = filepath[:-5] + ".pliv"
+    if not exists(plm_filepath):
         print("[ERROR] [PMM] Missing PLM file {0}".format(plm_filepath))
     else:
-        plm_file = open(plm_filepath, "rb")
-        plm_data = plm_file.read()
-        plm_file.close()
+        with open(plm_filepath, "rb") as plm_file:
+            plm_data = plm_file.read()
         if plm_check_type(plm_data):
             bones, animations = load_plm_animation(NoeBitStream(plm_data), pmm_data.scale_divider)
             model.setBones(bones)
             if animations is not None:
                 model.setAnims(animations)
 
-    tex_filepath = noesis.getSelectedFile()[:-5] + ".png"
-    if not isfile(tex_filepath):
-        tex_filepath = pmod_guess_texture_file(tex_filepath)
-    if not isfile(tex_filepath):
+    tex_filepath = filepath[:-5] + ".png"
+    if not exists(tex_filepath):
+        tex_filepath = pmod_guess_texture_file(tex_filepath, exists)
+    if not exists(tex_filepath):
         print("[ERROR] [Tex] Missing PNG file " + tex_filepath +
               "\nThis script expects .pngs to have identical names or same but ending in \"_water\"" +
               "\nYou will have to find the correct PNG file on your own." +
@@ -138,10 +144,8 @@ def load_pmm_from_pmod(data, models):
     else:
         diffuse_texture, alpha_texture = rapi.loadExternalTex(tex_filepath), None
         if diffuse_texture is None:
-            tex_file = open(tex_filepath, "rb")
-            tex_data = tex_file.read()
-            tex_file.close()
-
+            with open(tex_filepath, "rb") as tex_file:
+                tex_data = tex_file.read()
             diffuse_texture, alpha_texture = fmt_smon_joker.load_joker(NoeBitStream(tex_data))
         diffuse_texture.name = basename(tex_filepath)
         material_name = "Material_" + diffuse_texture.name
@@ -151,6 +155,8 @@ def load_pmm_from_pmod(data, models):
 
     print(plm_filepath)
     models.append(model)
+    if vertex_counts is not None:
+        vertex_counts.append(pmm_data.num_vertices)
     return 1
 
 
@@ -194,15 +200,15 @@ def load_pmm_data(bs):
         # print("[PMM:Unk4] {0}".format(bytes_str(unk4)))
 
     # print("[PMM:Data:Position] File Position: " + hex(bs.tell()))
-    pmm_data.position_bytes = bs.readBytes(pmm_data.num_vertices * 12)
+    pmm_data.position_bytes = read_view(bs, pmm_data.num_vertices * 12)
     # print("[PMM:Data:Normal] File Position: " + hex(bs.tell()))
-    pmm_data.normal_bytes = bs.readBytes(pmm_data.num_vertices * 3)
+    pmm_data.normal_bytes = read_view(bs, pmm_data.num_vertices * 3)
     # print("[PMM:Data:UV] File Position: " + hex(bs.tell()))
-    pmm_data.uv_bytes = bs.readBytes(pmm_data.num_vertices * 8)
+    pmm_data.uv_bytes = read_view(bs, pmm_data.num_vertices * 8)
     # print("[PMM:Data:Tri] File Position: " + hex(bs.tell()))
-    pmm_data.tri_indices = bs.readBytes(pmm_data.num_tris * 2)
+    pmm_data.tri_indices = read_view(bs, pmm_data.num_tris * 2)
     # print("[PMM:Data:Bone Weights] File Position: " + hex(bs.tell()))
-    pmm_data.bone_indices = bs.readBytes(pmm_data.num_vertices)
+    pmm_data.bone_indices = read_view(bs, pmm_data.num_vertices)
 
     return pmm_data
 
@@ -210,6 +216,7 @@ def load_pmm_data(bs):
 class PmmData:
     """
     Contains data stored in a Summoners War PMM chunk.
+    Buffers are kept as read, bytes or memoryviews of the chunk. The *_array methods decode them with numpy.
     :cvar num_tris: Number of tris in the model. Stored in file as ushort.
     :cvar num_vertices: Number of vertices in the model. Stored in file as ushort.
     :cvar scale_divider: Value to divide position_bytes data by. Stored in file as ushort.
@@ -218,21 +225,77 @@ class PmmData:
     :cvar uv_bytes: UV position data. Stored in file as 2x int per item.
     :cvar tri_indices: Triangle data. Stored in file as 3x ushort per item.
     :cvar bone_indices: Weights data. Stored in file as 1 ubyte per item. Index: vert index, value: bone index.
+    :cvar materials: NoeMaterials added with add_material.
     """
 
-    num_tris = 0
-    num_vertices = 0
-    scale_divider = 0
-    position_bytes = []
-    normal_bytes = []
-    uv_bytes = []
-    tri_indices = []
-    bone_indices = []
-    materials = []
+    __slots__ = ("num_tris", "num_vertices", "scale_divider", "position_bytes", "normal_bytes", "uv_bytes",
+                 "tri_indices", "bone_indices", "materials")
+
+    def __init__(self):
+        self.num_tris = 0
+        self.num_vertices = 0
+        self.scale_divider = 0
+        self.position_bytes = b""
+        self.normal_bytes = b""
+        self.uv_bytes = b""
+        self.tri_indices = b""
+        self.bone_indices = b""
+        self.materials = []
 
     def add_material(self, mat_name):
         self.materials.append(mat_name)
 
+    def share_buffers(self):
+        """
+        Returns a PmmData with the same counts and buffers, without copying them, and no materials.
+        :rtype: PmmData
+        """
+        pmm_data = PmmData()
+        for name in PmmData.__slots__:
+            if name != "materials":
+                setattr(pmm_data, name, getattr(self, name))
+        return pmm_data
+
+    def position_array(self):
+        """
+        Returns the vertex positions divided by scale_divider, like the position scale of construct_model.
+        :rtype: numpy.ndarray
+        :return: float32 array of shape (vertices, 3).
+        """
+        positions = _buffer_array(self.position_bytes, "<i4", self.num_vertices, 3)
+        return positions.astype(numpy.float32) / self.scale_divider
+
+    def normal_array(self):
+        """
+        Returns the vertex normals, normalized from signed bytes like construct_model.
+        :rtype: numpy.ndarray
+        :return: float32 array of shape (vertices, 3).
+        """
+        return _buffer_array(self.normal_bytes, "i1", self.num_vertices, 3).astype(numpy.float32) / 0x7F
+
+    def uv_array(self):
+        """
+        Returns the vertex UVs scaled by 1/0xFFFF, with V negated like the UV scale of construct_model.
+        :rtype: numpy.ndarray
+        :return: float32 array of shape (vertices, 2).
+        """
+        uvs = _buffer_array(self.uv_bytes, "<i4", self.num_vertices, 2)
+        return uvs.astype(numpy.float32) * numpy.array((1 / 0xFFFF, -1 / 0xFFFF), dtype=numpy.float32)
+
+    def tri_array(self):
+        """
+        :rtype: numpy.ndarray
+        :return: uint16 view of shape (tris / 3, 3) of the index buffer. num_tris is the number of indices.
+        """
+        return _buffer_array(self.tri_indices, "<u2", self.num_tris // 3, 3)
+
+    def bone_index_array(self):
+        """
+        :rtype: numpy.ndarray
+        :return: uint8 view of shape (vertices,) of the bone of each vertex.
+        """
+        return _buffer_array(self.bone_indices, "u1", self.num_vertices)
+
     def construct_model(self):
         """
         Constructs the model from member properties.
@@ -251,10 +314,23 @@ class PmmData:
 
         rapi.rpgCommitTriangles(self.tri_indices, noesis.RPGEODATA_USHORT, self.num_tris, noesis.RPGEO_TRIANGLE, 1)
         mdl = rapi.rpgConstructModel()
+        # The bound buffers may be views over a memory mapped file, which is closed once the model is built
+        rapi.rpgClearBufferBinds()
 
         return mdl
 
 
+def _buffer_array(buffer, dtype, count, components=None):
+    """
+    Returns a read-only numpy view of the first count items of the buffer, without copying it.
+    """
+    if numpy is None:
+        raise Exception("[PMM] numpy is required to decode buffers into arrays")
+    if components is None:
+        return numpy.frombuffer(buffer, dtype=dtype, count=count)
+    return numpy.frombuffer(buffer, dtype=dtype, count=count * components).reshape(count, components)
+
+
 def bytes_str(bit_array, split=1):
     """
     For debug purposes.
@@ -279,35 +355,126 @@ def bytes_str(bit_array, split=1):
     return out_string
 
 
-def pmod_guess_texture_file(filepath):
-    test = filepath + ""
-    guess_suffixes = ("", "_water", "_fire", "_wind", "_light", "_dark", "_ani")
-    try:
-        test = test[:-4].rstrip(string.digits) + ".png"
-        if isfile(test):
+def pmod_guess_texture_file(filepath, exists=isfile):
+    """
+    Guesses the texture of a .pmod file with a similar name.
+    :type filepath: str
+    :param filepath: Path of the .png file with the same name as the .pmod file.
+    :param exists: Called with each candidate path, returns whether the file exists.
+    :rtype: str
+    :return: The first candidate that exists, otherwise filepath.
+    """
+    for test in pmod_texture_candidates(filepath):
+        if exists(test):
             return test
+    return filepath
 
-        test = test[:-4]
-        for _ in range(6):
-            for suffix in guess_suffixes:
-                suffix_test = test + suffix + ".png"
-                if isfile(suffix_test):
-                    return suffix_test
-            test = test[:test.rindex("_")]
-        if not isfile(test):
-            return filepath
-        return test
-    except ValueError:
-        return filepath
+
+def pmod_texture_candidates(filepath):
+    """
+    Yields the paths guessed for the texture of a .pmod file, best guess first.
+    Trailing digits are removed first, then element suffixes are tried while removing one "_part" at a time.
+    :type filepath: str
+    :param filepath: Path of the .png file with the same name as the .pmod file.
+    :rtype: collections.Iterable[str]
+    """
+    guess_suffixes = ("", "_water", "_fire", "_wind", "_light", "_dark", "_ani")
+    test = filepath[:-4].rstrip(string.digits) + ".png"
+    yield test
+
+    test = test[:-4]
+    for _ in range(6):
+        for suffix in guess_suffixes:
+            yield test + suffix + ".png"
+        if "_" not in test:
+            return
+        test = test[:test.rindex("_")]
+    yield test
+
+
+# Size of the blocks used when deciphering a PMM chunk in pieces.
+PMM_CIPHER_BLOCK_SIZE = 0x10000
 
 
 def as_deciphered(ciphered_bytes):
-    size = len(ciphered_bytes)
-    deciphered = bytearray(size)
-    for i in range(size):
-        deciphered[i] = pmm_decipher[ciphered_bytes[i]]
+    """
+    Deciphers bytes from a ciphered PMM chunk.
+    :type ciphered_bytes: bytes | bytearray
+    :rtype: bytes | bytearray
+    :return: A deciphered copy of the same type as ciphered_bytes.
+    """
+
+    return ciphered_bytes.translate(pmm_decipher)
+
+
+def as_enciphered(deciphered_bytes):
+    """
+    Applies the PMM cipher to the bytes. Inverse of as_deciphered.
+    :type deciphered_bytes: bytes | bytearray
+    :rtype: bytes | bytearray
+    :return: A ciphered copy of the same type as deciphered_bytes.
+    """
+
+    return deciphered_bytes.translate(pmm_encipher)
+
+
+def iter_deciphered(ciphered_bytes, block_size=PMM_CIPHER_BLOCK_SIZE):
+    """
+    Deciphers the bytes in blocks of block_size, so that only one block is copied at a time.
+    :type ciphered_bytes: bytes | bytearray | memoryview
+    :type block_size: int
+    :rtype: collections.Iterable[bytes]
+    """
+
+    view = memoryview(ciphered_bytes)
+    for start in range(0, len(view), block_size):
+        yield view[start:start + block_size].tobytes().translate(pmm_decipher)
 
-    return deciphered
+
+def decipher_into(buffer, offset, size, block_size=PMM_CIPHER_BLOCK_SIZE, table=None):
+    """
+    Deciphers size bytes of a mutable buffer in place, one block at a time.
+    Only one block is allocated at a time, however large the chunk.
+    :type buffer: bytearray | mmap.mmap | memoryview
+    :param buffer: Writable buffer containing the ciphered PMM chunk.
+    :type offset: int
+    :param offset: Position of the PMM chunk in the buffer.
+    :type size: int
+    :param size: The size of the PMM chunk to decipher.
+    :type block_size: int
+    :param table: Translation table to apply. Defaults to pmm_decipher, use pmm_encipher to cipher the chunk instead.
+    """
+
+    table = pmm_decipher if table is None else table
+    end = offset + size
+    for start in range(offset, end, block_size):
+        stop = min(start + block_size, end)
+        block = buffer[start:stop]
+        if isinstance(block, memoryview):
+            block = block.tobytes()
+        buffer[start:stop] = block.translate(table)
+
+
+def decipher_stream(bs, size, block_size=PMM_CIPHER_BLOCK_SIZE):
+    """
+    Deciphers the PMM chunk at the current position of the bitstream, one block at a time.
+    The stream position is unchanged afterwards.
+    :type bs: NoeBitStream
+    :param bs: The bitstream containing the PMM chunk
+    :type size: int
+    :param size: The size of the PMM chunk to decipher
+    :type block_size: int
+    """
+
+    start = bs.tell()
+    remaining = size
+    while remaining > 0:
+        read_size = min(block_size, remaining)
+        block = bs.readBytes(read_size)
+        bs.seek(-read_size, NOESEEK_REL)
+        bs.writeBytes(block.translate(pmm_decipher))
+        remaining -= read_size
+    bs.seek(start, NOESEEK_ABS)
 
 
 pmm_decipher = bytearray([
@@ -327,4 +494,14 @@ pmm_decipher = bytearray([
     0x94, 0x5f, 0x45, 0x65, 0xf0, 0xb8, 0x34, 0xdd, 0x0b, 0xb1, 0x29, 0xe9, 0x2a, 0x75, 0x87, 0x39,  # D0-DF
     0xcf, 0x79, 0x93, 0xa1, 0xb2, 0x30, 0x15, 0x7a, 0x52, 0x12, 0x62, 0x36, 0xbf, 0x22, 0x4f, 0xc0,  # E0-EF
     0xa2, 0x17, 0xc8, 0x99, 0x3a, 0x60, 0xa9, 0xa0, 0x58, 0xf6, 0x0a, 0x9e, 0xf8, 0x6b, 0x26, 0x98   # F0-FF
-])
\ No newline at end of file
+])
+
+
+def _invert_table(table):
+    inverse = bytearray(len(table))
+    for i, value in enumerate(table):
+        inverse[value] = i
+    return inverse
+
+
+pmm_encipher = _invert_table(pmm_decipher)
\ No newline at end of file
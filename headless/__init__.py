@@ -0,0 +1,20 @@
+"""
+Stand-in for the parts of the Noesis Python API used by the Summoners War plugins,
+so the plugins can be imported and run by a regular Python interpreter.
+
+Call install() before importing the plugins. It does nothing if the real inc_noesis can be imported.
+"""
+import os
+import sys
+
+HEADLESS_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+
+def install():
+    """
+    Makes the stand-in inc_noesis, noesis and rapi modules importable, unless inc_noesis is already available.
+    """
+    try:
+        import inc_noesis
+    except ImportError:
+        sys.path.append(HEADLESS_DIRECTORY)
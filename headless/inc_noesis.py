@@ -0,0 +1,385 @@
+"""
+Stand-in for the inc_noesis module shipped with Noesis.
+Implements the subset of the API used by the Summoners War plugins.
+"""
+import math
+import struct
+
+import noesis
+import rapi
+
+NOESEEK_ABS = 0
+NOESEEK_REL = 1
+
+NOE_LITTLEENDIAN = 0
+NOE_BIGENDIAN = 1
+
+
+class NoeBitStream:
+    """
+    Reads and writes values from a copy of the data, like the Noesis bitstream.
+    Only byte-aligned reads are supported.
+    """
+
+    def __init__(self, data=None, bigEndian=NOE_LITTLEENDIAN):
+        self.data = bytearray(data) if data is not None else bytearray()
+        self.offset = 0
+        self.endian = ">" if bigEndian else "<"
+
+    def _unpack(self, fmt, size):
+        value = struct.unpack_from(self.endian + fmt, self.data, self.offset)[0]
+        self.offset += size
+        return value
+
+    def readBytes(self, size):
+        data = bytes(self.data[self.offset:self.offset + size])
+        self.offset += len(data)
+        return data
+
+    def readByte(self):
+        return self._unpack("b", 1)
+
+    def readUByte(self):
+        return self._unpack("B", 1)
+
+    def readShort(self):
+        return self._unpack("h", 2)
+
+    def readUShort(self):
+        return self._unpack("H", 2)
+
+    def readInt(self):
+        return self._unpack("i", 4)
+
+    def readUInt(self):
+        return self._unpack("I", 4)
+
+    def readFloat(self):
+        return self._unpack("f", 4)
+
+    def writeBytes(self, data):
+        size = len(data)
+        self.data[self.offset:self.offset + size] = data
+        self.offset += size
+
+    def tell(self):
+        return self.offset
+
+    def seek(self, offset, mode=NOESEEK_ABS):
+        self.offset = offset if mode == NOESEEK_ABS else self.offset + offset
+        return self.offset
+
+    def checkEOF(self):
+        return self.offset >= len(self.data)
+
+    def getSize(self):
+        return len(self.data)
+
+    def getBuffer(self, startOfs=None, endOfs=None):
+        return bytes(self.data[startOfs:endOfs])
+
+
+class NoeVec3:
+    def __init__(self, vec3=(0.0, 0.0, 0.0)):
+        self.vec3 = [float(vec3[0]), float(vec3[1]), float(vec3[2])]
+
+    @staticmethod
+    def fromBytes(data, bigEnd=NOE_LITTLEENDIAN):
+        return NoeVec3(struct.unpack((">" if bigEnd else "<") + "3f", data[:12]))
+
+    def toBytes(self):
+        return struct.pack("<3f", *self.vec3)
+
+    def __getitem__(self, index):
+        return self.vec3[index]
+
+    def __setitem__(self, index, value):
+        self.vec3[index] = float(value)
+
+    def __len__(self):
+        return 3
+
+    def __eq__(self, other):
+        return isinstance(other, NoeVec3) and self.vec3 == other.vec3
+
+    def __add__(self, other):
+        return NoeVec3([a + b for a, b in zip(self.vec3, other)])
+
+    def __sub__(self, other):
+        return NoeVec3([a - b for a, b in zip(self.vec3, other)])
+
+    def __mul__(self, other):
+        if isinstance(other, (NoeVec3, list, tuple)):
+            return NoeVec3([a * b for a, b in zip(self.vec3, other)])
+        return NoeVec3([a * other for a in self.vec3])
+
+    def __truediv__(self, other):
+        if isinstance(other, (NoeVec3, list, tuple)):
+            return NoeVec3([a / b for a, b in zip(self.vec3, other)])
+        return NoeVec3([a / other for a in self.vec3])
+
+    def __neg__(self):
+        return NoeVec3([-a for a in self.vec3])
+
+    def dot(self, other):
+        return sum(a * b for a, b in zip(self.vec3, other))
+
+    def length(self):
+        return math.sqrt(self.dot(self))
+
+    def getStorage(self):
+        return list(self.vec3)
+
+    def __repr__(self):
+        return "({0}, {1}, {2})".format(*self.vec3)
+
+
+class NoeQuat:
+    def __init__(self, quat=(0.0, 0.0, 0.0, 1.0)):
+        self.quat = [float(quat[0]), float(quat[1]), float(quat[2]), float(quat[3])]
+
+    @staticmethod
+    def fromBytes(data, bigEnd=NOE_LITTLEENDIAN):
+        return NoeQuat(struct.unpack((">" if bigEnd else "<") + "4f", data[:16]))
+
+    def toBytes(self):
+        return struct.pack("<4f", *self.quat)
+
+    def __getitem__(self, index):
+        return self.quat[index]
+
+    def __setitem__(self, index, value):
+        self.quat[index] = float(value)
+
+    def __len__(self):
+        return 4
+
+    def __eq__(self, other):
+        return isinstance(other, NoeQuat) and self.quat == other.quat
+
+    def __mul__(self, other):
+        if isinstance(other, NoeQuat):
+            x1, y1, z1, w1 = self.quat
+            x2, y2, z2, w2 = other.quat
+            return NoeQuat((w1 * x2 + x1 * w2 + y1 * z2 - z1 * y2,
+                            w1 * y2 - x1 * z2 + y1 * w2 + z1 * x2,
+                            w1 * z2 + x1 * y2 - y1 * x2 + z1 * w2,
+                            w1 * w2 - x1 * x2 - y1 * y2 - z1 * z2))
+        return NoeQuat([a * other for a in self.quat])
+
+    def __neg__(self):
+        return NoeQuat([-a for a in self.quat])
+
+    def normalize(self):
+        length = math.sqrt(sum(a * a for a in self.quat))
+        return NoeQuat([a / length for a in self.quat]) if length else NoeQuat()
+
+    def toMat43(self, transposed=0):
+        """
+        Returns the rotation as a matrix. Rows are the rotated basis vectors, points are transformed as p * m.
+        With transposed, the rows are swapped with the columns, which is the inverse rotation.
+        """
+        x, y, z, w = self.quat
+        rows = [[1.0 - 2.0 * (y * y + z * z), 2.0 * (x * y + z * w), 2.0 * (x * z - y * w)],
+                [2.0 * (x * y - z * w), 1.0 - 2.0 * (x * x + z * z), 2.0 * (y * z + x * w)],
+                [2.0 * (x * z + y * w), 2.0 * (y * z - x * w), 1.0 - 2.0 * (x * x + y * y)]]
+        if transposed:
+            rows = [list(column) for column in zip(*rows)]
+        return NoeMat43((NoeVec3(rows[0]), NoeVec3(rows[1]), NoeVec3(rows[2]), NoeVec3()))
+
+    def __repr__(self):
+        return "({0}, {1}, {2}, {3})".format(*self.quat)
+
+
+class NoeMat43:
+    """
+    4x3 matrix of rotation/scale rows followed by a translation row. Points are transformed as p * m.
+    """
+
+    def __init__(self, rows=None):
+        if rows is None:
+            rows = ((1.0, 0.0, 0.0), (0.0, 1.0, 0.0), (0.0, 0.0, 1.0), (0.0, 0.0, 0.0))
+        self.mat43 = [NoeVec3(row) for row in rows]
+
+    def __getitem__(self, index):
+        return self.mat43[index]
+
+    def __setitem__(self, index, value):
+        self.mat43[index] = NoeVec3(value)
+
+    def __len__(self):
+        return 4
+
+    def __mul__(self, other):
+        """
+        Concatenates the matrices: the result transforms by self, then by other.
+        """
+        rows = [other.transformNormal(self.mat43[i]) for i in range(3)]
+        rows.append(other.transformPoint(self.mat43[3]))
+        return NoeMat43(rows)
+
+    def transformPoint(self, point):
+        m = self.mat43
+        return NoeVec3([point[0] * m[0][i] + point[1] * m[1][i] + point[2] * m[2][i] + m[3][i] for i in range(3)])
+
+    def transformNormal(self, normal):
+        m = self.mat43
+        return NoeVec3([normal[0] * m[0][i] + normal[1] * m[1][i] + normal[2] * m[2][i] for i in range(3)])
+
+    def toBytes(self):
+        return b"".join(row.toBytes() for row in self.mat43)
+
+    def __repr__(self):
+        return "({0}, {1}, {2}, {3})".format(*self.mat43)
+
+
+class NoeBone:
+    def __init__(self, index, name, matrix, parentName=None, parentIndex=-1):
+        self.index = index
+        self.name = name
+        self._matrix = matrix
+        self.parentName = parentName
+        self.parentIndex = parentIndex
+
+    def getMatrix(self):
+        return self._matrix
+
+    def setMatrix(self, matrix):
+        self._matrix = matrix
+
+
+class NoeKeyFramedValue:
+    def __init__(self, time, value):
+        self.time = time
+        self.value = value
+
+
+class NoeKeyFramedBone:
+    def __init__(self, boneIndex):
+        self.boneIndex = boneIndex
+        self.rotationKeys = []
+        self.rotationInterpolation = noesis.NOEKF_INTERPOLATE_LINEAR
+        self.translationKeys = []
+        self.translationInterpolation = noesis.NOEKF_INTERPOLATE_LINEAR
+        self.scaleKeys = []
+        self.scaleType = noesis.NOEKF_SCALE_SCALAR_1
+        self.scaleInterpolation = noesis.NOEKF_INTERPOLATE_LINEAR
+
+    def setRotation(self, keys, rotationType=0, interpolationType=noesis.NOEKF_INTERPOLATE_LINEAR):
+        self.rotationKeys = keys
+        self.rotationInterpolation = interpolationType
+
+    def setTranslation(self, keys, translationType=0, interpolationType=noesis.NOEKF_INTERPOLATE_LINEAR):
+        self.translationKeys = keys
+        self.translationInterpolation = interpolationType
+
+    def setScale(self, keys, scaleType=noesis.NOEKF_SCALE_SCALAR_1,
+                 interpolationType=noesis.NOEKF_INTERPOLATE_LINEAR):
+        self.scaleKeys = keys
+        self.scaleType = scaleType
+        self.scaleInterpolation = interpolationType
+
+
+class NoeKeyFramedAnim:
+    def __init__(self, name, bones, kfBones, frameRate=20.0, flags=0):
+        self.name = name
+        self.bones = bones
+        self.kfBones = kfBones
+        self.frameRate = frameRate
+        self.flags = flags
+
+
+class NoeTexture:
+    def __init__(self, name, width, height, pixelData, pixelType=noesis.NOESISTEX_RGBA32):
+        self.name = name
+        self.width = width
+        self.height = height
+        self.pixelData = pixelData
+        self.pixelType = pixelType
+
+
+class NoeMaterial:
+    def __init__(self, name, texName):
+        self.name = name
+        self.texName = texName
+        self.opacityTexName = ""
+
+    def setTexture(self, texName):
+        self.texName = texName
+
+    def setOpacityTexture(self, texName):
+        self.opacityTexName = texName
+
+
+class NoeModelMaterials:
+    def __init__(self, texList, matList):
+        self.texList = texList
+        self.matList = matList
+
+
+class NoeMesh:
+    """
+    Mesh created by rapi.rpgConstructModel.
+    The bound buffers are kept as they were bound in buffers, and decoded into positions, normals, uvs, etc. on access.
+    """
+
+    def __init__(self, name="", matName="", buffers=None, indices=None):
+        self.name = name
+        self.matName = matName
+        self.buffers = buffers or {}
+        self._indices = indices
+        self._decoded = {}
+
+    def setName(self, name):
+        self.name = name
+
+    def setMaterial(self, matName):
+        self.matName = matName
+
+    def _decode(self, attribute):
+        if attribute not in self._decoded:
+            self._decoded[attribute] = rapi.decodeMeshBuffer(self.buffers.get(attribute))
+        return self._decoded[attribute]
+
+    @property
+    def positions(self):
+        return self._decode("position")
+
+    @property
+    def normals(self):
+        return self._decode("normal")
+
+    @property
+    def uvs(self):
+        return self._decode("uv1")
+
+    @property
+    def lmUVs(self):
+        return self._decode("uvx")
+
+    @property
+    def indices(self):
+        if self._indices is None:
+            return []
+        return list(rapi.decodeValues(*self._indices))
+
+    @property
+    def boneIndices(self):
+        return self._decode("bone_index")
+
+
+class NoeModel:
+    def __init__(self, meshes=None, bones=None, anims=None, modelMats=None):
+        self.meshes = meshes or []
+        self.bones = bones or []
+        self.anims = anims or []
+        self.modelMats = modelMats
+
+    def setBones(self, bones):
+        self.bones = bones
+
+    def setAnims(self, anims):
+        self.anims = anims
+
+    def setModelMaterials(self, modelMats):
+        self.modelMats = modelMats
@@ -0,0 +1,89 @@
+"""
+Stand-in for the noesis module built into Noesis.
+Handler and tool registration is accepted and ignored, logging goes to stdout.
+"""
+import os
+
+NOESISTEX_UNKNOWN = -1
+NOESISTEX_RGBA32 = 0
+
+RPGEODATA_FLOAT = 0
+RPGEODATA_INT = 1
+RPGEODATA_UINT = 2
+RPGEODATA_SHORT = 3
+RPGEODATA_USHORT = 4
+RPGEODATA_HALFFLOAT = 5
+RPGEODATA_DOUBLE = 6
+RPGEODATA_BYTE = 7
+RPGEODATA_UBYTE = 8
+
+RPGEO_NONE = 0
+RPGEO_POINTS = 1
+RPGEO_TRIANGLE = 2
+RPGEO_TRIANGLE_STRIP = 3
+
+NOEKF_INTERPOLATE_LINEAR = 0
+NOEKF_INTERPOLATE_NEAREST = 1
+
+NOEKF_SCALE_SCALAR_1 = 0
+NOEKF_SCALE_SINGLE = 1
+NOEKF_SCALE_VECTOR_3 = 2
+NOEKF_SCALE_TRANSPOSED_VECTOR_3 = 3
+
+_handles = []
+_selected_file = ""
+
+
+def register(name, extensions):
+    _handles.append((name, extensions))
+    return len(_handles) - 1
+
+
+def registerTool(name, method, help_text=None):
+    _handles.append((name, method))
+    return len(_handles) - 1
+
+
+def setHandlerTypeCheck(handle, method):
+    pass
+
+
+def setHandlerLoadModel(handle, method):
+    pass
+
+
+def setHandlerLoadRGBA(handle, method):
+    pass
+
+
+def setToolSubMenuName(handle, name):
+    pass
+
+
+def checkToolMenuItem(handle, checked):
+    pass
+
+
+def logPopup():
+    pass
+
+
+def logError(message):
+    print(message, end="")
+
+
+def getSelectedFile():
+    return _selected_file
+
+
+def getSelectedDirectory():
+    return os.path.dirname(_selected_file)
+
+
+def setSelectedFile(filepath):
+    """
+    Not part of the Noesis API. Sets the file returned by getSelectedFile and getSelectedDirectory.
+    :type filepath: str
+    """
+    global _selected_file
+    _selected_file = filepath
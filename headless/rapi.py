@@ -0,0 +1,243 @@
+"""
+Stand-in for the rapi module built into Noesis.
+The geometry context keeps the bound buffers as-is, and rpgConstructModel hands them to the constructed meshes.
+Textures are decoded with Pillow when it is installed, otherwise the encoded image data is kept.
+"""
+import io
+import os
+import struct
+
+import inc_noesis
+import noesis
+
+_DATA_TYPES = {
+    noesis.RPGEODATA_FLOAT: ("f", 1.0),
+    noesis.RPGEODATA_INT: ("i", float(0x7FFFFFFF)),
+    noesis.RPGEODATA_UINT: ("I", float(0xFFFFFFFF)),
+    noesis.RPGEODATA_SHORT: ("h", float(0x7FFF)),
+    noesis.RPGEODATA_USHORT: ("H", float(0xFFFF)),
+    noesis.RPGEODATA_HALFFLOAT: ("e", 1.0),
+    noesis.RPGEODATA_DOUBLE: ("d", 1.0),
+    noesis.RPGEODATA_BYTE: ("b", float(0x7F)),
+    noesis.RPGEODATA_UBYTE: ("B", float(0xFF)),
+}
+
+# Not part of the Noesis API. loadTexByHandler keeps no state between calls and Pillow releases the GIL while
+# decoding, so fmt_smon_dat.decode_images may call it from several threads.
+THREAD_SAFE_TEXTURE_DECODE = True
+
+
+class MeshBuffer:
+    """
+    A buffer bound to the geometry context.
+    :cvar data: The data as it was bound.
+    :cvar data_type: One of the noesis.RPGEODATA_* values.
+    :cvar stride: Bytes between the start of each element.
+    :cvar components: Number of values per element.
+    :cvar scale: Scale applied to each decoded element, or None.
+    :cvar bias: Bias added to each decoded element, or None.
+    :cvar normalize: Whether integer values are divided by the maximum value of their type.
+    """
+
+    def __init__(self, data, data_type, stride, components, scale=None, bias=None, normalize=False):
+        self.data = data
+        self.data_type = data_type
+        self.stride = stride
+        self.components = components
+        self.scale = scale
+        self.bias = bias
+        self.normalize = normalize
+
+    def count(self):
+        """
+        :rtype: int
+        :return: Number of elements in the data, counted from its size without decoding it.
+        """
+        if not self.stride:
+            return 0
+        element_size = struct.calcsize(_DATA_TYPES[self.data_type][0]) * self.components
+        count = len(self.data) // self.stride
+        if len(self.data) - count * self.stride >= element_size:
+            count += 1
+        return count
+
+
+class _Context:
+    def __init__(self):
+        self.buffers = {}
+        self.pos_scale = None
+        self.pos_bias = None
+        self.uv_scale = None
+        self.uv_bias = None
+        self.material = ""
+        self.meshes = []
+
+
+_context = None
+
+
+def _bind(attribute, buffer):
+    if buffer.data is None:
+        _context.buffers.pop(attribute, None)
+    else:
+        _context.buffers[attribute] = buffer
+
+
+def rpgCreateContext():
+    global _context
+    _context = _Context()
+
+
+def rpgBindPositionBuffer(data, dataType, stride):
+    _bind("position", MeshBuffer(data, dataType, stride, 3))
+
+
+def rpgBindNormalBuffer(data, dataType, stride):
+    _bind("normal", MeshBuffer(data, dataType, stride, 3, normalize=True))
+
+
+def rpgBindUV1Buffer(data, dataType, stride):
+    _bind("uv1", MeshBuffer(data, dataType, stride, 2))
+
+
+def rpgBindUVXBuffer(data, dataType, stride, slot, count):
+    _bind("uvx", MeshBuffer(data, dataType, stride, 2))
+
+
+def rpgBindBoneIndexBuffer(data, dataType, stride, count):
+    _bind("bone_index", MeshBuffer(data, dataType, stride, count))
+
+
+def rpgSetPosScaleBias(scale, bias):
+    _context.pos_scale = scale
+    _context.pos_bias = bias
+
+
+def rpgSetUVScaleBias(scale, bias):
+    _context.uv_scale = scale
+    _context.uv_bias = bias
+
+
+def rpgSetMaterial(name):
+    _context.material = name
+
+
+def rpgCommitTriangles(data, dataType, numIdx, primType, usePlotMap=0):
+    # Like Noesis, the mesh keeps a copy of the bound data, so the bound buffers can be released once committed
+    buffers = {}
+    for attribute, buffer in _context.buffers.items():
+        scale, bias = None, None
+        if attribute == "position":
+            scale, bias = _context.pos_scale, _context.pos_bias
+        elif attribute == "uv1":
+            scale, bias = _context.uv_scale, _context.uv_bias
+        buffers[attribute] = MeshBuffer(bytes(buffer.data), buffer.data_type, buffer.stride, buffer.components,
+                                        scale, bias, buffer.normalize)
+    indices = (bytes(data), dataType, numIdx) if data is not None else None
+    _context.meshes.append(inc_noesis.NoeMesh("mesh{0}".format(len(_context.meshes)), _context.material,
+                                              buffers, indices))
+
+
+def rpgClearBufferBinds():
+    _context.buffers.clear()
+
+
+def rpgConstructModel():
+    return inc_noesis.NoeModel(list(_context.meshes))
+
+
+def decodeValues(data, dataType, count, stride=None, offset=0):
+    """
+    Not part of the Noesis API. Decodes count values of the data type from the data.
+    :rtype: tuple
+    """
+    fmt, _ = _DATA_TYPES[dataType]
+    size = struct.calcsize(fmt)
+    if stride is None or stride == size:
+        return struct.unpack_from("<{0}{1}".format(count, fmt), data, offset)
+    return tuple(struct.unpack_from("<" + fmt, data, offset + i * stride)[0] for i in range(count))
+
+
+def decodeMeshBuffer(buffer):
+    """
+    Not part of the Noesis API. Decodes a bound buffer into a list of NoeVec3, applying its scale and bias.
+    :type buffer: MeshBuffer | None
+    :rtype: list[NoeVec3]
+    """
+    if buffer is None:
+        return []
+    fmt, type_max = _DATA_TYPES[buffer.data_type]
+    count = buffer.count()
+    element = struct.Struct("<{0}{1}".format(buffer.components, fmt))
+    divisor = type_max if buffer.normalize else 1.0
+    scale = buffer.scale
+    bias = buffer.bias
+    values = []
+    for i in range(count):
+        raw = [v / divisor for v in element.unpack_from(buffer.data, i * buffer.stride)]
+        raw += [0.0] * (3 - len(raw))
+        value = inc_noesis.NoeVec3(raw[:3])
+        if scale is not None:
+            value = value * scale
+        if bias is not None:
+            value = value + bias
+        values.append(value)
+    return values
+
+
+def loadTexByHandler(data, extension):
+    """
+    Decodes the image with Pillow if available.
+    Without Pillow, returns an undecoded texture holding the image file data.
+    :rtype: NoeTexture | None
+    """
+    data = bytes(data)
+    try:
+        from PIL import Image
+    except ImportError:
+        if not _looks_like_image(data):
+            return None
+        return inc_noesis.NoeTexture("", 0, 0, data, noesis.NOESISTEX_UNKNOWN)
+    try:
+        image = Image.open(io.BytesIO(data)).convert("RGBA")
+    except Exception:
+        return None
+    return inc_noesis.NoeTexture("", image.width, image.height, image.tobytes(), noesis.NOESISTEX_RGBA32)
+
+
+def loadExternalTex(filepath):
+    with open(filepath, "rb") as f:
+        data = f.read()
+    texture = loadTexByHandler(data, os.path.splitext(filepath)[1])
+    if texture is not None:
+        texture.name = os.path.basename(filepath)
+    return texture
+
+
+def _looks_like_image(data):
+    return data.startswith(b"\x89PNG") or data.startswith(b"\xFF\xD8")
+
+
+def imageGetTexRGBA(texture):
+    if texture.pixelType != noesis.NOESISTEX_RGBA32:
+        raise Exception("[rapi] Texture {0} is not decoded, Pillow is required to decode images".format(texture.name))
+    return texture.pixelData
+
+
+def imageResample(data, srcWidth, srcHeight, dstWidth, dstHeight):
+    """
+    Resamples RGBA32 data, with Pillow if available, otherwise with nearest neighbour sampling.
+    :rtype: bytes
+    """
+    try:
+        from PIL import Image
+    except ImportError:
+        output = bytearray()
+        for y in range(dstHeight):
+            row_start = (y * srcHeight // dstHeight) * srcWidth * 4
+            for x in range(dstWidth):
+                pixel_start = row_start + (x * srcWidth // dstWidth) * 4
+                output += data[pixel_start:pixel_start + 4]
+        return bytes(output)
+    image = Image.frombytes("RGBA", (srcWidth, srcHeight), bytes(data))
+    return image.resize((dstWidth, dstHeight)).tobytes()
@@ -0,0 +1,307 @@
+import mmap
+import os
+import struct
+from collections import OrderedDict
+
+from inc_noesis import *
+
+try:
+    import numpy
+except ImportError:
+    # numpy is not available in Noesis, it is only needed by the array decoders and the headless tools
+    numpy = None
+
+
+# ----------
+# Helpers shared by the Summoners War plugins.
+# ----------
+
+
+# Default maximum size of the textures kept by TextureCache
+TEXTURE_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+# Default maximum number of directory listings kept by DirectoryCache
+DIRECTORY_CACHE_MAX_DIRECTORIES = 1024
+
+
+def peek_bytes(bs, size):
+    """
+    Reads bytes from the bitstream without advancing its position.
+    :type bs: NoeBitStream
+    :type size: int
+    :rtype: bytes
+    """
+    data = bs.readBytes(size)
+    bs.seek(-len(data), NOESEEK_REL)
+    return data
+
+
+def read_view(bs, size):
+    """
+    Reads bytes from the bitstream, without copying them if the stream is a MappedStream.
+    :type bs: NoeBitStream | MappedStream
+    :type size: int
+    :rtype: bytes | memoryview
+    """
+    if isinstance(bs, MappedStream):
+        return bs.readView(size)
+    return bs.readBytes(size)
+
+
+class MappedStream:
+    """
+    Reads values from a buffer without copying it, with the same methods as the NoeBitStream reads used by the
+    parsers. Files are opened as a read-only memory map, so pages are only read from disk when accessed.
+    readView returns a memoryview over the buffer instead of a copy.
+    Can be used as a context manager, which closes the stream on exit.
+    :cvar writable: Whether writeBytes can modify the buffer.
+    """
+
+    def __init__(self, data, offset=0, size=None):
+        """
+        :type data: bytes | bytearray | memoryview | mmap.mmap
+        :type offset: int
+        :param offset: Position of the first byte of the stream in the buffer.
+        :type size: int
+        :param size: Size of the stream. Defaults to the rest of the buffer.
+        """
+        self.data = data
+        view = memoryview(data)
+        self.view = view[offset:] if size is None else view[offset:offset + size]
+        self.writable = not self.view.readonly
+        self.offset = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            self.close()
+        except BufferError:
+            # The traceback still references views read from the stream, the map is closed once they are released
+            if exc_type is None:
+                raise
+
+    @classmethod
+    def from_file(cls, filepath):
+        """
+        :type filepath: str
+        :rtype: MappedStream
+        """
+        with open(filepath, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return cls(b"")
+            # Unless closed, the map stays open for as long as the stream or a view read from it is referenced
+            return cls(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def close(self):
+        """
+        Not part of the NoeBitStream API. Releases the view over the buffer, and closes the memory map if created by
+        from_file. Views read from the stream must be released first.
+        """
+        self.view.release()
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+
+    def _unpack(self, fmt, size):
+        value = struct.unpack_from(fmt, self.view, self.offset)[0]
+        self.offset += size
+        return value
+
+    def readView(self, size):
+        """
+        Not part of the NoeBitStream API. Reads bytes as a memoryview over the buffer.
+        :type size: int
+        :rtype: memoryview
+        """
+        data = self.view[self.offset:self.offset + size]
+        self.offset += len(data)
+        return data
+
+    def readBytes(self, size):
+        return self.readView(size).tobytes()
+
+    def readByte(self):
+        return self._unpack("<b", 1)
+
+    def readUByte(self):
+        return self._unpack("<B", 1)
+
+    def readShort(self):
+        return self._unpack("<h", 2)
+
+    def readUShort(self):
+        return self._unpack("<H", 2)
+
+    def readInt(self):
+        return self._unpack("<i", 4)
+
+    def readUInt(self):
+        return self._unpack("<I", 4)
+
+    def readFloat(self):
+        return self._unpack("<f", 4)
+
+    def writeBytes(self, data):
+        if not self.writable:
+            raise Exception("[MappedStream] Stream is read-only")
+        size = len(data)
+        self.view[self.offset:self.offset + size] = data
+        self.offset += size
+
+    def tell(self):
+        return self.offset
+
+    def seek(self, offset, mode=NOESEEK_ABS):
+        self.offset = offset if mode == NOESEEK_ABS else self.offset + offset
+        return self.offset
+
+    def checkEOF(self):
+        return self.offset >= len(self.view)
+
+    def getSize(self):
+        return len(self.view)
+
+    def getBuffer(self, startOfs=None, endOfs=None):
+        return self.view[startOfs:endOfs].tobytes()
+
+
+def access_bit(data, num):
+    """
+    Returns the value of a bit in a bitarray. Bits are numbered from the least significant bit of each byte.
+    Example: for the bytes [0x05, 0x01], bits 0, 2 and 8 are set.
+    :type data: bytes | bytearray
+    :type num: int
+    :param num: Index of the bit.
+    :rtype: int
+    :return: 1 if the bit is set, otherwise 0.
+    """
+    return (data[num >> 3] >> (num & 7)) & 1
+
+
+class TextureCache:
+    """
+    Textures loaded with rapi.loadExternalTex, keyed by path and modification time.
+    Each texture is decoded once and the same NoeTexture is returned to every caller, which must not modify it.
+    The least recently used textures are dropped once the decoded size goes over max_bytes.
+    The cache lives as long as its owner, such as a single fid_load_model or a batch of files.
+    """
+
+    def __init__(self, max_bytes=TEXTURE_CACHE_MAX_BYTES):
+        """
+        :type max_bytes: int
+        :param max_bytes: Maximum total size of the pixel data of the cached textures.
+        """
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._textures = OrderedDict()
+
+    def load(self, filepath):
+        """
+        Returns the texture of the file, loading it if not already cached.
+        :type filepath: str
+        :rtype: NoeTexture | None
+        :return: The shared texture, or None if the file does not exist or could not be loaded.
+        """
+        path = os.path.normcase(os.path.abspath(filepath))
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            return None
+
+        key = (path, mtime)
+        if key in self._textures:
+            self._textures.move_to_end(key)
+            self.hits += 1
+            return self._textures[key]
+
+        self.misses += 1
+        texture = rapi.loadExternalTex(filepath)
+        if texture is None:
+            return None
+        self._textures[key] = texture
+        self.size += _texture_size(texture)
+        # Keep at least the texture just loaded, even if it is larger than max_bytes
+        while self.size > self.max_bytes and len(self._textures) > 1:
+            _, evicted = self._textures.popitem(last=False)
+            self.size -= _texture_size(evicted)
+        return texture
+
+    def clear(self):
+        self._textures.clear()
+        self.size = 0
+
+
+def _texture_size(texture):
+    return len(texture.pixelData) if texture.pixelData is not None else 0
+
+
+class DirectoryCache:
+    """
+    Listings of directories, so checking whether many files exist takes one listing per directory
+    instead of one system call per file.
+    Listings are only checked against the modification time of their directory by refresh.
+    """
+
+    def __init__(self, max_directories=DIRECTORY_CACHE_MAX_DIRECTORIES):
+        """
+        :type max_directories: int
+        :param max_directories: Maximum number of directory listings kept.
+        """
+        self.max_directories = max_directories
+        self.listings = 0
+        self._directories = OrderedDict()
+
+    def refresh(self, directory):
+        """
+        Lists the directory again if it changed since it was listed.
+        :type directory: str
+        """
+        directory = os.path.normcase(os.path.abspath(directory))
+        cached = self._directories.get(directory)
+        if cached is None:
+            self._list(directory)
+            return
+        try:
+            mtime = os.stat(directory).st_mtime_ns
+        except OSError:
+            mtime = None
+        if cached[0] != mtime:
+            self._list(directory)
+
+    def isfile(self, filepath):
+        """
+        Same as os.path.isfile, answered from the listing of the directory of the file.
+        :type filepath: str
+        :rtype: bool
+        """
+        directory, name = os.path.split(os.path.normcase(os.path.abspath(filepath)))
+        cached = self._directories.get(directory)
+        if cached is None:
+            cached = self._list(directory)
+        else:
+            self._directories.move_to_end(directory)
+        return name in cached[1]
+
+    def _list(self, directory):
+        self.listings += 1
+        try:
+            mtime = os.stat(directory).st_mtime_ns
+            with os.scandir(directory) as entries:
+                names = frozenset(os.path.normcase(entry.name) for entry in entries if entry.is_file())
+        except OSError:
+            mtime, names = None, frozenset()
+        self._directories[directory] = cached = (mtime, names)
+        self._directories.move_to_end(directory)
+        while len(self._directories) > self.max_directories:
+            self._directories.popitem(last=False)
+        return cached
+
+    def clear(self):
+        self._directories.clear()
+
+
+# Shared by all loads in this session
+directory_cache = DirectoryCache()
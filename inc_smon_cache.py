@@ -0,0 +1,413 @@
+import hashlib
+import mmap
+import os
+import struct
+from array import array
+
+import fmt_smon_joker
+import fmt_smon_plm
+import inc_smon_pose
+from inc_noesis import *
+from inc_smon import numpy
+from fmt_smon_pmm import PmmData, load_pmm_data, pmm_check_ciphered, decipher_into
+
+
+# ----------
+# Persistent cache of decoded PMM, PLM and Joker chunks, and of the animation bounds of models.
+#
+# Entries are keyed by a hash of the chunk data and the plugin options that affect decoding.
+# Animations are stored as the arrays of PlmSkeleton and PlmTrack, so a warm load creates no per-key objects.
+# Each entry is a single file of named sections that is memory mapped when read, and closed once the sections
+# are copied out:
+# 6 bytes magic, 4 bytes section count, then for each section:
+#     1 byte name length, name, 1 byte array typecode, 4 bytes offset, 4 bytes size
+# followed by the section data, each section aligned to 8 bytes.
+# ----------
+
+
+# Part of every key, bumped whenever the layout or the decoded values change
+CACHE_MAGIC = b"SMONC\x03"
+CACHE_EXTENSION = ".smc"
+CACHE_DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+
+# Fraction of max_bytes an eviction after a write shrinks the cache to, so that the next writes do not evict again
+CACHE_EVICT_TARGET = 0.9
+
+# Arrays of PlmSkeleton and their dtypes
+_SKELETON_ARRAYS = (("flags", "u1"), ("parents", "i2"), ("next_siblings", "i2"), ("first_children", "i2"),
+                    ("skinned_vert_counts", "u2"), ("depths", "intp"), ("order", "intp"),
+                    ("local_matrices", "f4"), ("world_matrices", "f4"))
+
+# Arrays of PlmTrack and their dtypes, concatenated over the tracks. Scales are only stored by some PLM versions.
+_TRACK_ARRAYS = (("rotations", "f4"), ("translations", "f4"), ("rotation_keys", "?"), ("translation_keys", "?"),
+                 ("rotation_single_key", "?"), ("translation_single_key", "?"), ("scale_single_key", "?"))
+_TRACK_SCALE_ARRAYS = (("scales", "f4"), ("scale_keys", "?"))
+
+
+class ModelCache:
+    """
+    On-disk cache around load_pmm_data, load_plm_skeleton, load_joker and animation_bounds.
+    Files are evicted least recently used first once the cache grows over max_bytes, down to CACHE_EVICT_TARGET
+    of max_bytes. The total size is tracked as files are written, so the directory is only listed when evicting. Files written
+    by other processes are counted at the next listing.
+    Buffers of cached results are memoryviews over copies of the cache file sections, so no file stays mapped.
+    :cvar hits: Number of loads served from the cache.
+    :cvar misses: Number of loads that decoded the chunk.
+    """
+
+    def __init__(self, directory, max_bytes=CACHE_DEFAULT_MAX_BYTES):
+        """
+        :type directory: str
+        :type max_bytes: int
+        :param max_bytes: Maximum total size of the cache files.
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        # Total size of the cache files, None until the directory is first listed
+        self._size = None
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    # ================================== PMM data ================================== #
+
+    def load_pmm_data(self, chunk):
+        """
+        Cached load_pmm_data. The chunk may be ciphered.
+        :type chunk: bytes | bytearray | memoryview
+        :param chunk: Data of the PMM chunk.
+        :rtype: PmmData
+        """
+        key = self._key("pmm", chunk)
+        sections = self._read(key)
+        if sections is not None:
+            return _pmm_from_sections(sections)
+
+        if pmm_check_ciphered(bytes(chunk[:3])):
+            chunk = bytearray(chunk)
+            decipher_into(chunk, 0, len(chunk))
+        pmm_data = load_pmm_data(NoeBitStream(bytes(chunk)))
+        self._write(key, _pmm_to_sections(pmm_data))
+        return pmm_data
+
+    # ================================== PLM data ================================== #
+
+    def load_plm_skeleton(self, chunk, scale_divider, read_tracks=True):
+        """
+        Cached load_plm_skeleton. Requires numpy.
+        The NoeBones and NoeKeyFramedAnims are created on demand with PlmSkeleton.to_bones and PlmTrack.to_anim.
+        The result depends on PLM_IGNORE_SCALE, which is part of the key.
+        :type chunk: bytes | bytearray | memoryview
+        :param chunk: Data of the PLM chunk.
+        :type scale_divider: int
+        :param scale_divider: Value from PMM chunk.
+        :type read_tracks: bool
+        :param read_tracks: Whether to decode the animations. When False, the returned list of tracks is empty.
+        :rtype: tuple[PlmSkeleton, list[PlmTrack]]
+        """
+        options = (scale_divider, read_tracks, fmt_smon_plm.PLM_IGNORE_SCALE)
+        key = self._key("plm", chunk, options)
+        sections = self._read(key)
+        if sections is not None:
+            return _skeleton_from_sections(sections)
+
+        skeleton, tracks = fmt_smon_plm.load_plm_skeleton(NoeBitStream(bytes(chunk)), scale_divider, read_tracks)
+        self._write(key, _skeleton_to_sections(skeleton, tracks))
+        return skeleton, tracks
+
+    # ============================== Animation bounds ============================== #
+
+    def load_animation_bounds(self, pmm_chunk, plm_chunk):
+        """
+        Cached animation_bounds of the model made of the PMM and PLM chunks. Requires numpy.
+        The result depends on PLM_IGNORE_SCALE and PLM_INTERPOLATE_TYPE, which are part of the key.
+        :type pmm_chunk: bytes | bytearray | memoryview
+        :param pmm_chunk: Data of the PMM chunk, may be ciphered.
+        :type plm_chunk: bytes | bytearray | memoryview
+        :param plm_chunk: Data of the PLM chunk.
+        :rtype: list[numpy.ndarray]
+        :return: float32 array of shape (frames, 2, 3) for each animation, see frame_bounds.
+        """
+        options = (hashlib.sha1(plm_chunk).hexdigest(), fmt_smon_plm.PLM_IGNORE_SCALE,
+                   fmt_smon_plm.PLM_INTERPOLATE_TYPE)
+        key = self._key("bounds", pmm_chunk, options)
+        sections = self._read(key)
+        if sections is not None:
+            return _bounds_from_sections(sections)
+
+        pmm_data = self.load_pmm_data(pmm_chunk)
+        skeleton, tracks = self.load_plm_skeleton(plm_chunk, pmm_data.scale_divider)
+        bounds = inc_smon_pose.animation_bounds(pmm_data, skeleton, tracks)
+        self._write(key, _bounds_to_sections(bounds))
+        return bounds
+
+    # ================================= Joker data ================================= #
+
+    def load_joker(self, chunk):
+        """
+        Cached load_joker.
+        The result depends on JOKER_COMBINE_ALPHA, which is part of the key.
+        :type chunk: bytes | bytearray | memoryview
+        :param chunk: Data of the Joker chunk.
+        :rtype: tuple[NoeTexture | None, NoeTexture | None]
+        """
+        combine_alpha = fmt_smon_joker.JOKER_COMBINE_ALPHA
+        key = self._key("joker", chunk, (combine_alpha,))
+        sections = self._read(key)
+        if sections is not None:
+            return _texture_from_sections(sections, "diffuse"), _texture_from_sections(sections, "alpha")
+
+        diffuse, alpha = fmt_smon_joker.load_joker(NoeBitStream(bytes(chunk)), combine_alpha)
+        self._write(key, _texture_to_sections(diffuse, "diffuse") + _texture_to_sections(alpha, "alpha"))
+        return diffuse, alpha
+
+    # ================================== Storage =================================== #
+
+    def _key(self, kind, chunk, options=()):
+        digest = hashlib.sha1(CACHE_MAGIC)
+        digest.update(chunk)
+        digest.update(repr(options).encode())
+        return kind + "_" + digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + CACHE_EXTENSION)
+
+    def _read(self, key):
+        path = self._path(key)
+        try:
+            sections = read_cache_file(path)
+        except (IOError, OSError, ValueError):
+            self.misses += 1
+            return None
+        # Marks the file as recently used for eviction
+        os.utime(path, None)
+        self.hits += 1
+        return sections
+
+    def _write(self, key, sections):
+        path = self._path(key)
+        temp_path = "{0}.{1}.tmp".format(path, os.getpid())
+        write_cache_file(temp_path, sections)
+        if self._size is None:
+            self._size = self.size()
+        try:
+            # Replacing an entry written meanwhile by another process
+            self._size -= os.path.getsize(path)
+        except OSError:
+            pass
+        self._size += os.path.getsize(temp_path)
+        os.replace(temp_path, path)
+        if self._size > self.max_bytes:
+            self.evict(int(self.max_bytes * CACHE_EVICT_TARGET))
+
+    def size(self):
+        """
+        :rtype: int
+        :return: Total size of the cache files.
+        """
+        self._size = sum(size for _, size, _ in self._entries())
+        return self._size
+
+    def evict(self, max_bytes=None):
+        """
+        Deletes least recently used files until the cache is no larger than max_bytes.
+        :type max_bytes: int
+        :param max_bytes: Defaults to the max_bytes of the cache.
+        """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        entries = sorted(self._entries(), key=lambda entry: entry[2])
+        total = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if total <= max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                # Still mapped by another reader on Windows, try again on a later eviction
+                pass
+        self._size = total
+
+    def clear(self):
+        self.evict(0)
+
+    def _entries(self):
+        for filename in os.listdir(self.directory):
+            if filename.endswith(CACHE_EXTENSION):
+                path = os.path.join(self.directory, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                yield path, stat.st_size, stat.st_mtime
+
+
+def write_cache_file(path, sections):
+    """
+    Writes the sections to a cache file.
+    :type path: str
+    :type sections: list[tuple[str, array]]
+    :param sections: Name and data of each section. bytes are written as an array of typecode B.
+    """
+    table_size = len(CACHE_MAGIC) + 4 + sum(1 + len(name.encode()) + 1 + 8 for name, _ in sections)
+    offset = _align(table_size)
+    table = [CACHE_MAGIC, struct.pack("<I", len(sections))]
+    blobs = []
+    for name, data in sections:
+        typecode = data.typecode if isinstance(data, array) else "B"
+        blob = data.tobytes() if isinstance(data, array) else bytes(data)
+        name_bytes = name.encode()
+        table.append(struct.pack("<B", len(name_bytes)) + name_bytes + typecode.encode() +
+                     struct.pack("<II", offset, len(blob)))
+        padding = _align(len(blob)) - len(blob)
+        blobs.append(blob + b"\x00" * padding)
+        offset += len(blob) + padding
+
+    with open(path, "wb") as f:
+        header = b"".join(table)
+        f.write(header + b"\x00" * (_align(table_size) - len(header)))
+        for blob in blobs:
+            f.write(blob)
+
+
+def read_cache_file(path):
+    """
+    Memory maps a cache file and returns copies of its sections. The file is closed before returning.
+    :type path: str
+    :rtype: dict[str, memoryview]
+    :return: Each section as a writable memoryview cast to its array typecode.
+    """
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        with memoryview(data) as view:
+            if bytes(view[:len(CACHE_MAGIC)]) != CACHE_MAGIC:
+                raise ValueError("Not a cache file: {0}".format(path))
+
+            offset = len(CACHE_MAGIC)
+            section_count = struct.unpack_from("<I", view, offset)[0]
+            offset += 4
+            sections = {}
+            for _ in range(section_count):
+                name_size = view[offset]
+                name = bytes(view[offset + 1:offset + 1 + name_size]).decode()
+                offset += 1 + name_size
+                typecode = chr(view[offset])
+                data_offset, data_size = struct.unpack_from("<II", view, offset + 1)
+                offset += 9
+                sections[name] = memoryview(bytearray(view[data_offset:data_offset + data_size])).cast(typecode)
+    return sections
+
+
+def _align(size):
+    return (size + 7) & ~7
+
+
+def _pmm_to_sections(pmm_data):
+    return [
+        ("header", array("I", (pmm_data.num_tris, pmm_data.num_vertices, pmm_data.scale_divider))),
+        ("position", pmm_data.position_bytes),
+        ("normal", pmm_data.normal_bytes),
+        ("uv", pmm_data.uv_bytes),
+        ("tri", pmm_data.tri_indices),
+        ("bone_index", pmm_data.bone_indices),
+    ]
+
+
+def _pmm_from_sections(sections):
+    pmm_data = PmmData()
+    pmm_data.num_tris, pmm_data.num_vertices, pmm_data.scale_divider = sections["header"]
+    pmm_data.position_bytes = sections["position"]
+    pmm_data.normal_bytes = sections["normal"]
+    pmm_data.uv_bytes = sections["uv"]
+    pmm_data.tri_indices = sections["tri"]
+    pmm_data.bone_indices = sections["bone_index"]
+    return pmm_data
+
+
+def _bounds_to_sections(bounds):
+    frame_counts = array("I", (len(frames) for frames in bounds))
+    values = array("f")
+    for frames in bounds:
+        values.frombytes(frames.astype("<f4").tobytes())
+    return [
+        ("frame_count", frame_counts),
+        ("bounds", values),
+    ]
+
+
+def _bounds_from_sections(sections):
+    values = numpy.frombuffer(sections["bounds"], dtype=numpy.float32).reshape(-1, 2, 3)
+    bounds = []
+    start = 0
+    for frame_count in sections["frame_count"]:
+        bounds.append(values[start:start + frame_count])
+        start += frame_count
+    return bounds
+
+
+def _skeleton_to_sections(skeleton, tracks):
+    sections = [("track_frames", array("I", (track.num_frames for track in tracks)))]
+    for name, dtype in _SKELETON_ARRAYS:
+        sections += _arrays_to_sections("skeleton_" + name, [getattr(skeleton, name)], dtype)
+    arrays = _TRACK_ARRAYS
+    if tracks and tracks[0].scales is not None:
+        arrays += _TRACK_SCALE_ARRAYS
+    for name, dtype in arrays:
+        sections += _arrays_to_sections("track_" + name, [getattr(track, name) for track in tracks], dtype)
+    return sections
+
+
+def _skeleton_from_sections(sections):
+    # Restored from the arrays, without reading the bone records again
+    skeleton = fmt_smon_plm.PlmSkeleton.__new__(fmt_smon_plm.PlmSkeleton)
+    for name, dtype in _SKELETON_ARRAYS:
+        setattr(skeleton, name, _arrays_from_sections(sections, "skeleton_" + name, dtype)[0])
+
+    tracks = []
+    for x, num_frames in enumerate(sections["track_frames"]):
+        track = fmt_smon_plm.PlmTrack.__new__(fmt_smon_plm.PlmTrack)
+        track.name = "Anim_{0:02}".format(x)
+        track.num_frames = num_frames
+        track.scales = track.scale_keys = None
+        tracks.append(track)
+    for name, dtype in _TRACK_ARRAYS + _TRACK_SCALE_ARRAYS:
+        if "track_" + name in sections:
+            for track, values in zip(tracks, _arrays_from_sections(sections, "track_" + name, dtype)):
+                setattr(track, name, values)
+    return skeleton, tracks
+
+
+def _arrays_to_sections(name, arrays, dtype):
+    # The arrays are concatenated along their first axis, the other axes must match
+    arrays = [numpy.asarray(values, dtype=dtype) for values in arrays]
+    return [
+        (name + "_rows", array("I", (len(values) for values in arrays))),
+        (name + "_shape", array("I", arrays[0].shape[1:] if arrays else ())),
+        (name, numpy.concatenate(arrays).tobytes() if arrays else b""),
+    ]
+
+
+def _arrays_from_sections(sections, name, dtype):
+    values = numpy.frombuffer(sections[name], dtype=dtype).reshape((-1,) + tuple(sections[name + "_shape"]))
+    arrays = []
+    start = 0
+    for rows in sections[name + "_rows"]:
+        arrays.append(values[start:start + rows])
+        start += rows
+    return arrays
+
+
+def _texture_to_sections(texture, name):
+    if texture is None:
+        return []
+    return [
+        (name + "_header", array("i", (texture.width, texture.height, texture.pixelType))),
+        (name, texture.pixelData),
+    ]
+
+
+def _texture_from_sections(sections, name):
+    if name not in sections:
+        return None
+    width, height, pixel_type = sections[name + "_header"]
+    return NoeTexture("", width, height, sections[name], pixel_type)
@@ -0,0 +1,266 @@
+import noesis
+from inc_smon import numpy
+from fmt_smon_plm import compose_matrices
+import fmt_smon_plm
+
+
+# ----------
+# Evaluates PLM animations and skins PMM meshes on the CPU, with numpy.
+#
+# Each PMM vertex is bound to a single bone by PmmData.bone_indices. Vertices are stored in bind pose model space,
+# so a posed vertex is p @ inverse(bind world matrix) @ posed world matrix of its bone.
+# ----------
+
+
+def interpolate_track(track, interpolation=None):
+    """
+    Returns the rotation, translation and scale of every bone on every frame of the track.
+    With linear interpolation, frames between keys are interpolated like Noesis, otherwise they hold the
+    previous key.
+    :type track: PlmTrack
+    :type interpolation: int
+    :param interpolation: Defaults to PLM_INTERPOLATE_TYPE.
+    :rtype: tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray | None]
+    :return: Rotations of shape (frames, bones, 4), translations and scales of shape (frames, bones, 3).
+    Scales are None for PLM versions without scale.
+    """
+    interp = fmt_smon_plm.PLM_INTERPOLATE_TYPE if interpolation is None else interpolation
+    if interp != noesis.NOEKF_INTERPOLATE_LINEAR:
+        return track.rotations, track.translations, track.scales
+
+    rotations = _interpolate_keys(track.rotations, track.rotation_keys, quaternions=True)
+    translations = _interpolate_keys(track.translations, track.translation_keys)
+    scales = None
+    if track.scales is not None:
+        scales = _interpolate_keys(track.scales, track.scale_keys)
+    return rotations, translations, scales
+
+
+def _interpolate_keys(values, keys, quaternions=False):
+    """
+    :type values: numpy.ndarray
+    :param values: Held values of shape (frames, bones, components), as stored in PlmTrack.
+    :type keys: numpy.ndarray
+    :param keys: Boolean array of shape (frames, bones).
+    :type quaternions: bool
+    :param quaternions: Interpolate along the shortest arc and normalize the results.
+    :rtype: numpy.ndarray
+    """
+    num_frames = len(keys)
+    frames = numpy.arange(num_frames)[:, None]
+    previous_key = numpy.maximum.accumulate(numpy.where(keys, frames, -1), axis=0)
+    next_key = numpy.minimum.accumulate(numpy.where(keys, frames, num_frames)[::-1], axis=0)[::-1]
+    # Frames on a key, before the first key or after the last key hold their value
+    between = (previous_key >= 0) & (next_key < num_frames) & (next_key > frames)
+    if not between.any():
+        return values
+
+    next_values = numpy.take_along_axis(values, numpy.minimum(next_key, num_frames - 1)[:, :, None], axis=0)
+    t = numpy.where(between, (frames - previous_key) / numpy.maximum(next_key - previous_key, 1), 0)
+    t = t[:, :, None].astype(numpy.float32)
+    if quaternions:
+        next_values = numpy.where(numpy.sum(values * next_values, axis=-1, keepdims=True) < 0,
+                                  -next_values, next_values)
+    result = values + (next_values - values) * t
+    if quaternions:
+        result /= numpy.linalg.norm(result, axis=-1, keepdims=True)
+    return result
+
+
+def evaluate_track(skeleton, track, interpolation=None, ignore_scale=None):
+    """
+    Computes the world matrices of every bone on every frame of the track.
+    :type skeleton: PlmSkeleton
+    :type track: PlmTrack
+    :type interpolation: int
+    :param interpolation: Defaults to PLM_INTERPOLATE_TYPE.
+    :type ignore_scale: int
+    :param ignore_scale: Defaults to PLM_IGNORE_SCALE.
+    :rtype: numpy.ndarray
+    :return: float32 array of shape (frames, bones, 4, 4).
+    """
+    _require_numpy()
+    ignore_scale = fmt_smon_plm.PLM_IGNORE_SCALE if ignore_scale is None else ignore_scale
+    rotations, translations, scales = interpolate_track(track, interpolation)
+    # Key rotations have their W component negated, which already makes them the transposed rotation
+    local_matrices = compose_matrices(rotations, translations, None if ignore_scale else scales)
+    return skeleton.to_world(local_matrices)
+
+
+def skinning_matrices(skeleton, world_matrices):
+    """
+    Returns the matrices that move vertices from the bind pose to the posed bones.
+    :type skeleton: PlmSkeleton
+    :type world_matrices: numpy.ndarray
+    :param world_matrices: Array of shape (..., bones, 4, 4), from evaluate_track.
+    :rtype: numpy.ndarray
+    :return: float32 array of the same shape.
+    """
+    inverse_bind = numpy.linalg.inv(skeleton.world_matrices.astype(numpy.float64))
+    return numpy.matmul(inverse_bind, world_matrices).astype(numpy.float32)
+
+
+def pmm_vertex_arrays(pmm_data):
+    """
+    Returns the vertex positions and bone of each vertex of the PMM chunk.
+    :type pmm_data: PmmData
+    :rtype: tuple[numpy.ndarray, numpy.ndarray]
+    :return: float32 positions of shape (vertices, 3), divided by scale_divider, and bone indices of shape (vertices,).
+    """
+    _require_numpy()
+    return pmm_data.position_array(), pmm_data.bone_index_array().astype(numpy.intp)
+
+
+def skin_vertices(positions, vertex_bones, skin_matrices):
+    """
+    Transforms every vertex by the skinning matrix of its bone, for every frame at once.
+    Vertices are grouped by bone, so each bone is a single matrix product over all frames.
+    :type positions: numpy.ndarray
+    :param positions: Array of shape (vertices, 3).
+    :type vertex_bones: numpy.ndarray
+    :param vertex_bones: Bone index of each vertex.
+    :type skin_matrices: numpy.ndarray
+    :param skin_matrices: Array of shape (frames, bones, 4, 4), from skinning_matrices.
+    :rtype: numpy.ndarray
+    :return: float32 array of shape (frames, vertices, 3).
+    """
+    num_frames, num_bones = skin_matrices.shape[:2]
+    if len(vertex_bones) and vertex_bones.max() >= num_bones:
+        raise Exception("[Pose] Vertex bound to bone {0}, skeleton has {1} bones".format(vertex_bones.max(),
+                                                                                         num_bones))
+    skinned = numpy.empty((num_frames, len(positions), 3), dtype=numpy.float32)
+    order = numpy.argsort(vertex_bones, kind="stable")
+    bounds = numpy.searchsorted(vertex_bones[order], numpy.arange(num_bones + 1))
+    for bone in range(num_bones):
+        vertices = order[bounds[bone]:bounds[bone + 1]]
+        if len(vertices) == 0:
+            continue
+        # (vertices, 3) @ (frames, 3, 3) + (frames, 1, 3)
+        matrices = skin_matrices[:, bone]
+        skinned[:, vertices] = numpy.matmul(positions[vertices], matrices[:, :3, :3]) + matrices[:, None, 3, :3]
+    return skinned
+
+
+def skin_track(pmm_data, skeleton, track, interpolation=None, ignore_scale=None):
+    """
+    Poses the PMM mesh on every frame of the track.
+    :type pmm_data: PmmData
+    :type skeleton: PlmSkeleton
+    :type track: PlmTrack
+    :type interpolation: int
+    :param interpolation: Defaults to PLM_INTERPOLATE_TYPE.
+    :type ignore_scale: int
+    :param ignore_scale: Defaults to PLM_IGNORE_SCALE.
+    :rtype: numpy.ndarray
+    :return: float32 vertex positions of shape (frames, vertices, 3).
+    """
+    positions, vertex_bones = pmm_vertex_arrays(pmm_data)
+    world_matrices = evaluate_track(skeleton, track, interpolation, ignore_scale)
+    return skin_vertices(positions, vertex_bones, skinning_matrices(skeleton, world_matrices))
+
+
+def bone_cluster_bounds(positions, vertex_bones, num_bones):
+    """
+    Returns the bind pose bounds of the vertices bound to each bone.
+    :type positions: numpy.ndarray
+    :param positions: Array of shape (vertices, 3).
+    :type vertex_bones: numpy.ndarray
+    :param vertex_bones: Bone index of each vertex.
+    :type num_bones: int
+    :rtype: tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]
+    :return: float32 minimums and maximums of shape (bones, 3), and a boolean array of shape (bones,) that is False
+    for bones without vertices, whose bounds are zero.
+    """
+    if len(vertex_bones) and vertex_bones.max() >= num_bones:
+        raise Exception("[Pose] Vertex bound to bone {0}, skeleton has {1} bones".format(vertex_bones.max(),
+                                                                                         num_bones))
+    mins = numpy.full((num_bones, 3), numpy.inf, dtype=numpy.float32)
+    maxs = numpy.full((num_bones, 3), -numpy.inf, dtype=numpy.float32)
+    numpy.minimum.at(mins, vertex_bones, positions)
+    numpy.maximum.at(maxs, vertex_bones, positions)
+    used = numpy.bincount(vertex_bones, minlength=num_bones) > 0
+    mins[~used] = 0
+    maxs[~used] = 0
+    return mins, maxs, used
+
+
+def transform_bounds(mins, maxs, matrices):
+    """
+    Returns the axis-aligned bounds of boxes transformed by matrices, without transforming their corners.
+    The center is transformed as a point and the half extents by the absolute values of the 3x3 part.
+    :type mins: numpy.ndarray
+    :param mins: Array of shape (..., 3).
+    :type maxs: numpy.ndarray
+    :param maxs: Array of shape (..., 3).
+    :type matrices: numpy.ndarray
+    :param matrices: Array of shape (..., 4, 4), broadcast against the boxes.
+    :rtype: tuple[numpy.ndarray, numpy.ndarray]
+    """
+    center = (mins + maxs) * 0.5
+    extent = (maxs - mins) * 0.5
+    center = numpy.matmul(center[..., None, :], matrices[..., :3, :3])[..., 0, :] + matrices[..., 3, :3]
+    extent = numpy.matmul(extent[..., None, :], numpy.abs(matrices[..., :3, :3]))[..., 0, :]
+    return center - extent, center + extent
+
+
+def frame_bounds(pmm_data, skeleton, track, interpolation=None, ignore_scale=None):
+    """
+    Computes the bounds of the posed PMM mesh on every frame of the track, without skinning its vertices.
+    The bind pose bounds of the vertices of each bone are moved with the bone, so the result contains the skinned
+    mesh but can be slightly larger than it.
+    :type pmm_data: PmmData
+    :type skeleton: PlmSkeleton
+    :type track: PlmTrack
+    :type interpolation: int
+    :param interpolation: Defaults to PLM_INTERPOLATE_TYPE.
+    :type ignore_scale: int
+    :param ignore_scale: Defaults to PLM_IGNORE_SCALE.
+    :rtype: numpy.ndarray
+    :return: float32 array of shape (frames, 2, 3), the minimum then the maximum of each frame.
+    Zero if the mesh has no vertices.
+    """
+    return animation_bounds(pmm_data, skeleton, [track], interpolation, ignore_scale)[0]
+
+
+def track_bounds(frame_bounds_array):
+    """
+    Merges the bounds of every frame of a track.
+    :type frame_bounds_array: numpy.ndarray
+    :param frame_bounds_array: Array of shape (frames, 2, 3), from frame_bounds.
+    :rtype: tuple[numpy.ndarray, numpy.ndarray]
+    :return: Minimum and maximum of shape (3,).
+    """
+    return frame_bounds_array[:, 0].min(axis=0), frame_bounds_array[:, 1].max(axis=0)
+
+
+def animation_bounds(pmm_data, skeleton, tracks, interpolation=None, ignore_scale=None):
+    """
+    Computes frame_bounds for every track. The bone bounds are computed once for all tracks.
+    :type pmm_data: PmmData
+    :type skeleton: PlmSkeleton
+    :type tracks: list[PlmTrack]
+    :type interpolation: int
+    :param interpolation: Defaults to PLM_INTERPOLATE_TYPE.
+    :type ignore_scale: int
+    :param ignore_scale: Defaults to PLM_IGNORE_SCALE.
+    :rtype: list[numpy.ndarray]
+    :return: float32 array of shape (frames, 2, 3) for each track.
+    """
+    positions, vertex_bones = pmm_vertex_arrays(pmm_data)
+    mins, maxs, used = bone_cluster_bounds(positions, vertex_bones, skeleton.num_bones)
+    results = []
+    for track in tracks:
+        world_matrices = evaluate_track(skeleton, track, interpolation, ignore_scale)
+        bounds = numpy.zeros((len(world_matrices), 2, 3), dtype=numpy.float32)
+        if used.any():
+            skin_matrices = skinning_matrices(skeleton, world_matrices)[:, used]
+            posed_mins, posed_maxs = transform_bounds(mins[used], maxs[used], skin_matrices)
+            bounds[:, 0] = posed_mins.min(axis=1)
+            bounds[:, 1] = posed_maxs.max(axis=1)
+        results.append(bounds)
+    return results
+
+
+def _require_numpy():
+    if numpy is None:
+        raise Exception("[Pose] numpy is required to evaluate poses")
@@ -0,0 +1,279 @@
+import os
+import struct
+
+from fmt_smon_dat import decipher_filename
+from fmt_smon_fid import FID_HEADER
+from fmt_smon_joker import JOKER_HEADER
+from fmt_smon_plm import PLM_SIGNATURE, PLM_VERSIONS
+from fmt_smon_pmm import PMM_HEADER, PMM_VERSIONS, as_deciphered, pmm_check_ciphered
+
+
+# ----------
+# Reads the metadata of a file from its headers only, without loading or decoding the file.
+#
+# Each probe reads the first PROBE_READ_SIZE bytes of the file, then seeks to the few other headers it needs
+# (the PLM chunk and texture chunk sizes of a DAT file, the texture and mesh headers of a FID file).
+# ----------
+
+
+PROBE_READ_SIZE = 0x200
+
+PROBE_FORMAT_DAT = "dat"
+PROBE_FORMAT_PMM = "pmm"
+PROBE_FORMAT_PLM = "plm"
+PROBE_FORMAT_FID = "fid"
+PROBE_FORMAT_JOKER = "joker"
+PROBE_FORMAT_PNG = "png"
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+class ProbeResult:
+    """
+    Metadata of a probed file. Values that do not apply to the format, or could not be read, are None.
+    :cvar filepath: Path of the probed file.
+    :cvar size: Size of the file in bytes.
+    :cvar format: One of the PROBE_FORMAT_* values, or None if the file was not recognised.
+    :cvar version: PMM or PLM version character. For a DAT file, the version of its PMM chunk.
+    :cvar plm_version: PLM version character of a DAT file.
+    :cvar ciphered: Whether the PMM data is ciphered.
+    :cvar name: Original filename stored in the header of a DAT file.
+    :cvar num_vertices: Number of vertices, for FID files summed over every mesh.
+    :cvar num_tris: Number of triangles, for FID files summed over every mesh. PMM chunks store the number of
+    triangle indices, which is divided by 3.
+    :cvar num_meshes: Number of meshes of a FID file.
+    :cvar num_bones: Number of bones.
+    :cvar num_animations: Number of animations.
+    :cvar anim_num_frames: Number of frames of each animation.
+    :cvar num_textures: Number of texture chunks of a DAT file, texture slots of a FID file or images of a Joker file.
+    :cvar material_ids: Material ID of each texture chunk of a DAT file, None for chunks without one.
+    :cvar texture_names: Texture filename of each texture slot of a FID file, None for empty slots.
+    """
+
+    def __init__(self, filepath, size):
+        """
+        :type filepath: str
+        :type size: int
+        """
+        self.filepath = filepath
+        self.size = size
+        self.format = None
+        self.version = None
+        self.plm_version = None
+        self.ciphered = None
+        self.name = None
+        self.num_vertices = None
+        self.num_tris = None
+        self.num_meshes = None
+        self.num_bones = None
+        self.num_animations = None
+        self.anim_num_frames = None
+        self.num_textures = None
+        self.material_ids = None
+        self.texture_names = None
+
+    def as_dict(self):
+        """
+        :rtype: dict
+        """
+        return dict(vars(self))
+
+    def __repr__(self):
+        return "ProbeResult({0})".format(", ".join("{0}={1!r}".format(k, v) for k, v in vars(self).items()
+                                                   if v is not None))
+
+
+def probe_file(filepath):
+    """
+    Reads the metadata of a DAT, PMOD, PLIV, FID, Joker or PNG file from its headers.
+    :type filepath: str
+    :rtype: ProbeResult
+    :return: The metadata. Its format is None if the file was not recognised.
+    """
+    with open(filepath, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        head = f.read(PROBE_READ_SIZE)
+        result = ProbeResult(filepath, size)
+
+        if head.startswith(FID_HEADER.encode()):
+            probe_fid(f, result)
+        elif head.startswith(JOKER_HEADER.encode()):
+            probe_joker(head, result)
+        elif head.startswith(PNG_SIGNATURE):
+            result.format = PROBE_FORMAT_PNG
+            result.num_textures = 1
+        elif head.startswith(PLM_SIGNATURE.encode()):
+            probe_plm(f, 0, result)
+        elif probe_pmm(head, result):
+            pass
+        else:
+            probe_dat(f, head, result)
+    return result
+
+
+def probe_pmm(data, result):
+    """
+    Reads the PMM chunk header, which may be ciphered.
+    :type data: bytes
+    :param data: At least the first 0x10 bytes of the PMM chunk.
+    :type result: ProbeResult
+    :return: 1 if this is a PMM chunk of a known version, otherwise 0.
+    :rtype: int
+    """
+    if len(data) < 0x10:
+        return 0
+    ciphered = pmm_check_ciphered(data[:3])
+    if ciphered:
+        data = as_deciphered(data[:0x10])
+    if data[:3] != PMM_HEADER.encode() or chr(data[3]) not in PMM_VERSIONS:
+        return 0
+
+    result.format = PROBE_FORMAT_PMM
+    result.version = chr(data[3])
+    result.ciphered = bool(ciphered)
+    num_indices, result.num_vertices = struct.unpack_from("<2H", data, 6)
+    result.num_tris = num_indices // 3
+    return 1
+
+
+def probe_plm(f, offset, result):
+    """
+    Reads the number of animations, their frame counts and the number of bones from the PLM chunk header.
+    :param f: File opened in binary mode.
+    :type offset: int
+    :param offset: Offset of the PLM chunk in the file.
+    :type result: ProbeResult
+    :return: 1 if this is a PLM chunk of a known version, otherwise 0.
+    :rtype: int
+    """
+    header = _read_at(f, offset, 0x1A)
+    version = chr(header[3])
+    if header[:3] != PLM_SIGNATURE.encode() or version not in PLM_VERSIONS:
+        return 0
+    num_animations = struct.unpack_from("<H", header, 4)[0]
+
+    # for each animation: 0x5 bytes unknown, 2 byte number of frames, then 1 byte number of bones
+    table = _read_at(f, offset + 0x1A, num_animations * 7 + 1)
+
+    if result.format is None:
+        result.format = PROBE_FORMAT_PLM
+        result.version = version
+    result.plm_version = version
+    result.num_animations = num_animations
+    result.anim_num_frames = [struct.unpack_from("<H", table, x * 7 + 5)[0] for x in range(num_animations)]
+    result.num_bones = table[-1]
+    return 1
+
+
+def probe_dat(f, head, result):
+    """
+    Reads the header chunk, PMM and PLM chunk headers, and texture chunk headers of a DAT file.
+    :param f: File opened in binary mode.
+    :type head: bytes
+    :param head: First bytes of the file.
+    :type result: ProbeResult
+    :return: 1 if this is a DAT file, otherwise 0.
+    :rtype: int
+    """
+    if len(head) < 8:
+        return 0
+    header_size = struct.unpack_from("<i", head)[0]
+    if header_size < 32 or header_size + 8 > result.size:
+        return 0
+
+    pmm_offset = header_size + 8
+    pmm_size = struct.unpack_from("<i", _read_at(f, header_size + 4, 4))[0]
+    if not probe_pmm(_read_at(f, pmm_offset, 0x10), result):
+        return 0
+    result.format = PROBE_FORMAT_DAT
+    result.name = decipher_filename(_read_at(f, 4 + 0x11, header_size - 0x11))
+
+    plm_offset = pmm_offset + pmm_size + 4
+    plm_size = struct.unpack_from("<i", _read_at(f, plm_offset - 4, 4))[0]
+    probe_plm(f, plm_offset, result)
+
+    # Same layout as DatIndex: an optional material ID before the size of each texture chunk
+    result.material_ids = []
+    offset = plm_offset + plm_size
+    while offset + 4 <= result.size:
+        material_id = struct.unpack_from("<i", _read_at(f, offset, 4))[0]
+        if material_id > 255:
+            material_id = None
+        else:
+            offset += 4
+        if offset + 4 > result.size:
+            break
+        chunk_size = struct.unpack_from("<i", _read_at(f, offset, 4))[0]
+        offset += 4
+        if chunk_size < 0 or offset + chunk_size > result.size:
+            raise Exception("[Probe] Invalid texture chunk size {0} at {1}".format(hex(chunk_size), hex(offset)))
+        offset += chunk_size
+        if chunk_size != 0:
+            result.material_ids.append(material_id)
+    result.num_textures = len(result.material_ids)
+    return 1
+
+
+def probe_fid(f, result):
+    """
+    Reads the texture slots and the mesh vertex counts of a FID file.
+    :param f: File opened in binary mode.
+    :type result: ProbeResult
+    """
+    result.format = PROBE_FORMAT_FID
+
+    offset = 0x1C
+    texture_count = struct.unpack_from("<i", _read_at(f, offset, 4))[0]
+    offset += 4
+    result.texture_names = []
+    for x in range(texture_count):
+        has_texture = struct.unpack_from("<i", _read_at(f, offset + 0x2C, 4))[0]
+        offset += 0x30
+        if has_texture:
+            result.texture_names.append(_read_at(f, offset, 0x40).decode().rstrip('\x00'))
+            offset += 0x40 + 0xBC
+        else:
+            result.texture_names.append(None)
+    result.num_textures = texture_count
+
+    offset += 0x18
+    mesh_count = struct.unpack_from("<i", _read_at(f, offset, 4))[0]
+    offset += 4
+    result.num_meshes = mesh_count
+    result.num_vertices = 0
+    for x in range(mesh_count):
+        # 0x40 bytes name, 0xC0 bytes unknown, 4 bytes texture index, 0xC bytes unknown
+        offset += 0x110
+        vertex_count, vertex_size = struct.unpack_from("<2i", _read_at(f, offset, 8))
+        offset += 8 + vertex_size
+        uv1_size = struct.unpack_from("<i", _read_at(f, offset, 4))[0]
+        offset += 4 + uv1_size
+        uv2_slot = struct.unpack_from("<i", _read_at(f, offset, 4))[0]
+        offset += 4
+        if uv2_slot != 0:
+            offset += 4 + struct.unpack_from("<i", _read_at(f, offset, 4))[0]
+        result.num_vertices += vertex_count
+    # Meshes are unindexed triangle lists
+    result.num_tris = result.num_vertices // 3
+
+
+def probe_joker(head, result):
+    """
+    Reads the number of images of a Joker file.
+    :type head: bytes
+    :param head: First bytes of the file.
+    :type result: ProbeResult
+    """
+    result.format = PROBE_FORMAT_JOKER
+    if len(head) < 0x10:
+        return
+    diffuse_size, alpha_size = struct.unpack_from("<2i", head, 8)
+    result.num_textures = (diffuse_size > 0) + (alpha_size > 0)
+
+
+def _read_at(f, offset, size):
+    f.seek(offset)
+    data = f.read(size)
+    if len(data) != size:
+        raise Exception("[Probe] Unexpected end of file at {0}".format(hex(offset + len(data))))
+    return data
@@ -0,0 +1,323 @@
+"""
+Imports a directory of Summoners War files outside of the Noesis GUI, in parallel across processes.
+Each file is loaded through the same handlers Noesis uses, and a report of the results is printed.
+
+Usage: python smon_batch.py <directory> [--jobs N] [--report report.json]
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+import traceback
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import headless
+
+# Outside of Noesis, the plugins run on the stand-in Noesis API.
+# Does nothing if the real inc_noesis is importable, so only the API common to both is used here.
+headless.install()
+
+import fmt_smon_dat
+import fmt_smon_fid
+import fmt_smon_joker
+import fmt_smon_pmm
+from inc_smon import TextureCache
+
+STATUS_OK = "ok"
+STATUS_SKIPPED = "skipped"
+STATUS_FAILED = "failed"
+
+# Bytes read from the start of each file for the type check
+CHECK_READ_SIZE = 0x1000
+
+# Files submitted to the pool per worker process. Bounds how many files are retried when a worker dies.
+IN_FLIGHT_PER_JOB = 2
+
+# Textures of the .fid files converted by this process, neighbouring terrain tiles share the same atlases
+fid_texture_cache = TextureCache()
+
+
+def read_file(filepath):
+    with open(filepath, "rb") as f:
+        return f.read()
+
+
+def convert_dat(filepath):
+    models, vertex_counts = [], []
+    # Memory mapped, only the chunks being parsed are read
+    fmt_smon_dat.dat_load_file(filepath, models, vertex_counts)
+    return models, [], sum(vertex_counts)
+
+
+def convert_pmod(filepath):
+    models, vertex_counts = [], []
+    fmt_smon_pmm.load_pmm_from_pmod(read_file(filepath), models, filepath, vertex_counts)
+    return models, [], sum(vertex_counts)
+
+
+def convert_fid(filepath):
+    models, vertex_counts = [], []
+    fmt_smon_fid.fid_load_model(read_file(filepath), models, os.path.dirname(filepath), fid_texture_cache,
+                                vertex_counts)
+    return models, [], sum(vertex_counts)
+
+
+def convert_joker(filepath):
+    textures = []
+    fmt_smon_joker.load_joker_file(read_file(filepath), textures)
+    return [], textures, 0
+
+
+# Extension: (type check, converter). .pliv files are loaded along with the .pmod of the same name.
+# Converters return the models, the textures and the vertex count of the models.
+# The vertices are counted from the PMM and FID data, the meshes of the models are not decoded.
+CONVERTERS = {
+    ".dat": (fmt_smon_dat.dat_check_type, convert_dat),
+    ".pmod": (fmt_smon_pmm.pmm_check_type, convert_pmod),
+    ".fid": (fmt_smon_fid.fid_check_type, convert_fid),
+    ".png": (fmt_smon_joker.joker_check_type, convert_joker),
+}
+
+
+class FileResult:
+    """
+    Result of converting a single file.
+    :cvar filepath: Path of the file.
+    :cvar status: One of STATUS_OK, STATUS_SKIPPED, STATUS_FAILED.
+    :cvar seconds: Time spent reading and converting the file.
+    :cvar size: Size of the file in bytes.
+    :cvar stats: Counts of what was loaded from the file.
+    :cvar error: Traceback of the failure, if any.
+    """
+
+    def __init__(self, filepath, status, seconds=0.0, size=0, stats=None, error=None):
+        self.filepath = filepath
+        self.status = status
+        self.seconds = seconds
+        self.size = size
+        self.stats = stats or {}
+        self.error = error
+
+    def to_dict(self):
+        return {
+            "file": self.filepath,
+            "status": self.status,
+            "seconds": self.seconds,
+            "size": self.size,
+            "stats": self.stats,
+            "error": self.error,
+        }
+
+
+def find_files(root):
+    """
+    Walks the directory and returns every file with a known extension, in sorted order.
+    :type root: str
+    :rtype: list[str]
+    """
+    found = []
+    for directory, _, filenames in os.walk(root):
+        for filename in filenames:
+            if os.path.splitext(filename)[1].lower() in CONVERTERS:
+                found.append(os.path.join(directory, filename))
+    found.sort()
+    return found
+
+
+def model_stats(models, textures, vertices):
+    stats = {
+        "models": len(models),
+        "meshes": 0,
+        "vertices": vertices,
+        "bones": 0,
+        "animations": 0,
+        "textures": len(textures),
+    }
+    for model in models:
+        stats["meshes"] += len(model.meshes)
+        stats["bones"] += len(model.bones or ())
+        stats["animations"] += len(model.anims or ())
+        if model.modelMats is not None:
+            stats["textures"] += len(model.modelMats.texList)
+    return stats
+
+
+def convert_file(filepath, verbose=False):
+    """
+    Converts a single file. Never raises, failures are reported in the result.
+    Runs in a worker process.
+    :type filepath: str
+    :type verbose: bool
+    :param verbose: Whether to keep the output printed by the plugins.
+    :rtype: FileResult
+    """
+    check_type, converter = CONVERTERS[os.path.splitext(filepath)[1].lower()]
+    start = time.perf_counter()
+    size = 0
+    output = sys.stdout if verbose else io.StringIO()
+    try:
+        with contextlib.redirect_stdout(output):
+            with open(filepath, "rb") as f:
+                size = os.fstat(f.fileno()).st_size
+                head = f.read(CHECK_READ_SIZE)
+            if not check_type(head):
+                return FileResult(filepath, STATUS_SKIPPED, time.perf_counter() - start, size)
+            models, textures, vertices = converter(filepath)
+        return FileResult(filepath, STATUS_OK, time.perf_counter() - start, size,
+                          model_stats(models, textures, vertices))
+    except Exception:
+        return FileResult(filepath, STATUS_FAILED, time.perf_counter() - start, size, error=traceback.format_exc())
+
+
+def convert_pool(pending, jobs, verbose, finish):
+    """
+    Converts the pending files in a new pool of worker processes, until they are done or a worker dies.
+    A dead worker breaks the pool and every file still in it, so those files are returned to be retried.
+    :type pending: deque[str]
+    :param pending: Files to convert. Consumed as they are submitted.
+    :type jobs: int
+    :type verbose: bool
+    :param finish: Called with each FileResult.
+    :rtype: list[str]
+    :return: Files that were in the pool when it broke. Empty if the pool did not break.
+    """
+    running = {}
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        while pending or running:
+            try:
+                while pending and len(running) < jobs * IN_FLIGHT_PER_JOB:
+                    future = executor.submit(convert_file, pending[0], verbose)
+                    running[future] = pending.popleft()
+            except BrokenProcessPool:
+                # Broke after the last running file completed, the rest is converted in the next pool
+                if not running:
+                    return []
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            broken = []
+            for future in done:
+                filepath = running.pop(future)
+                try:
+                    result = future.result()
+                except BrokenProcessPool:
+                    broken.append(filepath)
+                    continue
+                except Exception:
+                    result = FileResult(filepath, STATUS_FAILED, error=traceback.format_exc())
+                finish(result)
+            if broken:
+                return broken + list(running.values())
+    return []
+
+
+def convert_all(filepaths, jobs=None, verbose=False, progress=None):
+    """
+    Converts the files across a pool of worker processes.
+    When a worker process dies, the pool is recreated and the files that were in it are converted again one at a
+    time, so only the file that kills its worker fails.
+    :type filepaths: list[str]
+    :type jobs: int
+    :param jobs: Number of worker processes. Defaults to the number of CPUs.
+    :type verbose: bool
+    :param progress: Called with each FileResult as it completes.
+    :rtype: list[FileResult]
+    """
+    jobs = jobs or os.cpu_count() or 1
+    results = []
+
+    def finish(result):
+        results.append(result)
+        if progress is not None:
+            progress(result)
+
+    pending = deque(filepaths)
+    while pending:
+        for filepath in convert_pool(pending, jobs, verbose, finish):
+            # Alone in its own pool, a dead worker can only be this file
+            if convert_pool(deque((filepath,)), 1, verbose, finish):
+                finish(FileResult(filepath, STATUS_FAILED, error="Worker process died converting the file"))
+    results.sort(key=lambda r: r.filepath)
+    return results
+
+
+def summarize(results, wall_seconds, slowest=10):
+    """
+    Builds a printable summary of the results.
+    :type results: list[FileResult]
+    :type wall_seconds: float
+    :type slowest: int
+    :param slowest: Number of slowest files to list.
+    :rtype: str
+    """
+    lines = []
+    by_status = {STATUS_OK: 0, STATUS_SKIPPED: 0, STATUS_FAILED: 0}
+    by_extension = {}
+    for result in results:
+        by_status[result.status] += 1
+        extension = os.path.splitext(result.filepath)[1].lower()
+        count, seconds, size = by_extension.get(extension, (0, 0.0, 0))
+        by_extension[extension] = (count + 1, seconds + result.seconds, size + result.size)
+
+    total_size = sum(r.size for r in results)
+    lines.append("Files: {0} | OK: {1} | Skipped: {2} | Failed: {3}".format(
+        len(results), by_status[STATUS_OK], by_status[STATUS_SKIPPED], by_status[STATUS_FAILED]))
+    lines.append("Wall time: {0:.2f}s | Read: {1:.1f} MB | Throughput: {2:.1f} MB/s, {3:.1f} files/s".format(
+        wall_seconds, total_size / 1e6,
+        total_size / 1e6 / wall_seconds if wall_seconds else 0.0,
+        len(results) / wall_seconds if wall_seconds else 0.0))
+
+    for extension in sorted(by_extension):
+        count, seconds, size = by_extension[extension]
+        lines.append("  {0:6} {1:7} files | {2:9.2f}s CPU | {3:9.1f} MB | {4:8.2f} ms/file".format(
+            extension, count, seconds, size / 1e6, seconds * 1000 / count))
+
+    if results and slowest:
+        lines.append("Slowest files:")
+        for result in sorted(results, key=lambda r: r.seconds, reverse=True)[:slowest]:
+            lines.append("  {0:8.3f}s {1}".format(result.seconds, result.filepath))
+
+    failures = [r for r in results if r.status == STATUS_FAILED]
+    if failures:
+        lines.append("Failures:")
+        for result in failures:
+            last_line = result.error.strip().splitlines()[-1] if result.error else "Unknown error"
+            lines.append("  {0}: {1}".format(result.filepath, last_line))
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Imports Summoners War .dat, .pmod, .fid and Joker .png files.")
+    parser.add_argument("root", help="File or directory to convert. Directories are searched recursively.")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="Number of worker processes. Default: CPU count.")
+    parser.add_argument("--report", help="Write the per-file results to this JSON file.")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Show the output printed by the plugins.")
+    args = parser.parse_args(argv)
+
+    filepaths = [args.root] if os.path.isfile(args.root) else find_files(args.root)
+    if not filepaths:
+        print("No files found in {0}".format(args.root))
+        return 1
+
+    def progress(result):
+        if result.status == STATUS_FAILED:
+            print("[FAILED] {0}".format(result.filepath), file=sys.stderr)
+
+    start = time.perf_counter()
+    results = convert_all(filepaths, args.jobs, args.verbose, progress)
+    wall_seconds = time.perf_counter() - start
+
+    print(summarize(results, wall_seconds))
+
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump([r.to_dict() for r in results], f, indent=1)
+
+    return 0 if all(r.status != STATUS_FAILED for r in results) else 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
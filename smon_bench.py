@@ -0,0 +1,540 @@
+"""
+Benchmarks the plugins on synthetic PMM, PLM, FID, Joker and DAT data, outside of Noesis.
+Each stage is timed separately and reported as MB/s and objects/s.
+
+Usage: python smon_bench.py [--scale N] [--repeat N] [--save results.json] [--baseline results.json]
+With --baseline, stages slower than the baseline by more than --tolerance are reported as regressions.
+"""
+import argparse
+import contextlib
+import io
+import json
+import math
+import os
+import random
+import shutil
+import struct
+import sys
+import tempfile
+import time
+import zlib
+
+import headless
+
+# Outside of Noesis, the plugins run on the stand-in Noesis API.
+headless.install()
+
+import fmt_smon_dat
+import fmt_smon_fid
+import fmt_smon_joker
+import fmt_smon_plm
+import fmt_smon_pmm
+import inc_smon_pose
+from inc_noesis import NoeBitStream
+from inc_smon import numpy
+
+
+# ================================ Synthetic data ================================= #
+
+
+def build_pmm(num_vertices=1000, num_tris=1500, version=fmt_smon_pmm.PMM_V9, ciphered=False, num_bones=16, seed=0):
+    """
+    Builds a PMM chunk with random geometry.
+    :type num_vertices: int
+    :type num_tris: int
+    :param num_tris: Number of triangle indices.
+    :type version: str
+    :param version: One of PMM_VERSIONS.
+    :type ciphered: bool
+    :type num_bones: int
+    :param num_bones: Vertices are bound to bones in range(num_bones).
+    :rtype: bytes
+    """
+    r = random.Random(seed)
+    scale_divider = 64
+    header = (fmt_smon_pmm.PMM_HEADER + version).encode()
+    header += struct.pack("<HHH", 0x11F, num_tris, num_vertices) + b"\x00" * 4 + struct.pack("<H", scale_divider)
+    header += b"\x00" * 0x37
+
+    extent = 100 * scale_divider
+    positions = struct.pack("<{0}i".format(num_vertices * 3), *[r.randint(-extent, extent)
+                                                                for _ in range(num_vertices * 3)])
+    normals = bytes(r.randrange(256) for _ in range(num_vertices * 3))
+    uvs = struct.pack("<{0}i".format(num_vertices * 2), *[r.randint(0, 0xFFFF) for _ in range(num_vertices * 2)])
+    tris = struct.pack("<{0}H".format(num_tris), *[r.randrange(num_vertices) for _ in range(num_tris)])
+    bone_indices = bytes(r.randrange(num_bones) for _ in range(num_vertices))
+
+    data = header + positions + normals + uvs + tris + bone_indices
+    return bytes(fmt_smon_pmm.as_enciphered(data)) if ciphered else data
+
+
+def build_plm(num_bones=16, anim_num_frames=(30, 60, 90), version=fmt_smon_plm.PLM_V6, key_density=0.5, seed=0,
+              single_key_layout=True):
+    """
+    Builds a PLM chunk with a chain of bones and random animation keys.
+    :type num_bones: int
+    :type anim_num_frames: tuple[int]
+    :param anim_num_frames: Number of frames of each animation track.
+    :type version: str
+    :param version: One of PLM_VERSIONS. Selects between int and float values, and whether scale is stored.
+    :type key_density: float
+    :param key_density: Probability of a key on each frame.
+    :type single_key_layout: bool
+    :param single_key_layout: Whether attributes with one key use the single key layout instead of a bitarray.
+    :rtype: bytes
+    """
+    r = random.Random(seed)
+    floats = fmt_smon_plm.is_floats(version)
+    with_scale = fmt_smon_plm.has_scale(version)
+
+    def quaternion():
+        angle = r.uniform(-math.pi, math.pi)
+        axis = [r.uniform(-1, 1) for _ in range(3)]
+        length = math.sqrt(sum(a * a for a in axis)) or 1.0
+        s = math.sin(angle / 2) / length
+        values = (axis[0] * s, axis[1] * s, axis[2] * s, math.cos(angle / 2))
+        if floats:
+            return struct.pack("<4f", *values)
+        return struct.pack("<4h", *[int(v * 0x7FFF) for v in values])
+
+    def translation():
+        if floats:
+            return struct.pack("<3f", *[r.uniform(-2, 2) for _ in range(3)])
+        return struct.pack("<3i", *[r.randint(-0x2000, 0x2000) for _ in range(3)])
+
+    def scale():
+        if not with_scale:
+            return b""
+        if floats:
+            return struct.pack("<3f", *[r.uniform(0.5, 1.5) for _ in range(3)])
+        return struct.pack("<3i", *[r.randint(0x8000, 0x18000) for _ in range(3)])
+
+    def keys(num_frames, read_value):
+        key_frames = [0] + [f for f in range(1, num_frames) if r.random() < key_density]
+        if len(key_frames) == 1 and single_key_layout:
+            return b"\x00" + read_value()
+        key_positions = bytearray(int(math.ceil((num_frames + 1) / 8)))
+        for f in key_frames:
+            key_positions[f >> 3] |= 1 << (f & 7)
+        return bytes(key_positions) + b"".join(read_value() for _ in key_frames)
+
+    data = (fmt_smon_plm.PLM_SIGNATURE + version).encode()
+    data += struct.pack("<H", len(anim_num_frames)) + b"\x00" * 0x14
+    for num_frames in anim_num_frames:
+        data += b"\x00" * 5 + struct.pack("<H", num_frames)
+
+    unk_size = {fmt_smon_plm.PLM_V2: 0x06, fmt_smon_plm.PLM_V3: 0x08, fmt_smon_plm.PLM_V4: 0x08}.get(version, 0x11)
+    data += struct.pack("<B", num_bones) + b"\x00" * unk_size + b"\x00" * 0x18
+
+    for b in range(num_bones):
+        parent_id = 0xFF if b == 0 else b - 1
+        child_id = b + 1 if b + 1 < num_bones else 0xFF
+        data += struct.pack("<BBBBBH", 0, b, parent_id, 0xFF, child_id, 0)
+        data += quaternion() + translation() + scale()
+
+    for num_frames in anim_num_frames:
+        data += b"\x00" * 0x18
+        for _ in range(num_bones):
+            data += keys(num_frames, quaternion) + keys(num_frames, translation)
+            if with_scale:
+                data += keys(num_frames, scale)
+    return data
+
+
+def build_fid(num_meshes=4, num_vertices=3000, with_uv2=True, texture_names=("tex.png",), seed=0):
+    """
+    Builds a FID file of meshes referencing the textures in turn.
+    :type num_meshes: int
+    :type num_vertices: int
+    :param num_vertices: Number of vertices of each mesh.
+    :type with_uv2: bool
+    :type texture_names: tuple[str]
+    :rtype: bytes
+    """
+    r = random.Random(seed)
+    data = fmt_smon_fid.FID_HEADER.encode().ljust(12, b"\x00") + b"\x00" * 0x10
+    data += struct.pack("<i", len(texture_names))
+    for name in texture_names:
+        data += b"\x00" * 0x2C + struct.pack("<i", 1) + name.encode().ljust(0x40, b"\x00") + b"\x00" * 0xBC
+    data += b"\x00" * 0x18 + struct.pack("<i", num_meshes)
+
+    def buffer(values):
+        blob = struct.pack("<{0}f".format(len(values)), *values)
+        return struct.pack("<i", len(blob)) + blob
+
+    for m in range(num_meshes):
+        data += "mesh_{0}".format(m).encode().ljust(0x40, b"\x00") + b"\x00" * 0xC0
+        data += struct.pack("<i", m % len(texture_names)) + b"\x00" * 0xC
+        data += struct.pack("<i", num_vertices)
+        data += buffer([r.uniform(-100, 100) for _ in range(num_vertices * 3)])
+        data += buffer([r.random() for _ in range(num_vertices * 2)])
+        data += struct.pack("<i", 1 if with_uv2 else 0)
+        if with_uv2:
+            data += buffer([r.random() for _ in range(num_vertices * 2)])
+    return data
+
+
+def build_png(size=4):
+    """
+    Encodes a grey PNG.
+    :type size: int
+    :param size: Width and height of the image.
+    :rtype: bytes
+    """
+    def chunk(kind, blob):
+        return struct.pack(">I", len(blob)) + kind + blob + struct.pack(">I", zlib.crc32(kind + blob) & 0xFFFFFFFF)
+
+    rows = b"".join(b"\x00" + b"\x80" * (size * 3) for _ in range(size))
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", struct.pack(">IIBBBBB", size, size, 8, 2, 0, 0, 0)) +
+            chunk(b"IDAT", zlib.compress(rows)) + chunk(b"IEND", b""))
+
+
+def build_jpeg(size=256, seed=0):
+    """
+    Encodes a JPEG of noise with Pillow if available, otherwise returns bytes with JPEG start and end markers.
+    :type size: int
+    :param size: Width and height of the image.
+    :rtype: bytes
+    """
+    r = random.Random(seed)
+    try:
+        from PIL import Image
+    except ImportError:
+        return b"\xFF\xD8" + bytes(r.randrange(256) for _ in range(size * size // 4)) + b"\xFF\xD9"
+    image = Image.frombytes("RGB", (size, size), bytes(r.randrange(256) for _ in range(size * size * 3)))
+    output = io.BytesIO()
+    image.save(output, "JPEG")
+    return output.getvalue()
+
+
+def build_joker(size=256, with_alpha=True, seed=0):
+    """
+    Builds a Joker chunk of a diffuse and optional alpha JPEG.
+    :type size: int
+    :type with_alpha: bool
+    :rtype: bytes
+    """
+    diffuse = build_jpeg(size, seed)
+    alpha = build_jpeg(size, seed + 1) if with_alpha else b""
+    return (fmt_smon_joker.JOKER_HEADER.encode() + b"\x00\x1F\x01" + struct.pack("<ii", len(diffuse), len(alpha)) +
+            diffuse + alpha)
+
+
+def build_dat_header(name):
+    """
+    Builds a DAT header chunk with the name ciphered like DatHeader expects.
+    Characters missing from filename_decipher are left out of the name.
+    :type name: str
+    :rtype: bytes
+    """
+    cipher = {}
+    for ciphered, c in enumerate(fmt_smon_dat.filename_decipher):
+        if c and chr(c) not in cipher:
+            cipher[chr(c)] = ciphered
+    terminator = fmt_smon_dat.filename_decipher.index(0)
+    ciphered_name = bytes(cipher[c] for c in name if c in cipher) + bytes((terminator,))
+    return (b"\x00" * 0x11 + ciphered_name).ljust(0x20 + len(name), b"\x00")
+
+
+def build_dat(name="monster", pmm=None, plm=None, textures=None, ciphered=True):
+    """
+    Builds a DAT file from chunks. Missing chunks are generated with default sizes.
+    :type name: str
+    :type pmm: bytes
+    :param pmm: Deciphered PMM chunk.
+    :type plm: bytes
+    :type textures: dict[int, bytes]
+    :param textures: Joker chunk of each material ID.
+    :type ciphered: bool
+    :rtype: bytes
+    """
+    pmm = build_pmm() if pmm is None else pmm
+    plm = build_plm() if plm is None else plm
+    if textures is None:
+        textures = dict((material_id, build_joker(64, seed=material_id)) for material_id in (1, 2, 3))
+    if ciphered:
+        pmm = bytes(fmt_smon_pmm.as_enciphered(pmm))
+
+    def chunk(blob):
+        return struct.pack("<I", len(blob)) + blob
+
+    data = chunk(build_dat_header(name)) + chunk(pmm) + chunk(plm)
+    for material_id in sorted(textures):
+        data += struct.pack("<i", material_id) + chunk(textures[material_id])
+    return data
+
+
+# =================================== Stages ==================================== #
+
+
+class StageResult:
+    """
+    Timing of a benchmark stage.
+    :cvar name: Name of the stage.
+    :cvar seconds: Best time of the repeats.
+    :cvar size: Bytes processed by one run.
+    :cvar objects: Objects produced by one run, such as vertices, bones or keys.
+    """
+
+    def __init__(self, name, seconds, size, objects):
+        self.name = name
+        self.seconds = seconds
+        self.size = size
+        self.objects = objects
+
+    @property
+    def mb_per_second(self):
+        return self.size / 1e6 / self.seconds if self.seconds else 0.0
+
+    @property
+    def objects_per_second(self):
+        return self.objects / self.seconds if self.seconds else 0.0
+
+    def to_dict(self):
+        return {
+            "seconds": self.seconds,
+            "size": self.size,
+            "objects": self.objects,
+            "mb_per_second": self.mb_per_second,
+            "objects_per_second": self.objects_per_second,
+        }
+
+
+def time_stage(name, func, size, objects, repeat):
+    """
+    Runs func repeat times, keeping the best time. Output printed by the plugins is discarded.
+    :type name: str
+    :type func: function
+    :type size: int
+    :type objects: int
+    :type repeat: int
+    :rtype: StageResult
+    """
+    best = None
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+    return StageResult(name, best, size, objects)
+
+
+def count_keys(animations):
+    return sum(len(kf_bone.rotationKeys) + len(kf_bone.translationKeys) + len(kf_bone.scaleKeys or ())
+               for animation in animations for kf_bone in animation.kfBones)
+
+
+def pmm_stages(scale, repeat):
+    results = []
+    num_vertices = 2000 * scale
+    for version in fmt_smon_pmm.PMM_VERSIONS:
+        label = "PMM {0}".format(hex(ord(version)))
+        plain = build_pmm(num_vertices, num_vertices * 3 // 2, version)
+        ciphered = bytes(fmt_smon_pmm.as_enciphered(plain))
+
+        results.append(time_stage(label + " signature", lambda: [fmt_smon_pmm.pmm_check_type(ciphered)
+                                                                  for _ in range(1000)], 4000, 1000, repeat))
+        results.append(time_stage(label + " decipher", lambda: fmt_smon_pmm.as_deciphered(ciphered),
+                                  len(ciphered), len(ciphered), repeat))
+        results.append(time_stage(label + " decipher stream",
+                                  lambda: fmt_smon_pmm.decipher_stream(NoeBitStream(ciphered), len(ciphered)),
+                                  len(ciphered), len(ciphered), repeat))
+        buffer = bytearray(ciphered)
+        results.append(time_stage(label + " decipher in place",
+                                  lambda: fmt_smon_pmm.decipher_into(buffer, 0, len(buffer)),
+                                  len(ciphered), len(ciphered), repeat))
+        results.append(time_stage(label + " parse", lambda: fmt_smon_pmm.load_pmm_data(NoeBitStream(plain)),
+                                  len(plain), num_vertices, repeat))
+        with contextlib.redirect_stdout(io.StringIO()):
+            pmm_data = fmt_smon_pmm.load_pmm_data(NoeBitStream(plain))
+        results.append(time_stage(label + " model", pmm_data.construct_model, len(plain), num_vertices, repeat))
+    return results
+
+
+def plm_stages(scale, repeat):
+    results = []
+    num_bones = 32
+    anim_num_frames = tuple([60 * scale] * 8)
+    for version in (fmt_smon_plm.PLM_V2, fmt_smon_plm.PLM_V6, fmt_smon_plm.PLM_V9):
+        label = "PLM {0}".format(hex(ord(version)))
+        data = build_plm(num_bones, anim_num_frames, version)
+
+        def read_header():
+            bs = NoeBitStream(data)
+            return bs, fmt_smon_plm.plm_read_header(bs, 64)
+
+        def read_bones():
+            bs, header = read_header()
+            return bs, header, fmt_smon_plm.plm_read_bones(bs, header)
+
+        def read_animations():
+            bs, header, bones = read_bones()
+            return fmt_smon_plm.plm_read_animations(bs, header.anim_num_frames, bones, header.num_animations,
+                                                    header.num_bones, header.version, header.scale_divider)
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            num_keys = count_keys(read_animations())
+
+        results.append(time_stage(label + " signature", lambda: [fmt_smon_plm.plm_check_type(data)
+                                                                  for _ in range(1000)], 3000, 1000, repeat))
+        results.append(time_stage(label + " header", read_header, len(data), 1, repeat))
+        results.append(time_stage(label + " bones", read_bones, len(data), num_bones, repeat))
+        results.append(time_stage(label + " keyframes", read_animations, len(data), num_keys, repeat))
+        if numpy is not None:
+            results.append(time_stage(label + " keyframes arrays",
+                                      lambda: fmt_smon_plm.load_plm_animation_arrays(NoeBitStream(data), 64),
+                                      len(data), num_keys, repeat))
+    return results
+
+
+def pose_stages(scale, repeat):
+    if numpy is None:
+        return []
+
+    num_bones = 32
+    num_frames = 60 * scale
+    num_vertices = 2000 * scale
+    with contextlib.redirect_stdout(io.StringIO()):
+        skeleton, tracks = fmt_smon_plm.load_plm_skeleton(NoeBitStream(build_plm(num_bones, (num_frames,))), 64)
+        pmm_data = fmt_smon_pmm.load_pmm_data(NoeBitStream(build_pmm(num_vertices, 3, num_bones=num_bones)))
+    track = tracks[0]
+    world_matrices = inc_smon_pose.evaluate_track(skeleton, track)
+    skin_matrices = inc_smon_pose.skinning_matrices(skeleton, world_matrices)
+    positions, vertex_bones = inc_smon_pose.pmm_vertex_arrays(pmm_data)
+    return [
+        time_stage("Pose evaluate", lambda: inc_smon_pose.evaluate_track(skeleton, track),
+                   0, num_frames * num_bones, repeat),
+        time_stage("Pose skin", lambda: inc_smon_pose.skin_vertices(positions, vertex_bones, skin_matrices),
+                   0, num_frames * num_vertices, repeat),
+        time_stage("Pose bounds", lambda: inc_smon_pose.frame_bounds(pmm_data, skeleton, track),
+                   0, num_frames, repeat),
+    ]
+
+
+def fid_stages(scale, repeat, directory):
+    texture_names = ("tex_a.png", "tex_b.png")
+    for name in texture_names:
+        with open(os.path.join(directory, name), "wb") as f:
+            f.write(build_png())
+
+    num_vertices = 3000 * scale
+    results = []
+    for with_uv2 in (False, True):
+        label = "FID uv2" if with_uv2 else "FID"
+        data = build_fid(4, num_vertices, with_uv2, texture_names)
+        results.append(time_stage(label + " signature", lambda: [fmt_smon_fid.fid_check_type(data)
+                                                                  for _ in range(1000)], 6000, 1000, repeat))
+        results.append(time_stage(label + " model", lambda: fmt_smon_fid.fid_load_model(data, [], directory),
+                                  len(data), num_vertices * 4, repeat))
+    return results
+
+
+def joker_stages(scale, repeat):
+    data = build_joker(256 * scale)
+    return [
+        time_stage("Joker signature", lambda: [fmt_smon_joker.joker_check_type(data) for _ in range(1000)],
+                   5000, 1000, repeat),
+        time_stage("Joker textures", lambda: fmt_smon_joker.load_joker_file(data, []), len(data), 2, repeat),
+    ]
+
+
+def dat_stages(scale, repeat):
+    data = build_dat(pmm=build_pmm(2000 * scale, 3000 * scale), plm=build_plm(32, tuple([60 * scale] * 8)))
+    return [
+        time_stage("DAT signature", lambda: [fmt_smon_dat.dat_check_type(data) for _ in range(1000)],
+                   8000, 1000, repeat),
+        time_stage("DAT index", lambda: fmt_smon_dat.DatIndex(data), len(data), 6, repeat),
+        time_stage("DAT model", lambda: fmt_smon_dat.dat_load_model(data, []), len(data), 1, repeat),
+    ] + dat_texture_stages(scale, repeat)
+
+
+def dat_texture_stages(scale, repeat):
+    # A diffuse and alpha image of each of the six elements, like DAT_TEXTURE_WORKERS expects
+    textures = {element: build_joker(256 * scale, seed=element * 2) for element in range(1, 7)}
+    data = build_dat(textures=textures)
+    index = fmt_smon_dat.DatIndex(data)
+    bs = NoeBitStream(data)
+    images = []
+    for diffuse_bytes, alpha_bytes, extension in fmt_smon_dat.read_texture_images(bs, index.textures):
+        images.append((bytes(diffuse_bytes), extension))
+        images.append((bytes(alpha_bytes), extension))
+    size = sum(len(image) for image, _ in images)
+    workers = fmt_smon_dat.DAT_TEXTURE_WORKERS
+    return [
+        time_stage("DAT textures serial", lambda: fmt_smon_dat.decode_images(images, 1), size, len(images), repeat),
+        time_stage("DAT textures parallel", lambda: fmt_smon_dat.decode_images(images, workers),
+                   size, len(images), repeat),
+    ]
+
+
+def run(scale=1, repeat=3):
+    """
+    Runs every stage.
+    :type scale: int
+    :param scale: Multiplier of the synthetic data sizes.
+    :type repeat: int
+    :param repeat: Number of runs of each stage, the best time is kept.
+    :rtype: list[StageResult]
+    """
+    directory = tempfile.mkdtemp(prefix="smon_bench_")
+    try:
+        return (pmm_stages(scale, repeat) + plm_stages(scale, repeat) + pose_stages(scale, repeat) +
+                fid_stages(scale, repeat, directory) + joker_stages(scale, repeat) + dat_stages(scale, repeat))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def find_regressions(results, baseline, tolerance):
+    """
+    Compares the results to a baseline from --save.
+    :type results: list[StageResult]
+    :type baseline: dict[str, dict]
+    :type tolerance: float
+    :param tolerance: Allowed slowdown, 0.25 allows stages to be up to 25% slower than the baseline.
+    :rtype: list[tuple[StageResult, float]]
+    :return: Each regressed stage with its time relative to the baseline.
+    """
+    regressions = []
+    for result in results:
+        expected = baseline.get(result.name)
+        if expected and expected["seconds"] > 0:
+            ratio = result.seconds / expected["seconds"]
+            if ratio > 1 + tolerance:
+                regressions.append((result, ratio))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks the plugins on synthetic data.")
+    parser.add_argument("--scale", type=int, default=1, help="Multiplier of the synthetic data sizes.")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs of each stage, the best time is kept.")
+    parser.add_argument("--save", help="Write the results to this JSON file.")
+    parser.add_argument("--baseline", help="Compare the results to a JSON file written with --save.")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown relative to the baseline.")
+    args = parser.parse_args(argv)
+
+    results = run(args.scale, args.repeat)
+
+    print("{0:32} {1:>10} {2:>10} {3:>14}".format("Stage", "ms", "MB/s", "objects/s"))
+    for result in results:
+        print("{0:32} {1:10.3f} {2:10.1f} {3:14.0f}".format(result.name, result.seconds * 1000,
+                                                           result.mb_per_second, result.objects_per_second))
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(dict((r.name, r.to_dict()) for r in results), f, indent=1)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = find_regressions(results, baseline, args.tolerance)
+        for result, ratio in regressions:
+            print("[REGRESSION] {0}: {1:.2f}x the baseline time".format(result.name, ratio))
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,309 @@
+"""
+Keeps a catalogue of the Summoners War files of a directory tree in an SQLite database.
+Each file is probed from its headers only, and a rescan only probes files that were added or whose size or
+modification time changed.
+
+Usage: python smon_catalog.py <directory> [--db catalog.sqlite] [--find-texture file.pmod]
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import time
+
+import headless
+
+# Outside of Noesis, the plugins run on the stand-in Noesis API.
+headless.install()
+
+from fmt_smon_dat import material_names
+from fmt_smon_pmm import pmod_texture_candidates
+from inc_smon_probe import probe_file
+
+CATALOG_EXTENSIONS = (".dat", ".pmod", ".pliv", ".fid", ".png")
+CATALOG_DEFAULT_DB = "smon_catalog.sqlite"
+
+# Bumped whenever the schema or the probed values change, which drops the catalogue
+CATALOG_VERSION = 2
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    directory TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    format TEXT,
+    version TEXT,
+    plm_version TEXT,
+    ciphered INTEGER,
+    name TEXT,
+    num_vertices INTEGER,
+    num_tris INTEGER,
+    num_meshes INTEGER,
+    num_bones INTEGER,
+    num_animations INTEGER,
+    anim_num_frames TEXT,
+    num_textures INTEGER,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS files_directory ON files (directory);
+CREATE INDEX IF NOT EXISTS files_format ON files (format);
+CREATE INDEX IF NOT EXISTS files_name ON files (name);
+CREATE TABLE IF NOT EXISTS textures (
+    path TEXT NOT NULL,
+    slot INTEGER NOT NULL,
+    material_id INTEGER,
+    material TEXT,
+    texture_name TEXT,
+    PRIMARY KEY (path, slot)
+);
+CREATE INDEX IF NOT EXISTS textures_texture_name ON textures (texture_name);
+"""
+
+_FILE_COLUMNS = ("path", "directory", "size", "mtime_ns", "format", "version", "plm_version", "ciphered", "name",
+                 "num_vertices", "num_tris", "num_meshes", "num_bones", "num_animations", "anim_num_frames",
+                 "num_textures", "error")
+
+
+class ScanResult:
+    """
+    Counts of what a scan changed in the catalogue.
+    :cvar added: Files probed for the first time.
+    :cvar updated: Files probed again because their size or modification time changed.
+    :cvar removed: Files no longer found.
+    :cvar unchanged: Files kept from the previous scan without being probed.
+    :cvar failed: Probed files that could not be read, their error is recorded in the catalogue.
+    :cvar seconds: Time spent scanning.
+    """
+
+    def __init__(self):
+        self.added = 0
+        self.updated = 0
+        self.removed = 0
+        self.unchanged = 0
+        self.failed = 0
+        self.seconds = 0.0
+
+    def __str__(self):
+        return "Added: {0} | Updated: {1} | Removed: {2} | Unchanged: {3} | Failed: {4} | {5:.2f}s".format(
+            self.added, self.updated, self.removed, self.unchanged, self.failed, self.seconds)
+
+
+class AssetCatalog:
+    """
+    SQLite catalogue of probed files. Paths are stored absolute and normalised with normcase.
+    Rows are returned as sqlite3.Row, which can be indexed by column name.
+    """
+
+    def __init__(self, db_path=CATALOG_DEFAULT_DB):
+        """
+        :type db_path: str
+        :param db_path: Path of the database file, created if missing.
+        """
+        self.connection = sqlite3.connect(db_path)
+        self.connection.row_factory = sqlite3.Row
+        version = self.connection.execute("PRAGMA user_version").fetchone()[0]
+        if version != CATALOG_VERSION:
+            self.connection.executescript("DROP TABLE IF EXISTS files; DROP TABLE IF EXISTS textures;")
+            self.connection.execute("PRAGMA user_version = {0}".format(CATALOG_VERSION))
+        self.connection.executescript(_SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    # ==================================== Scan ===================================== #
+
+    def scan(self, root, extensions=CATALOG_EXTENSIONS):
+        """
+        Brings the catalogue of the directory tree up to date.
+        Only files that are new, or whose size or modification time changed, are probed.
+        :type root: str
+        :type extensions: tuple[str]
+        :param extensions: Lowercase extensions of the files to catalogue.
+        :rtype: ScanResult
+        """
+        start = time.perf_counter()
+        result = ScanResult()
+        root = _normalize(root)
+        prefix = os.path.join(root, "")
+
+        known = {}
+        for row in self.connection.execute("SELECT path, size, mtime_ns FROM files"):
+            if row[0].startswith(prefix):
+                known[row[0]] = (row[1], row[2])
+
+        with self.connection:
+            for path, stat in walk_files(root, extensions):
+                previous = known.pop(path, None)
+                if previous == (stat.st_size, stat.st_mtime_ns):
+                    result.unchanged += 1
+                    continue
+                if previous is None:
+                    result.added += 1
+                else:
+                    result.updated += 1
+                if not self._probe(path, stat):
+                    result.failed += 1
+
+            for path in known:
+                self._delete(path)
+            result.removed = len(known)
+
+        result.seconds = time.perf_counter() - start
+        return result
+
+    def _probe(self, path, stat):
+        error = None
+        try:
+            probe = probe_file(path)
+        except Exception as e:
+            probe, error = None, "{0}: {1}".format(type(e).__name__, e)
+
+        values = dict.fromkeys(_FILE_COLUMNS)
+        values.update(path=path, directory=os.path.dirname(path), size=stat.st_size, mtime_ns=stat.st_mtime_ns,
+                      error=error)
+        textures = []
+        if probe is not None:
+            for column in _FILE_COLUMNS[4:-1]:
+                values[column] = getattr(probe, column)
+            if probe.ciphered is not None:
+                values["ciphered"] = int(probe.ciphered)
+            if probe.anim_num_frames is not None:
+                values["anim_num_frames"] = json.dumps(probe.anim_num_frames)
+            for slot, material_id in enumerate(probe.material_ids or ()):
+                textures.append((path, slot, material_id, material_names.get(material_id), None))
+            for slot, texture_name in enumerate(probe.texture_names or ()):
+                textures.append((path, slot, None, None, texture_name))
+
+        self._delete(path)
+        self.connection.execute("INSERT INTO files ({0}) VALUES ({1})".format(
+            ", ".join(_FILE_COLUMNS), ", ".join("?" * len(_FILE_COLUMNS))), [values[c] for c in _FILE_COLUMNS])
+        self.connection.executemany("INSERT INTO textures VALUES (?, ?, ?, ?, ?)", textures)
+        return error is None
+
+    def _delete(self, path):
+        self.connection.execute("DELETE FROM files WHERE path = ?", (path,))
+        self.connection.execute("DELETE FROM textures WHERE path = ?", (path,))
+
+    # =================================== Queries =================================== #
+
+    def get(self, filepath):
+        """
+        :type filepath: str
+        :rtype: sqlite3.Row | None
+        """
+        return self.connection.execute("SELECT * FROM files WHERE path = ?", (_normalize(filepath),)).fetchone()
+
+    def isfile(self, filepath):
+        """
+        Whether the file was found by the last scan. Can be used as the exists check of pmod_guess_texture_file.
+        :type filepath: str
+        :rtype: bool
+        """
+        return self.connection.execute("SELECT 1 FROM files WHERE path = ?",
+                                       (_normalize(filepath),)).fetchone() is not None
+
+    def find(self, **columns):
+        """
+        Returns the files whose columns equal the given values, for example find(format="dat", num_bones=12).
+        :rtype: list[sqlite3.Row]
+        """
+        for column in columns:
+            if column not in _FILE_COLUMNS:
+                raise Exception("[Catalog] Unknown column: {0}".format(column))
+        where = " AND ".join("{0} = ?".format(column) for column in columns) or "1"
+        return self.connection.execute("SELECT * FROM files WHERE {0} ORDER BY path".format(where),
+                                       list(columns.values())).fetchall()
+
+    def find_textures(self, path=None, material=None, texture_name=None):
+        """
+        Returns the texture slots of DAT and FID files matching the given values.
+        :type path: str
+        :type material: str
+        :param material: Element name of DAT texture chunks, one of the values of material_names.
+        :type texture_name: str
+        :param texture_name: Texture filename referenced by FID files.
+        :rtype: list[sqlite3.Row]
+        """
+        conditions, values = [], []
+        for column, value in (("path", None if path is None else _normalize(path)), ("material", material),
+                              ("texture_name", texture_name)):
+            if value is not None:
+                conditions.append("{0} = ?".format(column))
+                values.append(value)
+        where = " AND ".join(conditions) or "1"
+        return self.connection.execute("SELECT * FROM textures WHERE {0} ORDER BY path, slot".format(where),
+                                       values).fetchall()
+
+    def guess_texture_file(self, pmod_filepath):
+        """
+        Finds the texture of a .pmod file with the same rules as pmod_guess_texture_file, in a single query.
+        :type pmod_filepath: str
+        :rtype: str | None
+        :return: The texture path, or None if no candidate is in the catalogue.
+        """
+        png_filepath = _normalize(pmod_filepath[:-5] + ".png")
+        candidates = [png_filepath] + [_normalize(c) for c in pmod_texture_candidates(png_filepath)]
+        found = set()
+        # Stay under the default limit of 999 variables of older SQLite versions
+        for i in range(0, len(candidates), 500):
+            batch = candidates[i:i + 500]
+            found.update(row[0] for row in self.connection.execute(
+                "SELECT path FROM files WHERE path IN ({0})".format(", ".join("?" * len(batch))), batch))
+        for candidate in candidates:
+            if candidate in found:
+                return candidate
+        return None
+
+
+def walk_files(root, extensions=CATALOG_EXTENSIONS):
+    """
+    Yields the path and stat result of every file with one of the extensions under the directory.
+    Uses os.scandir, so most platforms need no extra system call per file to get its size and modification time.
+    :type root: str
+    :type extensions: tuple[str]
+    :rtype: collections.Iterable[tuple[str, os.stat_result]]
+    """
+    pending = [root]
+    while pending:
+        try:
+            entries = list(os.scandir(pending.pop()))
+        except OSError:
+            continue
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                pending.append(entry.path)
+            elif os.path.splitext(entry.name)[1].lower() in extensions:
+                try:
+                    yield _normalize(entry.path), entry.stat()
+                except OSError:
+                    continue
+
+
+def _normalize(filepath):
+    return os.path.normcase(os.path.abspath(filepath))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Catalogues Summoners War files from their headers.")
+    parser.add_argument("root", help="Directory to catalogue. Searched recursively.")
+    parser.add_argument("--db", default=CATALOG_DEFAULT_DB, help="Catalogue database. Default: " + CATALOG_DEFAULT_DB)
+    parser.add_argument("--find-texture", metavar="PMOD", help="Print the texture found for this .pmod file.")
+    args = parser.parse_args(argv)
+
+    with AssetCatalog(args.db) as catalog:
+        print(catalog.scan(args.root))
+        if args.find_texture:
+            print(catalog.guess_texture_file(args.find_texture))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,205 @@
+"""
+Saves the images of .dat files and Joker .png files to disk without decoding them.
+The JPEG and PNG data is sliced out of the memory mapped file and written as is, so no image library is needed.
+Images of .dat files are named like the textures of load_textures: the embedded filename, the element name,
+then _diffuse or _alpha.
+
+Usage: python smon_extract.py <file or directory> [--output directory]
+"""
+import argparse
+import os
+import sys
+import time
+
+import headless
+
+# Outside of Noesis, the plugins run on the stand-in Noesis API.
+headless.install()
+
+from fmt_smon_dat import DatIndex, DatHeader, dat_check_type, dat_texture_name, read_texture_images
+from fmt_smon_joker import is_joker_chunk, read_joker_images
+from inc_noesis import NOESEEK_ABS
+from inc_smon import MappedStream
+from inc_smon_probe import PNG_SIGNATURE
+from smon_catalog import walk_files
+
+EXTRACT_EXTENSIONS = (".dat", ".png")
+
+
+class ExtractResult:
+    """
+    Counts of what an extraction wrote.
+    :cvar files: Files the images were extracted from.
+    :cvar images: Images written.
+    :cvar bytes: Bytes written.
+    :cvar skipped: Files that are neither a DAT nor a Joker file.
+    :cvar failed: Files that could not be read.
+    :cvar seconds: Time spent extracting.
+    """
+
+    def __init__(self):
+        self.files = 0
+        self.images = 0
+        self.bytes = 0
+        self.skipped = 0
+        self.failed = 0
+        self.seconds = 0.0
+
+    def __str__(self):
+        return "Files: {0} | Images: {1} | {2:.2f} MB | Skipped: {3} | Failed: {4} | {5:.2f}s".format(
+            self.files, self.images, self.bytes / (1024 * 1024), self.skipped, self.failed, self.seconds)
+
+
+def image_extension(data):
+    """
+    :type data: bytes | memoryview
+    :param data: Encoded image.
+    :rtype: str
+    :return: ".png" for PNG data, otherwise ".jpg".
+    """
+    return ".png" if bytes(data[:len(PNG_SIGNATURE)]) == PNG_SIGNATURE else ".jpg"
+
+
+def dat_images(index):
+    """
+    Returns the encoded images of every texture chunk of an indexed .dat file.
+    :type index: DatIndex
+    :rtype: list[tuple[str, memoryview]]
+    :return: Name without extension and data of each image, as views over the file data.
+    """
+    bs = MappedStream(index.data)
+    bs.seek(index.header.offset, NOESEEK_ABS)
+    header = DatHeader(bs, index.header.size)
+
+    images = []
+    for chunk, (diffuse, alpha, _) in zip(index.textures, read_texture_images(bs, index.textures)):
+        name = dat_texture_name(header, chunk)
+        if diffuse is not None:
+            images.append((name + "_diffuse", diffuse))
+        if alpha is not None:
+            images.append((name + "_alpha", alpha))
+    return images
+
+
+def joker_images(bs, name):
+    """
+    Returns the encoded images of a Joker file.
+    :type bs: MappedStream
+    :param bs: Stream of the file.
+    :type name: str
+    :param name: Name of the file without extension, which the images are named after.
+    :rtype: list[tuple[str, memoryview]]
+    """
+    if bs.getSize() < 5 or not is_joker_chunk(bs):
+        return []
+    diffuse, alpha = read_joker_images(bs)
+    return [(name + suffix, data) for suffix, data in (("_diffuse", diffuse), ("_alpha", alpha)) if data is not None]
+
+
+def extract_file(filepath, output=None, taken=None):
+    """
+    Writes the images of a .dat or Joker .png file.
+    :type filepath: str
+    :type output: str
+    :param output: Directory to write to, created if missing. Defaults to the directory of the file.
+    :type taken: set[str]
+    :param taken: Paths already written, which are not overwritten: a number is appended to the name instead.
+    Updated with the written paths.
+    :rtype: list[str]
+    :return: Paths of the written images. Empty if the file is neither a DAT nor a Joker file.
+    """
+    output = os.path.dirname(filepath) if output is None else output
+    taken = set() if taken is None else taken
+
+    # The images are views over the map, which is closed once they are written
+    if filepath.lower().endswith(".dat"):
+        with open(filepath, "rb") as f:
+            if not dat_check_type(f.read(0x1000)):
+                return []
+        with DatIndex.from_file(filepath) as index:
+            return write_images(dat_images(index), output, taken)
+    with MappedStream.from_file(filepath) as bs:
+        return write_images(joker_images(bs, os.path.splitext(os.path.basename(filepath))[0]), output, taken)
+
+
+def write_images(images, output, taken):
+    """
+    Writes the encoded images to the directory, with the extension of their format.
+    :type images: list[tuple[str, bytes | memoryview]]
+    :param images: Name without extension and data of each image.
+    :type output: str
+    :param output: Directory to write to, created if missing.
+    :type taken: set[str]
+    :param taken: Paths already written, see extract_file. Updated with the written paths.
+    :rtype: list[str]
+    :return: Paths of the written images.
+    """
+    if images and output and not os.path.isdir(output):
+        os.makedirs(output)
+    written = []
+    for name, data in images:
+        extension = image_extension(data)
+        image_filepath = os.path.join(output, name + extension)
+        number = 1
+        while os.path.normcase(image_filepath) in taken:
+            image_filepath = os.path.join(output, "{0}_{1}{2}".format(name, number, extension))
+            number += 1
+        taken.add(os.path.normcase(image_filepath))
+        with open(image_filepath, "wb") as f:
+            f.write(data)
+        written.append(image_filepath)
+    return written
+
+
+def extract_all(root, output=None):
+    """
+    Writes the images of every .dat and Joker .png file under the directory, or of a single file.
+    :type root: str
+    :type output: str
+    :param output: Directory to write to, created if missing. Defaults to the directory of each file.
+    The directories of the files relative to the root are kept under it.
+    :rtype: ExtractResult
+    """
+    start = time.perf_counter()
+    result = ExtractResult()
+    if output is not None and not os.path.isdir(output):
+        os.makedirs(output)
+
+    is_file = os.path.isfile(root)
+    filepaths = [root] if is_file else sorted(path for path, _ in walk_files(root, EXTRACT_EXTENSIONS))
+    taken = set()
+    for filepath in filepaths:
+        file_output = output
+        if output is not None and not is_file:
+            file_output = os.path.normpath(os.path.join(output, os.path.relpath(os.path.dirname(filepath), root)))
+        try:
+            written = extract_file(filepath, file_output, taken)
+        except Exception as e:
+            result.failed += 1
+            print("[FAILED] {0}: {1}".format(filepath, e), file=sys.stderr)
+            continue
+        if not written:
+            result.skipped += 1
+            continue
+        result.files += 1
+        result.images += len(written)
+        result.bytes += sum(os.path.getsize(path) for path in written)
+
+    result.seconds = time.perf_counter() - start
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Saves the images of .dat and Joker .png files without decoding.")
+    parser.add_argument("root", help="File or directory to extract. Directories are searched recursively.")
+    parser.add_argument("-o", "--output", help="Directory to write the images to, keeping the directories of the "
+                                               "files. Default: next to each file.")
+    args = parser.parse_args(argv)
+
+    result = extract_all(args.root, args.output)
+    print(result)
+    return 0 if result.failed == 0 else 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
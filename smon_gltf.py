@@ -0,0 +1,489 @@
+"""
+Exports Summoners War .dat and .pmod models to binary glTF 2.0 (.glb) files, without Noesis.
+Buffers are written from the parsed PMM and PLM chunks with numpy, and images are embedded exactly as stored.
+The texture chunks of a .dat file become material variants (KHR_materials_variants), one per element.
+
+Usage: python smon_gltf.py <file.dat | file.pmod> [-o output.glb]
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import struct
+import sys
+
+import headless
+
+# Outside of Noesis, the plugins run on the stand-in Noesis API.
+headless.install()
+
+import noesis
+import fmt_smon_plm
+from fmt_smon_dat import DatIndex, DatHeader, dat_texture_name, material_names, read_texture_images
+from fmt_smon_joker import is_joker_chunk, read_joker_images
+from fmt_smon_plm import load_plm_skeleton, plm_check_type, compose_matrices
+from fmt_smon_pmm import load_pmm_data, pmm_check_ciphered, decipher_into, pmod_guess_texture_file
+from inc_noesis import NOESEEK_ABS
+from inc_smon import MappedStream, numpy, peek_bytes
+from inc_smon_probe import PNG_SIGNATURE
+
+GLB_MAGIC = b"glTF"
+GLB_VERSION = 2
+GLB_CHUNK_JSON = 0x4E4F534A
+GLB_CHUNK_BIN = 0x004E4942
+
+GLTF_BYTE = 5120
+GLTF_UNSIGNED_BYTE = 5121
+GLTF_UNSIGNED_SHORT = 5123
+GLTF_FLOAT = 5126
+
+GLTF_ARRAY_BUFFER = 34962
+GLTF_ELEMENT_ARRAY_BUFFER = 34963
+
+# Key times are frame / 30 seconds, like plm_read_keys
+GLTF_FRAMES_PER_SECOND = 30.0
+
+_ACCESSOR_TYPES = {1: "SCALAR", 2: "VEC2", 3: "VEC3", 4: "VEC4", 16: "MAT4"}
+_COMPONENT_TYPES = {
+    numpy.dtype("int8"): GLTF_BYTE,
+    numpy.dtype("uint8"): GLTF_UNSIGNED_BYTE,
+    numpy.dtype("uint16"): GLTF_UNSIGNED_SHORT,
+    numpy.dtype("float32"): GLTF_FLOAT,
+} if numpy is not None else {}
+
+
+class GlbWriter:
+    """
+    Builds the JSON document and the binary buffer of a .glb file.
+    Each add_* method appends an object to the document and returns its index.
+    """
+
+    def __init__(self):
+        self.document = {
+            "asset": {"version": "2.0", "generator": "noesis-smon smon_gltf"},
+            "scene": 0,
+            "scenes": [{"nodes": []}],
+        }
+        self.buffer = bytearray()
+
+    def add(self, kind, item):
+        """
+        Appends the item to the list of the document with the given name, such as "nodes".
+        :type kind: str
+        :type item: dict
+        :rtype: int
+        """
+        items = self.document.setdefault(kind, [])
+        items.append(item)
+        return len(items) - 1
+
+    def add_buffer_view(self, data, target=None):
+        """
+        Appends the bytes to the binary buffer, aligned to 4 bytes.
+        :type data: bytes | bytearray | memoryview
+        :type target: int
+        :param target: GLTF_ARRAY_BUFFER or GLTF_ELEMENT_ARRAY_BUFFER for vertex and index data.
+        :rtype: int
+        """
+        self.buffer += b"\x00" * (-len(self.buffer) % 4)
+        view = {"buffer": 0, "byteOffset": len(self.buffer), "byteLength": len(data)}
+        if target is not None:
+            view["target"] = target
+        self.buffer += data
+        return self.add("bufferViews", view)
+
+    def add_accessor(self, array, target=None, normalized=False, bounds=False):
+        """
+        Appends the array as a tightly packed buffer view and an accessor of it.
+        :type array: numpy.ndarray
+        :param array: Array of shape (count,) or (count, components), of a dtype in _COMPONENT_TYPES.
+        :type target: int
+        :type normalized: bool
+        :type bounds: bool
+        :param bounds: Whether to write the min and max, which glTF requires for positions and animation inputs.
+        :rtype: int
+        """
+        components = 1 if array.ndim == 1 else array.shape[1]
+        accessor = {
+            "bufferView": self.add_buffer_view(numpy.ascontiguousarray(array).astype(array.dtype.newbyteorder("<"),
+                                                                                     copy=False).tobytes(), target),
+            "componentType": _COMPONENT_TYPES[array.dtype],
+            "count": len(array),
+            "type": _ACCESSOR_TYPES[components],
+        }
+        if normalized:
+            accessor["normalized"] = True
+        if bounds:
+            values = array.reshape(len(array), components)
+            accessor["min"] = values.min(axis=0).tolist()
+            accessor["max"] = values.max(axis=0).tolist()
+        return self.add("accessors", accessor)
+
+    def add_image(self, data, name):
+        """
+        Embeds an encoded image as is.
+        :type data: bytes | memoryview
+        :type name: str
+        :rtype: int
+        """
+        mime_type = "image/png" if bytes(data[:len(PNG_SIGNATURE)]) == PNG_SIGNATURE else "image/jpeg"
+        return self.add("images", {"name": name, "bufferView": self.add_buffer_view(data), "mimeType": mime_type})
+
+    def to_bytes(self):
+        """
+        :rtype: bytes
+        """
+        if self.buffer:
+            self.document["buffers"] = [{"byteLength": len(self.buffer)}]
+        document = json.dumps(self.document, separators=(",", ":")).encode()
+        document += b" " * (-len(document) % 4)
+        binary = bytes(self.buffer) + b"\x00" * (-len(self.buffer) % 4)
+
+        chunks = struct.pack("<II", len(document), GLB_CHUNK_JSON) + document
+        if binary:
+            chunks += struct.pack("<II", len(binary), GLB_CHUNK_BIN) + binary
+        return struct.pack("<4sII", GLB_MAGIC, GLB_VERSION, 12 + len(chunks)) + chunks
+
+    def write(self, filepath):
+        with open(filepath, "wb") as f:
+            f.write(self.to_bytes())
+
+
+class GltfTexture:
+    """
+    Encoded images of one texture chunk.
+    :cvar name: Texture name, like the names given by load_textures.
+    :cvar material_id: Element ID of the chunk, None for files without one.
+    :cvar diffuse: Encoded diffuse image.
+    :cvar alpha: Encoded alpha image, None if there is none.
+    """
+
+    def __init__(self, name, material_id, diffuse, alpha=None):
+        self.name = name
+        self.material_id = material_id
+        self.diffuse = diffuse
+        self.alpha = alpha
+
+
+def export_model(writer, name, pmm_data, skeleton=None, tracks=(), textures=(), interpolation=None,
+                 ignore_scale=None):
+    """
+    Adds the mesh, skeleton, animations and textures of a model to the writer.
+    :type writer: GlbWriter
+    :type name: str
+    :type pmm_data: PmmData
+    :type skeleton: PlmSkeleton | None
+    :type tracks: list[PlmTrack] | LazyPlmAnimations
+    :type textures: list[GltfTexture]
+    :param textures: Each texture becomes a material. With more than one, they are material variants.
+    :type interpolation: int
+    :param interpolation: Defaults to PLM_INTERPOLATE_TYPE. Nearest exports STEP samplers, linear LINEAR ones.
+    :type ignore_scale: int
+    :param ignore_scale: Defaults to PLM_IGNORE_SCALE.
+    """
+    interp = fmt_smon_plm.PLM_INTERPOLATE_TYPE if interpolation is None else interpolation
+    ignore_scale = fmt_smon_plm.PLM_IGNORE_SCALE if ignore_scale is None else ignore_scale
+    scene_nodes = writer.document["scenes"][0]["nodes"]
+
+    # ==================================== Mesh ===================================== #
+
+    normals = pmm_data.normal_array()
+    lengths = numpy.linalg.norm(normals, axis=1, keepdims=True)
+    normals = numpy.where(lengths > 0, normals / numpy.maximum(lengths, 1e-12), (0, 0, 1)).astype(numpy.float32)
+    # construct_model negates V for Noesis, glTF uses the UVs as stored
+    uvs = pmm_data.uv_array() * numpy.array((1, -1), dtype=numpy.float32)
+
+    attributes = {
+        "POSITION": writer.add_accessor(pmm_data.position_array(), GLTF_ARRAY_BUFFER, bounds=True),
+        "NORMAL": writer.add_accessor(normals, GLTF_ARRAY_BUFFER),
+        "TEXCOORD_0": writer.add_accessor(uvs, GLTF_ARRAY_BUFFER),
+    }
+    # num_tris is the number of indices, which are already tightly packed uint16
+    indices = numpy.frombuffer(pmm_data.tri_indices, dtype="<u2", count=pmm_data.num_tris)
+    primitive = {
+        "attributes": attributes,
+        "indices": writer.add_accessor(indices.astype(numpy.uint16), GLTF_ELEMENT_ARRAY_BUFFER),
+    }
+    mesh_node = {"name": name, "mesh": writer.add("meshes", {"name": name, "primitives": [primitive]})}
+
+    # =================================== Materials ================================= #
+
+    variants = []
+    for texture in textures:
+        material = {"name": texture.name,
+                    "pbrMetallicRoughness": {"metallicFactor": 0.0,
+                                             "baseColorTexture": {"index": _add_texture(writer, texture.diffuse,
+                                                                                        texture.name + "_diffuse")}}}
+        if texture.alpha is not None:
+            # glTF has no separate opacity texture, the alpha image is embedded for tools that read it from extras
+            material["extras"] = {"opacityTexture": _add_texture(writer, texture.alpha, texture.name + "_alpha")}
+        variants.append((writer.add("materials", material), texture))
+
+    if variants:
+        primitive["material"] = variants[0][0]
+    if len(variants) > 1:
+        writer.document.setdefault("extensionsUsed", []).append("KHR_materials_variants")
+        writer.document.setdefault("extensions", {})["KHR_materials_variants"] = {"variants": [
+            {"name": material_names.get(texture.material_id, texture.name)} for _, texture in variants]}
+        primitive["extensions"] = {"KHR_materials_variants": {"mappings": [
+            {"material": material, "variants": [i]} for i, (material, _) in enumerate(variants)]}}
+
+    if skeleton is None or skeleton.num_bones == 0:
+        scene_nodes.append(writer.add("nodes", mesh_node))
+        return
+
+    # =================================== Skeleton ================================== #
+
+    vertex_bones = pmm_data.bone_index_array()
+    if len(vertex_bones) and vertex_bones.max() >= skeleton.num_bones:
+        raise Exception("[glTF] Vertex bound to bone {0}, skeleton has {1} bones".format(vertex_bones.max(),
+                                                                                         skeleton.num_bones))
+    joints = numpy.zeros((len(vertex_bones), 4), dtype=numpy.uint8)
+    joints[:, 0] = vertex_bones
+    weights = numpy.zeros((len(vertex_bones), 4), dtype=numpy.uint8)
+    weights[:, 0] = 0xFF
+    attributes["JOINTS_0"] = writer.add_accessor(joints, GLTF_ARRAY_BUFFER)
+    attributes["WEIGHTS_0"] = writer.add_accessor(weights, GLTF_ARRAY_BUFFER, normalized=True)
+
+    first_bone_node = len(writer.document.get("nodes", ()))
+    translations, rotations, scales = decompose_matrices(skeleton.local_matrices)
+    for i in range(skeleton.num_bones):
+        node = {"name": "Bone {0}".format(i), "translation": translations[i].tolist(),
+                "rotation": rotations[i].tolist(), "scale": scales[i].tolist()}
+        children = numpy.flatnonzero(skeleton.parents == i)
+        if len(children):
+            node["children"] = (children + first_bone_node).tolist()
+        writer.add("nodes", node)
+    scene_nodes.extend((numpy.flatnonzero(skeleton.parents == -1) + first_bone_node).tolist())
+
+    # Row-major inverse world matrices of row vector transforms are column-major for glTF column vectors
+    inverse_bind = numpy.linalg.inv(skeleton.world_matrices.astype(numpy.float64)).astype(numpy.float32)
+    mesh_node["skin"] = writer.add("skins", {
+        "joints": list(range(first_bone_node, first_bone_node + skeleton.num_bones)),
+        "inverseBindMatrices": writer.add_accessor(inverse_bind.reshape(skeleton.num_bones, 16)),
+    })
+    scene_nodes.append(writer.add("nodes", mesh_node))
+
+    # ================================== Animations ================================= #
+
+    sampler_interpolation = "LINEAR" if interp == noesis.NOEKF_INTERPOLATE_LINEAR else "STEP"
+    for track in tracks:
+        export_track(writer, track, first_bone_node, sampler_interpolation, ignore_scale)
+
+
+def export_track(writer, track, first_bone_node, sampler_interpolation="STEP", ignore_scale=0):
+    """
+    Adds an animation with a sampler per bone and attribute, holding only the frames with a stored key.
+    Key times of the same frames are shared between samplers.
+    :type writer: GlbWriter
+    :type track: PlmTrack
+    :type first_bone_node: int
+    :param first_bone_node: Node index of the first bone.
+    :type sampler_interpolation: str
+    :type ignore_scale: int
+    """
+    # Key rotations have their W component negated, which already makes them the transposed rotation
+    _, rotations, _ = decompose_matrices(compose_matrices(track.rotations, track.translations))
+    translations = track.translations
+    scales = None if ignore_scale else track.scales
+
+    channels = [("rotation", rotations, track.rotation_keys), ("translation", translations, track.translation_keys)]
+    if scales is not None:
+        channels.append(("scale", scales, track.scale_keys))
+
+    inputs = {}
+    samplers = []
+    animation_channels = []
+    for b in range(track.num_bones):
+        for path, values, keys in channels:
+            frames = numpy.flatnonzero(keys[:, b])
+            if len(frames) == 0:
+                continue
+            frames_key = frames.tobytes()
+            if frames_key not in inputs:
+                times = (frames / GLTF_FRAMES_PER_SECOND).astype(numpy.float32)
+                inputs[frames_key] = writer.add_accessor(times, bounds=True)
+            samplers.append({"input": inputs[frames_key], "interpolation": sampler_interpolation,
+                             "output": writer.add_accessor(numpy.ascontiguousarray(values[frames, b],
+                                                                                   dtype=numpy.float32))})
+            animation_channels.append({"sampler": len(samplers) - 1,
+                                       "target": {"node": first_bone_node + b, "path": path}})
+    if samplers:
+        writer.add("animations", {"name": track.name, "samplers": samplers, "channels": animation_channels})
+
+
+def decompose_matrices(matrices):
+    """
+    Splits row vector matrices, such as those of PlmSkeleton, into glTF translations, rotations and scales.
+    Requires the matrices to be a rotation and a scale along the axes of the bone, without shear.
+    :type matrices: numpy.ndarray
+    :param matrices: Array of shape (..., 4, 4), with the translation in the last row.
+    :rtype: tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]
+    :return: float32 translations of shape (..., 3), (x, y, z, w) quaternions of shape (..., 4) and scales of shape
+    (..., 3).
+    """
+    matrices = numpy.asarray(matrices, dtype=numpy.float64)
+    translations = matrices[..., 3, :3]
+    # Rows of a row vector matrix are the columns of the column vector matrix used by glTF
+    linear = numpy.swapaxes(matrices[..., :3, :3], -1, -2)
+    scales = numpy.linalg.norm(linear, axis=-2)
+    scales[numpy.linalg.det(linear) < 0, 0] *= -1
+    r = linear / numpy.where(scales == 0, 1, scales)[..., None, :]
+
+    trace = r[..., 0, 0] + r[..., 1, 1] + r[..., 2, 2]
+    candidates = numpy.stack((
+        numpy.stack((r[..., 2, 1] - r[..., 1, 2], r[..., 0, 2] - r[..., 2, 0], r[..., 1, 0] - r[..., 0, 1],
+                     1 + trace), axis=-1),
+        numpy.stack((1 + r[..., 0, 0] - r[..., 1, 1] - r[..., 2, 2], r[..., 0, 1] + r[..., 1, 0],
+                     r[..., 0, 2] + r[..., 2, 0], r[..., 2, 1] - r[..., 1, 2]), axis=-1),
+        numpy.stack((r[..., 0, 1] + r[..., 1, 0], 1 + r[..., 1, 1] - r[..., 0, 0] - r[..., 2, 2],
+                     r[..., 1, 2] + r[..., 2, 1], r[..., 0, 2] - r[..., 2, 0]), axis=-1),
+        numpy.stack((r[..., 0, 2] + r[..., 2, 0], r[..., 1, 2] + r[..., 2, 1],
+                     1 + r[..., 2, 2] - r[..., 0, 0] - r[..., 1, 1], r[..., 1, 0] - r[..., 0, 1]), axis=-1),
+    ), axis=-2)
+    # Each candidate is the quaternion scaled by one of its components, use the one with the largest scale
+    best = numpy.argmax(numpy.stack((trace, r[..., 0, 0], r[..., 1, 1], r[..., 2, 2]), axis=-1), axis=-1)
+    quaternions = numpy.take_along_axis(candidates, best[..., None, None], axis=-2)[..., 0, :]
+    quaternions /= numpy.linalg.norm(quaternions, axis=-1, keepdims=True)
+    return translations.astype(numpy.float32), quaternions.astype(numpy.float32), scales.astype(numpy.float32)
+
+
+def _add_texture(writer, data, name):
+    if not writer.document.get("samplers"):
+        writer.add("samplers", {})
+    return writer.add("textures", {"name": name, "sampler": 0, "source": writer.add_image(data, name)})
+
+
+def dat_to_glb(filepath, glb_filepath):
+    """
+    Exports a .dat file.
+    :type filepath: str
+    :type glb_filepath: str
+    """
+    # The writer keeps a copy of what is exported, so the map is closed before writing
+    with DatIndex.from_file(filepath) as index:
+        writer = export_dat(index)
+    writer.write(glb_filepath)
+
+
+def export_dat(index):
+    """
+    Exports the model of an indexed .dat file.
+    :type index: DatIndex
+    :rtype: GlbWriter
+    """
+    bs = MappedStream(index.data)
+    bs.seek(index.header.offset, NOESEEK_ABS)
+    header = DatHeader(bs, index.header.size)
+
+    pmm_chunk = index.slice(index.pmm)
+    if pmm_check_ciphered(bytes(pmm_chunk[:3])):
+        # The file is mapped read-only, decipher a copy of the chunk
+        pmm_chunk = bytearray(pmm_chunk)
+        decipher_into(pmm_chunk, 0, len(pmm_chunk))
+    pmm_data = load_pmm_data(MappedStream(pmm_chunk))
+
+    # Tracks are exported one at a time, so each is only decoded when exported
+    skeleton, tracks = load_plm_skeleton(MappedStream(index.slice(index.plm)), pmm_data.scale_divider,
+                                         not fmt_smon_plm.PLM_IGNORE_ANIMATIONS, lazy=True)
+
+    textures = []
+    for chunk, (diffuse, alpha, _) in zip(index.textures, read_texture_images(bs, index.textures)):
+        if diffuse is not None:
+            textures.append(GltfTexture(dat_texture_name(header, chunk), chunk.material_id, diffuse, alpha))
+
+    writer = GlbWriter()
+    export_model(writer, header.name, pmm_data, skeleton, tracks, textures)
+    return writer
+
+
+def pmod_to_glb(filepath, glb_filepath):
+    """
+    Exports a .pmod file, with the .pliv file and texture found like load_pmm_from_pmod.
+    :type filepath: str
+    :type glb_filepath: str
+    """
+    plm_filepath = filepath[:-5] + ".pliv"
+    tex_filepath = filepath[:-5] + ".png"
+    if not os.path.isfile(tex_filepath):
+        tex_filepath = pmod_guess_texture_file(tex_filepath)
+
+    # The writer keeps a copy of what is exported, so the maps are closed before writing
+    with contextlib.ExitStack() as stack:
+        pmm_bs = stack.enter_context(MappedStream.from_file(filepath))
+        plm_bs = stack.enter_context(MappedStream.from_file(plm_filepath)) if os.path.isfile(plm_filepath) else None
+        tex_bs = stack.enter_context(MappedStream.from_file(tex_filepath)) if os.path.isfile(tex_filepath) else None
+        writer = export_pmod(os.path.splitext(os.path.basename(filepath))[0], pmm_bs, plm_bs, tex_bs,
+                             os.path.splitext(os.path.basename(tex_filepath))[0])
+    writer.write(glb_filepath)
+
+
+def export_pmod(name, pmm_bs, plm_bs, tex_bs, tex_name):
+    """
+    Exports the model of a .pmod file.
+    :type name: str
+    :type pmm_bs: MappedStream
+    :type plm_bs: MappedStream | None
+    :param plm_bs: Stream of the .pliv file, if found.
+    :type tex_bs: MappedStream | None
+    :param tex_bs: Stream of the texture file, if found.
+    :type tex_name: str
+    :rtype: GlbWriter
+    """
+    pmm_chunk = pmm_bs.view
+    if pmm_check_ciphered(bytes(pmm_chunk[:3])):
+        pmm_chunk = bytearray(pmm_chunk)
+        decipher_into(pmm_chunk, 0, len(pmm_chunk))
+    pmm_data = load_pmm_data(MappedStream(pmm_chunk))
+
+    skeleton, tracks = None, []
+    if plm_bs is not None and plm_check_type(peek_bytes(plm_bs, 8)):
+        skeleton, tracks = load_plm_skeleton(plm_bs, pmm_data.scale_divider, not fmt_smon_plm.PLM_IGNORE_ANIMATIONS,
+                                             lazy=True)
+
+    textures = []
+    if tex_bs is not None:
+        if tex_bs.getSize() >= 5 and is_joker_chunk(tex_bs):
+            diffuse, alpha = read_joker_images(tex_bs)
+        else:
+            diffuse, alpha = tex_bs.view, None
+        if diffuse is not None:
+            textures.append(GltfTexture(tex_name, None, diffuse, alpha))
+
+    writer = GlbWriter()
+    export_model(writer, name, pmm_data, skeleton, tracks, textures)
+    return writer
+
+
+# Extension: exporter
+EXPORTERS = {
+    ".dat": dat_to_glb,
+    ".pmod": pmod_to_glb,
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Exports Summoners War .dat and .pmod models to .glb files.")
+    parser.add_argument("filepath", help=".dat or .pmod file to export.")
+    parser.add_argument("-o", "--output", help="Output .glb file. Default: the input file with a .glb extension.")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Show the output printed by the plugins.")
+    args = parser.parse_args(argv)
+
+    if numpy is None:
+        print("numpy is required to export glTF files", file=sys.stderr)
+        return 1
+    extension = os.path.splitext(args.filepath)[1].lower()
+    if extension not in EXPORTERS:
+        print("Unsupported file: {0}".format(args.filepath), file=sys.stderr)
+        return 1
+
+    output = args.output or os.path.splitext(args.filepath)[0] + ".glb"
+    with contextlib.redirect_stdout(sys.stdout if args.verbose else io.StringIO()):
+        EXPORTERS[extension](args.filepath, output)
+    print(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
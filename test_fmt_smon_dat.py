@@ -0,0 +1,185 @@
+"""
+Checks DatIndex against reading the chunks with a NoeBitStream, and DatBundle against loading each .dat file on its own.
+The DAT files are generated by smon_bench.build_dat.
+
+Usage: python -m unittest test_fmt_smon_dat
+"""
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+from unittest import mock
+
+import headless
+
+# Outside of Noesis, the plugins run on the stand-in Noesis API.
+headless.install()
+
+import fmt_smon_dat
+from inc_noesis import NoeBitStream, NOESEEK_REL
+from smon_bench import build_dat, build_dat_header, build_joker, build_plm, build_pmm
+
+MESH_ATTRIBUTES = ("positions", "normals", "uvs", "indices", "boneIndices")
+
+
+def counted(func):
+    # Unlike a mock, keeps no references to the arguments, which would keep the files mapped
+    def wrapper(*args, **kwargs):
+        wrapper.calls += 1
+        return func(*args, **kwargs)
+
+    wrapper.calls = 0
+    return wrapper
+
+
+def bitstream_chunks(data):
+    """
+    Walks the chunks like dat_load_model did before DatIndex, returning (kind, offset, size, material_id) tuples.
+    """
+    bs = NoeBitStream(data)
+    chunks = []
+    for kind in (fmt_smon_dat.DAT_CHUNK_HEADER, fmt_smon_dat.DAT_CHUNK_PMM, fmt_smon_dat.DAT_CHUNK_PLM):
+        size = bs.readUInt()
+        chunks.append((kind, bs.tell(), size, None))
+        bs.seek(size, NOESEEK_REL)
+    while not bs.checkEOF():
+        material_id = bs.readInt()
+        if material_id > 255:
+            chunk_size = material_id
+            material_id = None
+        else:
+            chunk_size = bs.readInt()
+        if chunk_size != 0:
+            chunks.append((fmt_smon_dat.DAT_CHUNK_TEXTURE, bs.tell(), chunk_size, material_id))
+        bs.seek(chunk_size, NOESEEK_REL)
+    return chunks
+
+
+def index_chunks(index):
+    return [(chunk.kind, chunk.offset, chunk.size, chunk.material_id)
+            for chunk in [index.header, index.pmm, index.plm] + index.textures]
+
+
+def chunk(blob):
+    return struct.pack("<I", len(blob)) + blob
+
+
+class DatIndexTest(unittest.TestCase):
+
+    def test_index_matches_bitstream(self):
+        # Elements 1 to 3, an empty chunk, and a single image without a material ID
+        single = build_joker(16)
+        self.assertGreater(len(single), 255)
+        fixtures = {
+            "elements": build_dat(),
+            "empty texture": build_dat() + struct.pack("<i", 4) + chunk(b""),
+            "single image": (chunk(build_dat_header("special_mdl")) + chunk(build_pmm(10, 15)) +
+                             chunk(build_plm(4, (5,))) + chunk(single)),
+        }
+        for name, data in fixtures.items():
+            index = fmt_smon_dat.DatIndex(data)
+            self.assertEqual(index_chunks(index), bitstream_chunks(data), name)
+            for dat_chunk in index.chunks:
+                self.assertEqual(bytes(index.slice(dat_chunk)),
+                                 data[dat_chunk.offset:dat_chunk.offset + dat_chunk.size], name)
+        self.assertEqual(index.textures[0].material_id, None)
+
+    def test_truncated_chunks_raise(self):
+        data = build_dat()
+        index = fmt_smon_dat.DatIndex(data)
+        truncations = {
+            "header size": 2,
+            "pmm size": index.pmm.offset - 2,
+            "pmm data": index.pmm.offset + 10,
+            "plm data": index.plm.offset + index.plm.size - 1,
+            "texture data": index.textures[-1].offset + 1,
+        }
+        for name, size in truncations.items():
+            with self.assertRaises(Exception, msg=name):
+                fmt_smon_dat.DatIndex(data[:size])
+
+    def test_oversized_chunks_raise(self):
+        data = bytearray(build_dat())
+        index = fmt_smon_dat.DatIndex(bytes(data))
+        for chunk_size in (len(data), 0x7FFFFFFF, -1):
+            for dat_chunk in (index.pmm, index.textures[0]):
+                oversized = bytearray(data)
+                struct.pack_into("<i", oversized, dat_chunk.offset - 4, chunk_size)
+                with self.assertRaises(Exception, msg="{0} {1}".format(dat_chunk.kind, chunk_size)):
+                    fmt_smon_dat.DatIndex(bytes(oversized))
+
+
+class DatBundleTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="smon_dat_test_")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def write(self, filename, data):
+        path = os.path.join(self.directory, filename)
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    def write_variants(self):
+        # Elemental variants of a monster: same mesh and skeleton, different textures
+        pmm = build_pmm(200, 300)
+        plm = build_plm(8, (10, 20))
+        return [self.write("monster_{0}.dat".format(element),
+                           build_dat("monster", pmm, plm, {element: build_joker(16, seed=element)}))
+                for element in (1, 2)]
+
+    def assertModelsEqual(self, expected, actual):
+        self.assertEqual(len(expected.meshes), len(actual.meshes))
+        for expected_mesh, actual_mesh in zip(expected.meshes, actual.meshes):
+            for attribute in MESH_ATTRIBUTES:
+                self.assertEqual(list(getattr(expected_mesh, attribute)), list(getattr(actual_mesh, attribute)),
+                                 attribute)
+        self.assertEqual([bone.getMatrix().toBytes() for bone in expected.bones],
+                         [bone.getMatrix().toBytes() for bone in actual.bones])
+        self.assertEqual([anim.name for anim in expected.anims], [anim.name for anim in actual.anims])
+
+    def test_identical_chunks_are_decoded_once(self):
+        filepaths = self.write_variants()
+        separate = []
+        for filepath in filepaths:
+            fmt_smon_dat.dat_load_file(filepath, separate)
+
+        models = []
+        read_pmm = counted(fmt_smon_dat.dat_read_pmm)
+        load_plm_animation = counted(fmt_smon_dat.load_plm_animation)
+        with mock.patch.object(fmt_smon_dat, "dat_read_pmm", read_pmm), \
+                mock.patch.object(fmt_smon_dat, "load_plm_animation", load_plm_animation):
+            stats = fmt_smon_dat.dat_load_bundle(filepaths, models)
+        self.assertEqual(read_pmm.calls, 1)
+        self.assertEqual(load_plm_animation.calls, 1)
+        self.assertEqual((stats.files, stats.pmm_decoded, stats.pmm_shared, stats.plm_decoded, stats.plm_shared),
+                         (2, 1, 1, 1, 1))
+
+        self.assertEqual(len(separate), len(models))
+        for expected, actual in zip(separate, models):
+            self.assertModelsEqual(expected, actual)
+        self.assertIs(models[0].anims, models[1].anims)
+
+    def test_files_are_closed_when_a_file_fails(self):
+        filepaths = self.write_variants()
+        filepaths.insert(1, self.write("truncated.dat", build_dat()[:100]))
+        indexes = []
+
+        def from_file(filepath, writable=False):
+            indexes.append(from_file.original(filepath, writable))
+            return indexes[-1]
+
+        from_file.original = fmt_smon_dat.DatIndex.from_file
+        with mock.patch.object(fmt_smon_dat.DatIndex, "from_file", side_effect=from_file):
+            with self.assertRaises(Exception):
+                fmt_smon_dat.dat_load_bundle(filepaths, [])
+        self.assertEqual(len(indexes), 1)
+        self.assertTrue(indexes[0].data.closed)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,104 @@
+"""
+Checks the textures and buffers of the models of fmt_smon_fid.fid_load_model.
+The FID files are generated by smon_bench.build_fid.
+
+Usage: python -m unittest test_fmt_smon_fid
+"""
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+from unittest import mock
+
+import headless
+
+# Outside of Noesis, the plugins run on the stand-in Noesis API.
+headless.install()
+
+import fmt_smon_fid
+import rapi
+from inc_smon import TextureCache, numpy
+from smon_bench import build_fid, build_png
+
+# Names in FID files may include a directory, unlike the names given by rapi.loadExternalTex
+TEXTURE_NAMES = ("textures/tex_a.png", "textures/tex_b.png")
+
+
+class FidTextureTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="smon_fid_test_")
+        os.mkdir(os.path.join(self.directory, "textures"))
+        for name in TEXTURE_NAMES:
+            with open(os.path.join(self.directory, name), "wb") as f:
+                f.write(build_png())
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def load(self, data, texture_cache=None):
+        models = []
+        fmt_smon_fid.fid_load_model(data, models, self.directory, texture_cache)
+        return models
+
+    def test_each_texture_is_loaded_once_per_load(self):
+        data = build_fid(6, 10, False, TEXTURE_NAMES)
+        with mock.patch.object(rapi, "loadExternalTex", wraps=rapi.loadExternalTex) as load_texture, \
+                mock.patch("os.stat", wraps=os.stat) as stat:
+            models = self.load(data)
+        self.assertEqual(load_texture.call_count, len(TEXTURE_NAMES))
+        self.assertEqual(stat.call_count, len(TEXTURE_NAMES))
+        names = [model.modelMats.texList[0].name for model in models]
+        self.assertEqual(names, [TEXTURE_NAMES[m % len(TEXTURE_NAMES)] for m in range(6)])
+
+        # Without a cache passed in, nothing is kept for the next load
+        with mock.patch.object(rapi, "loadExternalTex", wraps=rapi.loadExternalTex) as load_texture:
+            self.load(data)
+        self.assertEqual(load_texture.call_count, len(TEXTURE_NAMES))
+
+    def test_shared_cache_textures_are_not_renamed(self):
+        texture_cache = TextureCache()
+        first = self.load(build_fid(2, 10, False, TEXTURE_NAMES), texture_cache)
+        with mock.patch.object(rapi, "loadExternalTex", wraps=rapi.loadExternalTex) as load_texture:
+            second = self.load(build_fid(2, 10, False, TEXTURE_NAMES), texture_cache)
+        load_texture.assert_not_called()
+        self.assertEqual(texture_cache.hits, len(TEXTURE_NAMES))
+
+        cached = texture_cache.load(os.path.join(self.directory, TEXTURE_NAMES[0]))
+        texture = second[0].modelMats.texList[0]
+        self.assertIsNot(texture, cached)
+        self.assertIsNot(texture, first[0].modelMats.texList[0])
+        self.assertIs(texture.pixelData, cached.pixelData)
+        self.assertEqual(texture.name, TEXTURE_NAMES[0])
+        self.assertEqual(cached.name, "tex_a.png")
+
+
+class FidBufferTest(unittest.TestCase):
+
+    def test_index_buffer_is_little_endian_uint32(self):
+        for vertex_count in (0, 1, 3, 1000):
+            buffer = fmt_smon_fid.fid_index_buffer(vertex_count)
+            self.assertGreaterEqual(len(buffer), vertex_count * 4)
+            self.assertEqual(buffer[:vertex_count * 4], struct.pack("<{0}I".format(vertex_count), *range(vertex_count)))
+
+    def test_index_buffer_without_numpy(self):
+        with mock.patch.object(fmt_smon_fid, "numpy", None), mock.patch.object(fmt_smon_fid, "_fid_index_buffer", b""):
+            self.assertEqual(fmt_smon_fid.fid_index_buffer(5), struct.pack("<5I", 0, 1, 2, 3, 4))
+
+    @unittest.skipIf(numpy is None, "numpy is required to decode buffers into arrays")
+    def test_uv1_array_negates_v(self):
+        uvs = [(0.25, 0.5), (1.0, 0.0), (0.0, 0.75)]
+        fid_data = fmt_smon_fid.FidData("mesh")
+        fid_data.vertex_count = len(uvs)
+        fid_data.uv1_bytes = b"".join(struct.pack("<2f", *uv) for uv in uvs)
+        self.assertEqual(fid_data.uv1_array().tolist(), [[u, -v] for u, v in uvs])
+
+        # Same UVs as the model, where V is negated by the UV scale
+        fid_data.vertex_bytes = b"\x00" * 12 * len(uvs)
+        mesh = fid_data.construct_model().meshes[0]
+        self.assertEqual([list(uv[:2]) for uv in mesh.uvs], fid_data.uv1_array().tolist())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+"""
+Checks that combining a Joker diffuse and alpha image gives the Rec.601 luma of the alpha image as the alpha channel.
+
+Usage: python -m unittest test_fmt_smon_joker
+"""
+import unittest
+
+import headless
+
+# Outside of Noesis, the plugins run on the stand-in Noesis API.
+headless.install()
+
+import fmt_smon_joker
+import noesis
+import rapi
+from inc_noesis import NoeTexture
+from smon_bench import build_joker
+
+# Diffuse pixels, and alpha pixels with their Rec.601 luma
+DIFFUSE = ((10, 20, 30, 255), (40, 50, 60, 255), (70, 80, 90, 255), (100, 110, 120, 255))
+ALPHA = (
+    ((255, 0, 0, 255), 76),
+    ((0, 255, 0, 255), 149),
+    ((0, 0, 255, 255), 29),
+    ((200, 100, 50, 255), 124),
+)
+
+
+def rgba_texture(name, width, height, pixels):
+    return NoeTexture(name, width, height, bytes(c for pixel in pixels for c in pixel), noesis.NOESISTEX_RGBA32)
+
+
+def rec601_luma(rgba):
+    return bytes((299 * rgba[i] + 587 * rgba[i + 1] + 114 * rgba[i + 2]) // 1000 for i in range(0, len(rgba), 4))
+
+
+class JokerAlphaTest(unittest.TestCase):
+
+    def assertCombined(self, combined, diffuse_pixels, expected_alpha):
+        self.assertEqual(combined.pixelType, noesis.NOESISTEX_RGBA32)
+        rgba = combined.pixelData
+        self.assertEqual(len(rgba), len(diffuse_pixels) * 4)
+        self.assertEqual(bytes(rgba[3::4]), bytes(expected_alpha))
+        for i, pixel in enumerate(diffuse_pixels):
+            self.assertEqual(tuple(rgba[i * 4:i * 4 + 3]), pixel[:3])
+
+    def test_alpha_is_rec601_luma(self):
+        diffuse = rgba_texture("diffuse", 2, 2, DIFFUSE)
+        alpha = rgba_texture("alpha", 2, 2, [pixel for pixel, _ in ALPHA])
+        combined = fmt_smon_joker.combine_joker_alpha(diffuse, alpha)
+        self.assertEqual((combined.name, combined.width, combined.height), ("diffuse", 2, 2))
+        self.assertCombined(combined, DIFFUSE, [luma for _, luma in ALPHA])
+        self.assertIsNone(diffuse.pixelData)
+        self.assertIsNone(alpha.pixelData)
+
+    def test_greyscale_alpha(self):
+        grey = [(v, v, v, 255) for v in (0, 1, 128, 255)]
+        combined = fmt_smon_joker.combine_joker_alpha(rgba_texture("diffuse", 2, 2, DIFFUSE),
+                                                      rgba_texture("alpha", 2, 2, grey))
+        self.assertCombined(combined, DIFFUSE, [0, 1, 128, 255])
+
+    def test_alpha_is_resampled_to_the_diffuse_size(self):
+        combined = fmt_smon_joker.combine_joker_alpha(rgba_texture("diffuse", 2, 2, DIFFUSE),
+                                                      rgba_texture("alpha", 1, 1, [ALPHA[3][0]]))
+        self.assertCombined(combined, DIFFUSE, [ALPHA[3][1]] * 4)
+
+    def test_load_joker_file_combines_alpha(self):
+        data = build_joker(16)
+        separate = []
+        fmt_smon_joker.load_joker_file(data, separate, combine_alpha=0)
+        if separate[0].pixelType != noesis.NOESISTEX_RGBA32:
+            self.skipTest("Pillow is required to decode the images")
+        diffuse_rgba = bytes(rapi.imageGetTexRGBA(separate[0]))
+        alpha_rgba = bytes(rapi.imageGetTexRGBA(separate[1]))
+
+        combined = []
+        fmt_smon_joker.load_joker_file(data, combined, combine_alpha=1)
+        self.assertEqual(len(combined), 1)
+        rgba = combined[0].pixelData
+        self.assertEqual(bytes(rgba[3::4]), rec601_luma(alpha_rgba))
+        for channel in range(3):
+            self.assertEqual(bytes(rgba[channel::4]), diffuse_rgba[channel::4])
+
+
+if __name__ == "__main__":
+    unittest.main()
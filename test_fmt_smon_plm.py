@@ -0,0 +1,134 @@
+"""
+Checks that the array, lazy and key reduction decoders of fmt_smon_plm agree with plm_read_keyframed_bone_animation.
+The PLM chunks are generated by smon_bench.build_plm.
+
+Usage: python -m unittest test_fmt_smon_plm
+"""
+import unittest
+from unittest import mock
+
+import headless
+
+# Outside of Noesis, the plugins run on the stand-in Noesis API.
+headless.install()
+
+import noesis
+import fmt_smon_plm
+from inc_noesis import NoeBitStream
+from inc_smon import numpy
+from smon_bench import build_plm
+
+INTERPOLATIONS = (noesis.NOEKF_INTERPOLATE_NEAREST, noesis.NOEKF_INTERPOLATE_LINEAR)
+SCALE_DIVIDER = 64
+
+# Int and float values, with and without scale
+VERSIONS = (fmt_smon_plm.PLM_V2, fmt_smon_plm.PLM_V6, fmt_smon_plm.PLM_V9)
+
+# Sparse keys give attributes with a single key, without other keys every attribute has one
+KEY_DENSITIES = (0.5, 0.01, 0.0)
+
+# A single key is stored either with the single key layout or as a bitarray
+SINGLE_KEY_LAYOUTS = (True, False)
+
+ATTRIBUTES = ("rotationKeys", "translationKeys", "scaleKeys")
+
+
+def load_animations(data, interpolation):
+    with mock.patch.object(fmt_smon_plm, "PLM_INTERPOLATE_TYPE", interpolation):
+        return fmt_smon_plm.load_plm_animation(NoeBitStream(data), SCALE_DIVIDER)
+
+
+def fixtures():
+    for version in VERSIONS:
+        for key_density in KEY_DENSITIES:
+            for single_key_layout in SINGLE_KEY_LAYOUTS:
+                yield ((version, key_density, single_key_layout),
+                       build_plm(8, (1, 9, 40), version, key_density, single_key_layout=single_key_layout))
+
+
+class PlmDecoderTest(unittest.TestCase):
+
+    def assertValueEqual(self, expected, actual, msg=None):
+        self.assertEqual(len(expected), len(actual), msg)
+        for c in range(len(expected)):
+            self.assertAlmostEqual(expected[c], actual[c], 5, msg)
+
+    def assertKeysEqual(self, expected, actual, msg=None):
+        self.assertEqual([key.time for key in expected], [key.time for key in actual], msg)
+        for expected_key, actual_key in zip(expected, actual):
+            self.assertValueEqual(expected_key.value, actual_key.value, msg)
+
+    def assertBonesEqual(self, expected, actual, msg=None):
+        self.assertEqual(len(expected), len(actual), msg)
+        for expected_bone, actual_bone in zip(expected, actual):
+            self.assertEqual(expected_bone.boneIndex, actual_bone.boneIndex, msg)
+            for attribute in ATTRIBUTES:
+                self.assertKeysEqual(getattr(expected_bone, attribute), getattr(actual_bone, attribute),
+                                     "{0} {1} of bone {2}".format(msg, attribute, expected_bone.boneIndex))
+
+    @unittest.skipIf(numpy is None, "numpy is required to decode animations into arrays")
+    def test_arrays_match_keyframed_bones(self):
+        for interpolation in INTERPOLATIONS:
+            for fixture, data in fixtures():
+                _, animations = load_animations(data, interpolation)
+                _, tracks = fmt_smon_plm.load_plm_animation_arrays(NoeBitStream(data), SCALE_DIVIDER)
+                self.assertEqual(len(animations), len(tracks))
+                for animation, track in zip(animations, tracks):
+                    self.assertBonesEqual(animation.kfBones, track.to_keyframed_bones(interpolation),
+                                          "{0} {1} {2}".format(fixture, interpolation, track.name))
+
+    def test_lazy_matches_eager(self):
+        for interpolation in INTERPOLATIONS:
+            for fixture, data in fixtures():
+                _, animations = load_animations(data, interpolation)
+                with mock.patch.object(fmt_smon_plm, "PLM_INTERPOLATE_TYPE", interpolation):
+                    _, lazy = fmt_smon_plm.load_plm_animation_lazy(NoeBitStream(data), SCALE_DIVIDER, cache_size=1)
+                    lazy_animations = [lazy[x] for x in range(len(lazy))]
+                    # Dropped from the cache by the later animations, so decoded again
+                    lazy_animations[0] = lazy[0]
+                self.assertEqual(len(animations), len(lazy_animations))
+                for animation, lazy_animation in zip(animations, lazy_animations):
+                    self.assertEqual(animation.name, lazy_animation.name)
+                    self.assertBonesEqual(animation.kfBones, lazy_animation.kfBones,
+                                          "{0} {1} {2}".format(fixture, interpolation, animation.name))
+
+    @unittest.skipIf(numpy is None, "numpy is required to decode animations into arrays")
+    def test_lazy_tracks_match_eager(self):
+        for fixture, data in fixtures():
+            _, tracks = fmt_smon_plm.load_plm_skeleton(NoeBitStream(data), SCALE_DIVIDER)
+            _, lazy = fmt_smon_plm.load_plm_skeleton(NoeBitStream(data), SCALE_DIVIDER, lazy=True)
+            # Only the encoded tracks are kept
+            self.assertIsInstance(lazy.data, bytes)
+            self.assertLess(len(lazy.data), len(data))
+            self.assertEqual(len(tracks), len(lazy))
+            for track, lazy_track in zip(tracks, lazy):
+                for attribute in ("rotations", "translations", "scales", "rotation_keys", "translation_keys"):
+                    expected, actual = getattr(track, attribute), getattr(lazy_track, attribute)
+                    if expected is None:
+                        self.assertIsNone(actual)
+                    else:
+                        self.assertTrue(numpy.array_equal(expected, actual), "{0} {1}".format(fixture, attribute))
+
+    def test_nearest_reduction_holds_every_frame(self):
+        interpolation = noesis.NOEKF_INTERPOLATE_NEAREST
+        for fixture, data in fixtures():
+            _, animations = load_animations(data, interpolation)
+            _, reduced = load_animations(data, interpolation)
+            stats = fmt_smon_plm.plm_reduce_animations(reduced, 0.0, interpolation)
+            self.assertLessEqual(stats.keys_after, stats.keys_before)
+            for animation, reduced_animation in zip(animations, reduced):
+                for kf_bone, reduced_bone in zip(animation.kfBones, reduced_animation.kfBones):
+                    for attribute in ATTRIBUTES:
+                        keys = getattr(kf_bone, attribute)
+                        reduced_keys = getattr(reduced_bone, attribute)
+                        if keys:
+                            self.assertEqual(keys[-1].time, reduced_keys[-1].time)
+                        # Every original key is reproduced by the last reduced key at or before it
+                        for key in keys:
+                            held = [k for k in reduced_keys if k.time <= key.time][-1]
+                            self.assertValueEqual(key.value, held.value,
+                                                  "{0} {1} {2}".format(fixture, animation.name, attribute))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+"""
+Checks the PMM cipher helpers of fmt_smon_pmm against the byte by byte loop they replaced.
+
+Usage: python -m unittest test_fmt_smon_pmm
+"""
+import random
+import unittest
+
+import headless
+
+# Outside of Noesis, the plugins run on the stand-in Noesis API.
+headless.install()
+
+import fmt_smon_pmm
+from inc_noesis import NoeBitStream
+from smon_bench import build_pmm
+
+# Block sizes that do not divide the chunk sizes, so the last block is partial
+BLOCK_SIZES = (1, 7, 0x1000, fmt_smon_pmm.PMM_CIPHER_BLOCK_SIZE)
+
+
+def baseline_deciphered(ciphered_bytes):
+    # as_deciphered before it used bytes.translate
+    deciphered = bytearray(len(ciphered_bytes))
+    for i in range(len(ciphered_bytes)):
+        deciphered[i] = fmt_smon_pmm.pmm_decipher[ciphered_bytes[i]]
+    return deciphered
+
+
+def fixtures():
+    r = random.Random(0)
+    yield "every byte", bytes(range(256))
+    yield "random", bytes(r.getrandbits(8) for _ in range(10007))
+    yield "pmm", fmt_smon_pmm.as_enciphered(build_pmm(100, 150))
+
+
+class PmmCipherTest(unittest.TestCase):
+
+    def test_encipher_table_is_the_inverse(self):
+        self.assertEqual(sorted(fmt_smon_pmm.pmm_encipher), list(range(256)))
+        for i in range(256):
+            self.assertEqual(fmt_smon_pmm.pmm_encipher[fmt_smon_pmm.pmm_decipher[i]], i)
+        self.assertEqual(fmt_smon_pmm._invert_table(fmt_smon_pmm.pmm_encipher), fmt_smon_pmm.pmm_decipher)
+
+    def test_round_trip(self):
+        for name, data in fixtures():
+            self.assertEqual(fmt_smon_pmm.as_enciphered(fmt_smon_pmm.as_deciphered(data)), data, name)
+            self.assertEqual(fmt_smon_pmm.as_deciphered(fmt_smon_pmm.as_enciphered(data)), data, name)
+
+    def test_as_deciphered_matches_baseline(self):
+        for name, data in fixtures():
+            expected = baseline_deciphered(data)
+            self.assertEqual(fmt_smon_pmm.as_deciphered(data), expected, name)
+            self.assertEqual(fmt_smon_pmm.as_deciphered(bytearray(data)), expected, name)
+            self.assertIsInstance(fmt_smon_pmm.as_deciphered(bytearray(data)), bytearray)
+
+    def test_blocks_match_baseline(self):
+        for name, data in fixtures():
+            expected = baseline_deciphered(data)
+            for block_size in BLOCK_SIZES:
+                msg = "{0} block size {1}".format(name, block_size)
+                self.assertEqual(b"".join(fmt_smon_pmm.iter_deciphered(data, block_size)), expected, msg)
+
+                # Only the chunk between the surrounding bytes is deciphered
+                buffer = bytearray(b"head" + data + b"tail")
+                fmt_smon_pmm.decipher_into(buffer, 4, len(data), block_size)
+                self.assertEqual(buffer, b"head" + expected + b"tail", msg)
+
+                view = memoryview(bytearray(data))
+                fmt_smon_pmm.decipher_into(view, 0, len(data), block_size)
+                self.assertEqual(view.tobytes(), expected, msg)
+                fmt_smon_pmm.decipher_into(view, 0, len(data), block_size, fmt_smon_pmm.pmm_encipher)
+                self.assertEqual(view.tobytes(), data, msg)
+
+                bs = NoeBitStream(b"head" + data + b"tail")
+                bs.seek(4)
+                fmt_smon_pmm.decipher_stream(bs, len(data), block_size)
+                self.assertEqual(bs.tell(), 4, msg)
+                self.assertEqual(bs.getBuffer(), b"head" + expected + b"tail", msg)
+
+
+if __name__ == "__main__":
+    unittest.main()
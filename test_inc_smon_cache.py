@@ -0,0 +1,78 @@
+"""
+Checks that ModelCache returns the same results from the cache files as from decoding the chunks.
+The chunks are generated by smon_bench.
+
+Usage: python -m unittest test_inc_smon_cache
+"""
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import headless
+
+# Outside of Noesis, the plugins run on the stand-in Noesis API.
+headless.install()
+
+import fmt_smon_plm
+import inc_smon_cache
+from inc_smon import numpy
+from smon_bench import build_plm, build_pmm
+
+SCALE_DIVIDER = 64
+
+
+@unittest.skipIf(numpy is None, "numpy is required to cache animations")
+class ModelCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="smon_cache_test_")
+        self.cache = inc_smon_cache.ModelCache(self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def assertArraysEqual(self, expected, actual, msg=None):
+        self.assertIsNotNone(actual, msg)
+        self.assertEqual(expected.shape, actual.shape, msg)
+        self.assertTrue(numpy.array_equal(expected, actual), msg)
+
+    def test_warm_skeleton_matches_cold(self):
+        for version in (fmt_smon_plm.PLM_V2, fmt_smon_plm.PLM_V9):
+            chunk = build_plm(8, (1, 9, 40), version)
+            skeleton, tracks = self.cache.load_plm_skeleton(chunk, SCALE_DIVIDER)
+            with mock.patch.object(fmt_smon_plm, "load_plm_skeleton") as load_plm_skeleton:
+                warm_skeleton, warm_tracks = self.cache.load_plm_skeleton(chunk, SCALE_DIVIDER)
+            load_plm_skeleton.assert_not_called()
+
+            for name, _ in inc_smon_cache._SKELETON_ARRAYS:
+                self.assertArraysEqual(getattr(skeleton, name), getattr(warm_skeleton, name), name)
+            self.assertEqual(len(tracks), len(warm_tracks))
+            for track, warm_track in zip(tracks, warm_tracks):
+                self.assertEqual((track.name, track.num_frames), (warm_track.name, warm_track.num_frames))
+                for name, _ in inc_smon_cache._TRACK_ARRAYS + inc_smon_cache._TRACK_SCALE_ARRAYS:
+                    if getattr(track, name) is None:
+                        self.assertIsNone(getattr(warm_track, name), name)
+                    else:
+                        self.assertArraysEqual(getattr(track, name), getattr(warm_track, name), name)
+        self.assertEqual((self.cache.hits, self.cache.misses), (2, 2))
+
+    def test_warm_pmm_matches_cold(self):
+        chunk = build_pmm(100, 150)
+        pmm_data = self.cache.load_pmm_data(chunk)
+        warm_pmm_data = self.cache.load_pmm_data(chunk)
+        self.assertEqual(self.cache.hits, 1)
+        for name in ("position_bytes", "normal_bytes", "uv_bytes", "tri_indices", "bone_indices"):
+            self.assertEqual(bytes(getattr(pmm_data, name)), bytes(getattr(warm_pmm_data, name)), name)
+
+    def test_entries_can_be_evicted_while_results_are_used(self):
+        chunk = build_plm(4, (9,))
+        self.cache.load_plm_skeleton(chunk, SCALE_DIVIDER)
+        skeleton, tracks = self.cache.load_plm_skeleton(chunk, SCALE_DIVIDER)
+        self.cache.clear()
+        self.assertEqual(self.cache.size(), 0)
+        self.assertEqual(len(tracks[0].to_keyframed_bones()), skeleton.num_bones)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,138 @@
+"""
+Checks that probe_file reads the same metadata as fully parsing each format.
+The files are generated by smon_bench.
+
+Usage: python -m unittest test_inc_smon_probe
+"""
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import headless
+
+# Outside of Noesis, the plugins run on the stand-in Noesis API.
+headless.install()
+
+import fmt_smon_dat
+import fmt_smon_fid
+import fmt_smon_joker
+import fmt_smon_plm
+import fmt_smon_pmm
+import inc_smon_probe
+from inc_noesis import NoeBitStream, NOESEEK_ABS
+from smon_bench import build_dat, build_fid, build_joker, build_plm, build_png, build_pmm
+
+
+class ProbeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="smon_probe_test_")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def probe(self, filename, data):
+        path = os.path.join(self.directory, filename)
+        with open(path, "wb") as f:
+            f.write(data)
+        result = inc_smon_probe.probe_file(path)
+        self.assertEqual(result.size, len(data))
+        return result
+
+    def assertPmmEqual(self, result, pmm_chunk):
+        ciphered = fmt_smon_pmm.pmm_check_ciphered(pmm_chunk[:3])
+        deciphered = fmt_smon_pmm.as_deciphered(pmm_chunk) if ciphered else pmm_chunk
+        with contextlib.redirect_stdout(io.StringIO()):
+            pmm_data = fmt_smon_pmm.load_pmm_data(NoeBitStream(deciphered))
+        self.assertEqual(result.ciphered, bool(ciphered))
+        self.assertEqual(result.version, chr(deciphered[3]))
+        self.assertEqual(result.num_vertices, pmm_data.num_vertices)
+        self.assertEqual(result.num_tris, pmm_data.num_tris // 3)
+
+    def assertPlmEqual(self, result, plm_chunk):
+        with contextlib.redirect_stdout(io.StringIO()):
+            header = fmt_smon_plm.plm_read_header(NoeBitStream(plm_chunk), 64)
+        self.assertEqual(result.plm_version, header.version)
+        self.assertEqual(result.num_animations, header.num_animations)
+        self.assertEqual(result.anim_num_frames, list(header.anim_num_frames))
+        self.assertEqual(result.num_bones, header.num_bones)
+
+    def test_dat(self):
+        for ciphered in (True, False):
+            data = build_dat("monster", build_pmm(100, 150), build_plm(8, (10, 20, 30)), ciphered=ciphered)
+            result = self.probe("monster.dat", data)
+            self.assertEqual(result.format, inc_smon_probe.PROBE_FORMAT_DAT)
+
+            index = fmt_smon_dat.DatIndex(data)
+            bs = NoeBitStream(data)
+            bs.seek(index.header.offset, NOESEEK_ABS)
+            self.assertEqual(result.name, fmt_smon_dat.DatHeader(bs, index.header.size).name)
+            self.assertPmmEqual(result, bytes(index.slice(index.pmm)))
+            self.assertPlmEqual(result, bytes(index.slice(index.plm)))
+            self.assertEqual(result.material_ids, [chunk.material_id for chunk in index.textures])
+            self.assertEqual(result.num_textures, len(index.textures))
+
+    def test_pmm_and_plm(self):
+        pmm = build_pmm(100, 150, fmt_smon_pmm.PMM_V9)
+        for chunk in (pmm, fmt_smon_pmm.as_enciphered(pmm)):
+            result = self.probe("monster.pmod", chunk)
+            self.assertEqual(result.format, inc_smon_probe.PROBE_FORMAT_PMM)
+            self.assertPmmEqual(result, chunk)
+
+        for version in (fmt_smon_plm.PLM_V2, fmt_smon_plm.PLM_V6, fmt_smon_plm.PLM_V9):
+            chunk = build_plm(8, (10, 20), version)
+            result = self.probe("monster.pliv", chunk)
+            self.assertEqual((result.format, result.version), (inc_smon_probe.PROBE_FORMAT_PLM, version))
+            self.assertPlmEqual(result, chunk)
+
+    def test_fid(self):
+        texture_names = ("tex_a.png", "tex_b.png")
+        data = build_fid(3, 30, True, texture_names)
+        result = self.probe("terrain.fid", data)
+        self.assertEqual(result.format, inc_smon_probe.PROBE_FORMAT_FID)
+
+        models = []
+        with contextlib.redirect_stdout(io.StringIO()):
+            fmt_smon_fid.fid_load_model(data, models, self.directory)
+        self.assertEqual(result.num_meshes, len(models))
+        self.assertEqual(result.num_vertices, sum(len(model.meshes[0].positions) for model in models))
+        self.assertEqual(result.num_tris, result.num_vertices // 3)
+        self.assertEqual(result.texture_names, list(texture_names))
+
+    def test_joker_and_png(self):
+        for with_alpha in (True, False):
+            data = build_joker(16, with_alpha)
+            result = self.probe("texture.png", data)
+            self.assertEqual(result.format, inc_smon_probe.PROBE_FORMAT_JOKER)
+            textures = []
+            fmt_smon_joker.load_joker_file(data, textures, combine_alpha=0)
+            self.assertEqual(result.num_textures, len(textures))
+
+        result = self.probe("texture.png", build_png())
+        self.assertEqual((result.format, result.num_textures), (inc_smon_probe.PROBE_FORMAT_PNG, 1))
+
+    def test_truncated_files_raise(self):
+        dat = build_dat()
+        index = fmt_smon_dat.DatIndex(dat)
+        # The probe skips the vertex data, so the FID file is cut in the texture slots
+        fid = build_fid(2, 30, False, ("tex_a.png",))
+        truncated = {
+            "plm.dat": dat[:index.plm.offset + 10],
+            "texture.dat": dat[:index.textures[-1].offset + 1],
+            "texture.fid": fid[:0x40],
+            "header.pliv": build_plm(8, (10, 20))[:0x10],
+        }
+        for filename, data in truncated.items():
+            with self.assertRaises(Exception, msg=filename):
+                self.probe(filename, data)
+
+    def test_unknown_file(self):
+        result = self.probe("unknown.dat", b"\x00" * 64)
+        self.assertIsNone(result.format)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+"""
+Checks the counts reported by smon_batch.convert_file, and that convert_all recovers from a dead worker process.
+The files are generated by smon_bench.
+
+Usage: python -m unittest test_smon_batch
+"""
+import multiprocessing
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import smon_batch
+from smon_bench import build_dat, build_fid, build_joker, build_plm, build_pmm
+
+
+def crash(filepath):
+    # Kills the worker process like a crash in native code would
+    os._exit(1)
+
+
+class BatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="smon_batch_test_")
+        self.files = {
+            "monster.dat": build_dat("monster", build_pmm(100, 150), build_plm(8, (10, 20))),
+            "monster.pmod": build_pmm(60, 90),
+            "monster.pliv": build_plm(8, (10,)),
+            "terrain.fid": build_fid(3, 30),
+            "texture.png": build_joker(16),
+        }
+        for name, data in self.files.items():
+            self.write(name, data)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def write(self, name, data):
+        with open(self.path(name), "wb") as f:
+            f.write(data)
+
+    def test_vertices_are_counted_from_the_data(self):
+        expected = {
+            "monster.dat": (1, 100),
+            "monster.pmod": (1, 60),
+            "terrain.fid": (3, 90),
+            "texture.png": (0, 0),
+        }
+        for name, (models, vertices) in expected.items():
+            result = smon_batch.convert_file(self.path(name))
+            self.assertEqual(result.status, smon_batch.STATUS_OK, result.error)
+            self.assertEqual((result.stats["models"], result.stats["vertices"]), (models, vertices), name)
+
+    @unittest.skipUnless(multiprocessing.get_start_method() == "fork",
+                         "the worker processes must inherit the patched converters")
+    def test_dead_worker_is_retried_alone(self):
+        self.write("dies.crash", b"")
+        filepaths = smon_batch.find_files(self.directory) + [self.path("dies.crash")]
+        pools = []
+
+        def convert_pool(pending, *args):
+            # The pending files are consumed by the pool, so they are copied before
+            pools.append(list(pending))
+            return original_convert_pool(pending, *args)
+
+        original_convert_pool = smon_batch.convert_pool
+        converters = dict(smon_batch.CONVERTERS, **{".crash": (lambda head: 1, crash)})
+        with mock.patch.object(smon_batch, "CONVERTERS", converters), \
+                mock.patch.object(smon_batch, "convert_pool", convert_pool):
+            results = smon_batch.convert_all(filepaths, jobs=2)
+
+        self.assertEqual([r.filepath for r in results], sorted(filepaths))
+        statuses = {os.path.basename(r.filepath): r.status for r in results}
+        self.assertEqual(statuses.pop("dies.crash"), smon_batch.STATUS_FAILED)
+        self.assertEqual(set(statuses.values()), {smon_batch.STATUS_OK})
+        self.assertIn("Worker process died", [r for r in results if r.filepath.endswith(".crash")][0].error)
+
+        # Every file left in the broken pool is converted again in a pool of its own
+        self.assertEqual(pools[0], filepaths)
+        self.assertIn([self.path("dies.crash")], pools[1:])
+        self.assertTrue(all(len(pending) == 1 for pending in pools[1:]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,108 @@
+"""
+Checks that AssetCatalog.scan only probes the files that were added or changed since the last scan.
+The files are generated by smon_bench.
+
+Usage: python -m unittest test_smon_catalog
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import smon_catalog
+from smon_bench import build_dat, build_fid, build_joker, build_plm, build_pmm
+
+
+class AssetCatalogTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="smon_catalog_test_")
+        self.root = os.path.join(self.directory, "assets")
+        os.makedirs(os.path.join(self.root, "monster"))
+        self.files = {
+            "monster/monster.dat": build_dat(),
+            "monster/monster.pmod": build_pmm(100, 150),
+            "monster/monster.pliv": build_plm(8, (10, 20)),
+            "monster/monster.png": build_joker(16),
+            "terrain.fid": build_fid(2, 30, False, ("tex_a.png",)),
+        }
+        for name, data in self.files.items():
+            self.write(name, data)
+        # Not catalogued
+        self.write("readme.txt", b"")
+        self.catalog = smon_catalog.AssetCatalog(os.path.join(self.directory, "catalog.sqlite"))
+
+    def tearDown(self):
+        self.catalog.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def path(self, name):
+        return smon_catalog._normalize(os.path.join(self.root, name))
+
+    def write(self, name, data):
+        with open(os.path.join(self.root, name), "wb") as f:
+            f.write(data)
+
+    def scan(self):
+        # Returns the scan result and the paths that were probed
+        with mock.patch.object(smon_catalog, "probe_file", wraps=smon_catalog.probe_file) as probe_file:
+            result = self.catalog.scan(self.root)
+        return result, sorted(call.args[0] for call in probe_file.call_args_list)
+
+    def assertCounts(self, result, added=0, updated=0, removed=0, unchanged=0, failed=0):
+        self.assertEqual((result.added, result.updated, result.removed, result.unchanged, result.failed),
+                         (added, updated, removed, unchanged, failed))
+
+    def test_rescan_only_probes_changed_files(self):
+        result, probed = self.scan()
+        self.assertCounts(result, added=len(self.files))
+        self.assertEqual(probed, sorted(self.path(name) for name in self.files))
+
+        result, probed = self.scan()
+        self.assertCounts(result, unchanged=len(self.files))
+        self.assertEqual(probed, [])
+
+        # Touched: same size, later modification time
+        stat = os.stat(os.path.join(self.root, "monster/monster.pliv"))
+        os.utime(os.path.join(self.root, "monster/monster.pliv"), ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        result, probed = self.scan()
+        self.assertCounts(result, updated=1, unchanged=len(self.files) - 1)
+        self.assertEqual(probed, [self.path("monster/monster.pliv")])
+
+        # Changed: different size, read again from the new contents
+        self.write("monster/monster.dat", build_dat("other_mdl", build_pmm(60, 90), build_plm(4, (5,))))
+        result, probed = self.scan()
+        self.assertCounts(result, updated=1, unchanged=len(self.files) - 1)
+        self.assertEqual(probed, [self.path("monster/monster.dat")])
+        row = self.catalog.get(os.path.join(self.root, "monster/monster.dat"))
+        self.assertEqual((row["name"], row["num_vertices"], row["num_bones"]), ("other_mdl", 60, 4))
+
+    def test_added_removed_and_failed_files(self):
+        self.scan()
+        os.remove(os.path.join(self.root, "terrain.fid"))
+        self.write("monster/truncated.dat", build_dat()[:100])
+        result, probed = self.scan()
+        self.assertCounts(result, added=1, removed=1, unchanged=len(self.files) - 1, failed=1)
+        self.assertEqual(probed, [self.path("monster/truncated.dat")])
+
+        self.assertFalse(self.catalog.isfile(os.path.join(self.root, "terrain.fid")))
+        self.assertEqual(self.catalog.find_textures(path=os.path.join(self.root, "terrain.fid")), [])
+        row = self.catalog.get(os.path.join(self.root, "monster/truncated.dat"))
+        self.assertIsNone(row["format"])
+        self.assertIn("Unexpected end of file", row["error"])
+
+    def test_queries(self):
+        self.scan()
+        self.assertEqual([row["path"] for row in self.catalog.find(format="dat")],
+                         [self.path("monster/monster.dat")])
+        self.assertEqual([row["texture_name"] for row in self.catalog.find_textures(texture_name="tex_a.png")],
+                         ["tex_a.png"])
+        self.assertEqual(self.catalog.guess_texture_file(os.path.join(self.root, "monster/monster.pmod")),
+                         self.path("monster/monster.png"))
+        with self.assertRaises(Exception):
+            self.catalog.find(unknown=1)
+
+
+if __name__ == "__main__":
+    unittest.main()